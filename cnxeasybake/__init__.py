@@ -6,8 +6,32 @@
 # See LICENCE.txt for details.
 # ###
 """Implements baking in a subset of CSS3 content spec into HTML."""
-from .oven import Oven  # noqa
+import sys
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+__all__ = ['Oven', '__version__']
+
+
+def _get_version():
+    from ._version import get_versions
+    return get_versions()['version']
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        """Import the oven and look up the version on first use (PEP 562).
+
+        Keeps `import cnxeasybake` cheap for callers, like the cli's
+        --help, that need neither.
+        """
+        if name == 'Oven':
+            from .oven import Oven as value
+        elif name == '__version__':
+            value = _get_version()
+        else:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(
+                __name__, name))
+        globals()[name] = value
+        return value
+else:
+    from .oven import Oven  # noqa
+    __version__ = _get_version()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Bake from asyncio code without blocking the event loop (Python 3 only).
+
+Parsing, baking and serialization run in a thread pool. Cancelling the
+awaiting task stops the bake before its next pass, and a semaphore bounds
+how many bakes run at the same time; the rest wait their turn on the loop.
+
+Example::
+
+    from cnxeasybake.aio import bake_async
+
+    baked = await bake_async('recipe.css', 'raw.html')
+    await bake_async(oven, raw_bytes, 'baked.html')
+"""
+import asyncio
+import multiprocessing
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from .oven import Oven
+
+__all__ = ['AsyncBaker', 'BakeCancelled', 'bake_async']
+
+
+class BakeCancelled(Exception):
+    """Raised in the baking thread when the awaiting task was cancelled."""
+
+
+def _parse(source, parser=None):
+    """Return source, a path, bytes, file object or tree, as a tree.
+
+    Paths, bytes and file objects are parsed with parser, by default the
+    one of files.make_parser() for the current thread.
+    """
+    from lxml import etree
+    from .files import read_html
+    if isinstance(source, bytes):
+        return read_html(BytesIO(source), parser)
+    if etree.iselement(source):
+        return source.getroottree()
+    if isinstance(source, etree._ElementTree):
+        return source
+    return read_html(source, parser)
+
+
+def _serialize(tree, sink):
+    """Write tree to sink, a path or binary file, or return it as bytes."""
+    from lxml import etree
+    from .files import write_bytes
+    data = etree.tostring(tree, method='xml')
+    if sink is None:
+        return data
+    write_bytes(data, sink)
+
+
+class AsyncBaker(object):
+    """Run bakes for asyncio code, at most max_concurrency at a time."""
+
+    def __init__(self, max_concurrency=None, executor=None, parser=None):
+        """Bake in executor, by default a pool of max_concurrency threads.
+
+        Sources are parsed with a copy of parser, see files.make_parser,
+        so that bakes in different threads do not wait for each other.
+        """
+        self.parser = parser
+        self.max_concurrency = max_concurrency or multiprocessing.cpu_count()
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(self.max_concurrency)
+        # asyncio primitives belong to one event loop, keep them per loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _bake(self, oven, source, sink, last_step, cancelled):
+        """Parse, bake and serialize, in an executor thread."""
+        def before_step(step):
+            if cancelled.is_set():
+                raise BakeCancelled(step)
+
+        if not isinstance(oven, Oven):
+            oven = Oven(oven)
+        parser = self.parser
+        tree = _parse(source, parser.copy() if parser is not None else None)
+        oven.bake(tree, last_step, before_step)
+        if cancelled.is_set():
+            raise BakeCancelled(None)
+        return _serialize(tree, sink)
+
+    async def bake(self, recipe, source, sink=None, last_step=None):
+        """Bake source with recipe and write the result to sink.
+
+        recipe is an Oven or anything an Oven accepts as CSS, it is parsed
+        for this bake only. source is a path, file object, bytes or lxml
+        tree; sink a path or binary file object. With no sink, the baked
+        document is returned as bytes.
+        """
+        loop = asyncio.get_event_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+
+        async with semaphore:
+            cancelled = threading.Event()
+            future = loop.run_in_executor(
+                self.executor, self._bake, recipe, source, sink, last_step,
+                cancelled)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Stop at the next pass, and keep the slot until then
+                cancelled.set()
+                try:
+                    await future
+                except BakeCancelled:
+                    pass
+                raise
+
+    def close(self):
+        """Shut down the executor, if the baker created it."""
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+
+_default_baker = None
+
+
+async def bake_async(recipe, source, sink=None, last_step=None):
+    """Bake with a shared AsyncBaker, one bake per CPU at a time.
+
+    See AsyncBaker.bake for the arguments.
+    """
+    global _default_baker
+    if _default_baker is None:
+        _default_baker = AsyncBaker()
+    return await _default_baker.bake(recipe, source, sink, last_step)
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Find what the passes of a recipe read and write, without baking.
+
+For each pass, the declarations of its rules tell which counters it resets,
+increments and reads, which strings it sets and reads and which pending
+buckets it fills (``move-to``, ``copy-to``, ``node-set``) and drains
+(``pending()``, ``nodes()``, ``clear()``). A later pass depends on an
+earlier one when it reads a counter or string the earlier pass writes, or
+when both use the same bucket: ``counter()``, ``string()`` and bucket
+lookups fall back to the stores of earlier passes.
+
+Adjacent passes can share one walk of the document (see fusion_groups)
+when all but the last of them only set attributes and variables, and none
+of the later ones reads what the earlier ones write.
+
+The same declarations find dead parts of a recipe (see lint): rules of
+passes not baked, buckets drained but never filled or filled but never
+drained, and declarations the oven has no method for.
+"""
+from collections import OrderedDict
+
+import cssselect2
+from cssselect2.extensions import extensions
+from cssselect2.parser import parse
+from tinycss2 import ast, serialize
+
+from .oven import split
+
+# Keys of the name sets in a usage dict, in report order
+USAGE_SETS = ('counters_reset', 'counters_incremented', 'counters_read',
+              'strings_set', 'strings_read', 'buckets_filled',
+              'buckets_drained', 'attributes_set', 'attributes_read')
+# Keys of the flags in a usage dict
+USAGE_FLAGS = ('targets', 'uuid', 'moves', 'copies')
+
+# Declarations that only set attributes or variables of matched elements
+ATTRIBUTE_DECLARATIONS = ('class', 'counter-reset', 'counter-increment',
+                          'string-set')
+
+# Declarations putting the matched element in a bucket
+FILLING_DECLARATIONS = ('move-to', 'copy-to', 'node-set')
+# Functions taking the items out of a bucket
+DRAINING_FUNCTIONS = ('pending', 'nodes', 'clear')
+
+# Attributes the bake reads from every element: ids for target-*()
+# references and languages for sorting and grouping
+ALWAYS_READ = ('id', 'lang', 'xml:lang')
+
+
+def _functions(tokens):
+    """Yield the function blocks in tokens, nested ones included."""
+    for token in tokens:
+        if type(token) is ast.FunctionBlock:
+            yield token
+            for function in _functions(token.arguments):
+                yield function
+
+
+def _argument(tokens, index=0):
+    """Return a name given as argument of a function, or None."""
+    arguments = split(tokens, ',')
+    if len(arguments) <= index:
+        return None
+    return serialize(arguments[index]).strip(u' "\'')
+
+
+def empty_usage():
+    """Return a usage dict of a pass doing nothing, see rule_usage."""
+    usage = dict((key, set()) for key in USAGE_SETS)
+    usage.update((key, False) for key in USAGE_FLAGS)
+    return usage
+
+
+def rule_usage(declarations):
+    """Return what a rule's declarations do with variables and buckets.
+
+    A dict of sets of counters ``reset``, ``incremented`` and ``read``,
+    strings ``set`` and ``read``, buckets ``filled`` and ``drained`` and
+    attributes ``set`` and ``read`` (by attr()), with the flags
+    ``targets`` (target-*() references), ``uuid``, ``moves`` (the matched
+    element is moved or copied) and ``copies`` (content() copies the
+    matched element while matching). Counters and strings read through
+    target-counter() and target-string() count as read.
+    """
+    usage = empty_usage()
+    for decl in declarations:
+        if decl.name == 'class':
+            usage['attributes_set'].add('class')
+        elif decl.name.startswith('attr-'):
+            usage['attributes_set'].add(decl.name[5:].lower())
+        elif decl.name.startswith('data-'):
+            usage['attributes_set'].add(decl.name.lower())
+        elif decl.name in ('counter-reset', 'counter-increment'):
+            key = ('counters_reset' if decl.name == 'counter-reset'
+                   else 'counters_incremented')
+            usage[key].update(term.value for term in decl.value
+                              if type(term) is ast.IdentToken)
+        elif decl.name == 'string-set':
+            for string in split(decl.value, ','):
+                idents = [term.value for term in string
+                          if type(term) is ast.IdentToken]
+                if idents:
+                    usage['strings_set'].add(idents[0])
+        elif decl.name in FILLING_DECLARATIONS:
+            usage['buckets_filled'].add(serialize(decl.value).strip())
+            usage['moves'] = True
+        for function in _functions(decl.value):
+            if function.name in ('counter', 'string'):
+                name = _argument(function.arguments)
+                if name is not None:
+                    usage[function.name + 's_read'].add(name)
+            elif function.name in DRAINING_FUNCTIONS:
+                usage['buckets_drained'].add(
+                    serialize(function.arguments).strip())
+            elif function.name.startswith('target-'):
+                usage['targets'] = True
+                name = _argument(function.arguments, 1)
+                if name is not None:
+                    key = function.name[7:] + 's_read'
+                    if key in usage:
+                        usage[key].add(name)
+            elif function.name == 'uuid':
+                usage['uuid'] = True
+            elif function.name == 'attr':
+                name = _argument(function.arguments)
+                if name is not None:
+                    usage['attributes_read'].add(name.lower())
+            elif function.name == 'content' and decl.name == 'content':
+                usage['copies'] = True
+    return usage
+
+
+def _selector_attributes(selector):
+    """Yield the attributes a parsed selector tests."""
+    if isinstance(selector, cssselect2.parser.AttributeSelector):
+        yield selector.lower_name
+    elif isinstance(selector, cssselect2.parser.ClassSelector):
+        yield 'class'
+    elif isinstance(selector, cssselect2.parser.IDSelector):
+        yield 'id'
+    for name in ('left', 'right', 'parsed_tree'):
+        if hasattr(selector, name):
+            for attribute in _selector_attributes(getattr(selector, name)):
+                yield attribute
+    for sub_selector in getattr(selector, 'simple_selectors', ()):
+        for attribute in _selector_attributes(sub_selector):
+            yield attribute
+
+
+def selector_attributes(selector, namespaces=None):
+    """Return the attributes tested by a selector, given as text."""
+    attributes = set()
+    for parsed in parse(selector, namespaces, extensions):
+        attributes.update(_selector_attributes(parsed))
+    return attributes
+
+
+def merge_usage(total, usage):
+    """Add usage to the usage dict total, and return total."""
+    for key in USAGE_SETS:
+        total[key] |= usage[key]
+    for key in USAGE_FLAGS:
+        total[key] = total[key] or usage[key]
+    return total
+
+
+def pass_usage(oven, step):
+    """Return the usage of all rules of a pass, see rule_usage.
+
+    The attributes tested by the selectors of the pass count as read.
+    """
+    total = empty_usage()
+    for (_, selector), declarations, _ in oven.rules[step]:
+        merge_usage(total, rule_usage(declarations))
+        try:
+            total['attributes_read'] |= selector_attributes(
+                selector, oven.css_namespaces)
+        except cssselect2.SelectorError:
+            # Part of the selector list is invalid, assume it reads all
+            total['attributes_read'].add('*')
+    return total
+
+
+def attribute_only(oven, step):
+    """Return whether a pass only sets attributes and variables.
+
+    Such a pass has no pseudo-element rules and does not change the tree
+    in any other way, so a later pass can match against the tree as it was
+    before this one.
+    """
+    for _, declarations, label in oven.rules[step]:
+        if label not in (None, 'deferred'):
+            return False
+        for decl in declarations:
+            if not (decl.name in ATTRIBUTE_DECLARATIONS or
+                    decl.name.startswith('attr-') or
+                    decl.name.startswith('data-')):
+                return False
+    return True
+
+
+def _fusable(oven, usages, group, step):
+    """Return whether step can share the walk of the passes in group."""
+    if not attribute_only(oven, group[-1]):
+        return False
+    later = usages[step]
+    read = later['attributes_read'] | set(ALWAYS_READ)
+    for earlier in group:
+        usage = usages[earlier]
+        if not independent(usages, earlier, step):
+            return False
+        if usage['attributes_set'] and (usage['attributes_set'] & read or
+                                        '*' in read):
+            return False
+        if usage['attributes_set'] and later['copies']:
+            return False
+        if oven.use_repeatable_ids and usage['uuid'] and later['uuid']:
+            return False
+    return True
+
+
+def fusion_groups(oven, usages=None):
+    """Split the passes of the oven into groups baked in one walk each.
+
+    Returns a list of tuples of pass names, in pass order. Matching all
+    passes of a group against the tree before any of them is applied
+    gives the same result as baking them one after the other.
+    """
+    if usages is None:
+        usages = analyze(oven)
+    groups = []
+    for step in oven.steps:
+        if groups and _fusable(oven, usages, groups[-1], step):
+            groups[-1].append(step)
+        else:
+            groups.append([step])
+    return [tuple(group) for group in groups]
+
+
+def analyze(oven):
+    """Return the usage of each pass of the oven's recipe, in pass order."""
+    return OrderedDict((step, pass_usage(oven, step)) for step in oven.steps)
+
+
+def names(usage):
+    """Return the (kind, name) of the counters, strings and buckets used."""
+    return (set(('counter', name) for name in
+                usage['counters_reset'] | usage['counters_incremented'] |
+                usage['counters_read']) |
+            set(('string', name) for name in
+                usage['strings_set'] | usage['strings_read']) |
+            set(('bucket', name) for name in
+                usage['buckets_filled'] | usage['buckets_drained']))
+
+
+def _depends(earlier, later):
+    """Yield the (kind, name) that make pass usage later need earlier."""
+    written = earlier['counters_reset'] | earlier['counters_incremented']
+    for name in sorted(written & later['counters_read']):
+        yield 'counter', name
+    for name in sorted(earlier['strings_set'] & later['strings_read']):
+        yield 'string', name
+    buckets = earlier['buckets_filled'] | earlier['buckets_drained']
+    for name in sorted(buckets & (later['buckets_filled'] |
+                                  later['buckets_drained'])):
+        yield 'bucket', name
+
+
+def dependencies(usages):
+    """Return the edges of the dependency graph of the passes.
+
+    usages is the result of analyze. Each edge is a tuple ``(earlier pass,
+    later pass, kind, name)``: the later pass reads the counter or string
+    written by the earlier one, or uses the same bucket.
+    """
+    steps = list(usages)
+    edges = []
+    for position, earlier in enumerate(steps):
+        for later in steps[position + 1:]:
+            for kind, name in _depends(usages[earlier], usages[later]):
+                edges.append((earlier, later, kind, name))
+    return edges
+
+
+def independent(usages, first, second):
+    """Return whether two passes share no counter, string or bucket."""
+    return not (names(usages[first]) & names(usages[second]))
+
+
+def to_json(usages, groups=None):
+    """Return the analysis as a JSON serializable dict.
+
+    With the fusion_groups, also list the passes fused into one walk.
+    """
+    data = {
+        'passes': OrderedDict(
+            (step, dict((key, sorted(value)) if key in USAGE_SETS
+                        else (key, value) for key, value in usage.items()))
+            for step, usage in usages.items()),
+        'dependencies': [
+            {'from': earlier, 'to': later, 'kind': kind, 'name': name}
+            for earlier, later, kind, name in dependencies(usages)],
+    }
+    if groups is not None:
+        data['fused'] = [list(group) for group in groups if len(group) > 1]
+    return data
+
+
+def format_report(usages, groups=None):
+    """Return the analysis as plain text, see to_json."""
+    lines = []
+    for step, usage in usages.items():
+        lines.append(u'pass {}'.format(step))
+        for key in USAGE_SETS:
+            if usage[key]:
+                lines.append(u'  {:<22}{}'.format(
+                    key.replace('_', ' '), u', '.join(sorted(usage[key]))))
+        flags = [key for key in USAGE_FLAGS if usage[key]]
+        if flags:
+            lines.append(u'  {:<22}{}'.format('uses', u', '.join(flags)))
+    lines.append(u'dependencies')
+    edges = dependencies(usages)
+    for earlier, later, kind, name in edges:
+        lines.append(u'  {} -> {}: {} {}'.format(earlier, later, kind, name))
+    if not edges:
+        lines.append(u'  none')
+    if groups is not None:
+        lines.append(u'fused passes')
+        fused = [group for group in groups if len(group) > 1]
+        for group in fused:
+            lines.append(u'  ' + u', '.join(group))
+        if not fused:
+            lines.append(u'  none')
+    return u'\n'.join(lines)
+
+
+def _bucket_uses(declarations):
+    """Yield (line, name, bucket) for the buckets declarations use.
+
+    name is that of the declaration filling the bucket, move-to, copy-to
+    or node-set, or of the function draining it, pending, nodes or clear.
+    """
+    for decl in declarations:
+        if decl.name in FILLING_DECLARATIONS:
+            yield decl.source_line, decl.name, serialize(decl.value).strip()
+        for function in _functions(decl.value):
+            if function.name in DRAINING_FUNCTIONS:
+                yield (decl.source_line, function.name,
+                       serialize(function.arguments).strip())
+
+
+def known_declaration(oven, name):
+    """Return whether the oven has a method for the declaration name."""
+    return (name.startswith('data-') or name.startswith('attr-') or
+            hasattr(oven, 'do_' + name.replace('-', '_')))
+
+
+def lint(oven, last_step=None):
+    """Return the dead rules and declarations of the oven's recipe.
+
+    Each problem is a tuple ``(line, message)``, in line order: rules of
+    passes not baked when stopping before last_step, buckets drained
+    before any pass fills them, buckets filled and never drained by the
+    same or a later pass, and declarations the oven ignores, having no
+    method for them. Nothing is baked.
+    """
+    baked = oven.steps_before(last_step)
+    problems = set()
+    for step in oven.steps:
+        if step not in baked:
+            for (line, selector), _, _ in oven.rules[step]:
+                problems.add((line, u'{} is in pass {}, not baked'.format(
+                    selector.strip(), step)))
+
+    uses = dict((step, list(_bucket_uses(
+        decl for _, declarations, _ in oven.rules[step]
+        for decl in declarations))) for step in baked)
+    filled = set()
+    for step in baked:
+        filled.update(bucket for _, name, bucket in uses[step]
+                      if name in FILLING_DECLARATIONS)
+        for line, name, bucket in uses[step]:
+            if name in DRAINING_FUNCTIONS and bucket not in filled:
+                problems.add((line, u'{}({}) drains a bucket no pass fills'
+                              .format(name, bucket)))
+    drained = set()
+    for step in reversed(baked):
+        drained.update(bucket for _, name, bucket in uses[step]
+                       if name in DRAINING_FUNCTIONS)
+        for line, name, bucket in uses[step]:
+            if name in FILLING_DECLARATIONS and bucket not in drained:
+                problems.add((line, u'{}: {} fills a bucket no pass drains'
+                              .format(name, bucket)))
+
+    for step in baked:
+        for _, declarations, _ in oven.rules[step]:
+            for decl in declarations:
+                if not known_declaration(oven, decl.name):
+                    problems.add((decl.source_line,
+                                  u'unknown declaration {} is ignored'
+                                  .format(decl.name)))
+    return sorted(problems)
+
+
+def format_lint(problems):
+    """Return the problems found by lint as plain text, one per line."""
+    return u'\n'.join(u'line {}: {}'.format(line, message)
+                      for line, message in problems)
@@ -0,0 +1,6 @@
+"""Run the benchmarks with ``python -m cnxeasybake.benchmarks``."""
+import sys
+
+from cnxeasybake.benchmarks.run import main
+
+sys.exit(main(sys.argv[1:]))
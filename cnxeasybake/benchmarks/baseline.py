@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Persist benchmark results and compare them against a saved baseline.
+
+A results file is JSON holding the environment the benchmarks ran in
+(machine fingerprint and library versions), the parameters of the synthetic
+book and the per-scenario results, median timings included.
+"""
+import hashlib
+import json
+import multiprocessing
+import platform
+
+FORMAT_VERSION = 1
+
+# Result keys compared against the baseline, lower is better for all
+METRICS = ('bake', 'peak_rss')
+
+
+def machine():
+    """Return a description of the machine the benchmarks run on."""
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = None
+    info = {
+        'node': platform.node(),
+        'system': platform.system(),
+        'release': platform.release(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': cpus,
+    }
+    digest = hashlib.sha1(json.dumps(info, sort_keys=True).encode('utf-8'))
+    info['fingerprint'] = digest.hexdigest()[:16]
+    return info
+
+
+def versions():
+    """Return the versions of Python and the libraries baking depends on."""
+    from lxml import etree
+    import cssselect2
+    import icu
+    import tinycss2
+    from cnxeasybake import __version__
+
+    def dotted(version):
+        return '.'.join(str(v) for v in version)
+
+    return {
+        'python': platform.python_version(),
+        'python_implementation': platform.python_implementation(),
+        'cnx-easybake': __version__,
+        'lxml': dotted(etree.LXML_VERSION),
+        'libxml2': dotted(etree.LIBXML_VERSION),
+        'libxslt': dotted(etree.LIBXSLT_VERSION),
+        'icu': icu.ICU_VERSION,
+        'pyicu': icu.VERSION,
+        'tinycss2': getattr(tinycss2, 'VERSION', None),
+        'cssselect2': getattr(cssselect2, 'VERSION', None),
+    }
+
+
+def build_report(results, book):
+    """Return the JSON serializable report of a benchmark run."""
+    return {
+        'format': FORMAT_VERSION,
+        'machine': machine(),
+        'versions': versions(),
+        'book': book,
+        'scenarios': dict((result['scenario'], result)
+                          for result in results),
+    }
+
+
+def save_report(report, fp):
+    """Write report as JSON to the open text file fp."""
+    json.dump(report, fp, indent=2, sort_keys=True)
+    fp.write('\n')
+
+
+def load_report(fp):
+    """Read a report written by save_report from the open file fp."""
+    report = json.load(fp)
+    if report.get('format') != FORMAT_VERSION:
+        raise ValueError(u'Unsupported benchmark results format: {}'.format(
+            report.get('format')))
+    return report
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare the scenarios of two reports.
+
+    Returns a list of ``(scenario, metric, baseline value, current value,
+    relative change, regressed)`` tuples, one per metric present in both
+    reports. A metric regressed if it grew by more than threshold, a
+    fraction of the baseline value.
+    """
+    rows = []
+    for name in sorted(current['scenarios']):
+        if name not in baseline['scenarios']:
+            continue
+        old = baseline['scenarios'][name]
+        new = current['scenarios'][name]
+        for metric in METRICS:
+            if not old.get(metric) or new.get(metric) is None:
+                continue
+            change = (new[metric] - old[metric]) / float(old[metric])
+            rows.append((name, metric, old[metric], new[metric], change,
+                         change > threshold))
+    return rows
+
+
+def mismatches(baseline, current):
+    """Return descriptions of how the two runs are not comparable."""
+    found = []
+    if baseline['book'] != current['book']:
+        found.append(u'book parameters differ: {} != {}'.format(
+            baseline['book'], current['book']))
+    if (baseline['machine']['fingerprint'] !=
+            current['machine']['fingerprint']):
+        found.append(u'machine differs: {} != {}'.format(
+            baseline['machine']['fingerprint'],
+            current['machine']['fingerprint']))
+    for name in sorted(set(baseline['versions']) | set(current['versions'])):
+        old = baseline['versions'].get(name)
+        new = current['versions'].get(name)
+        if old != new:
+            found.append(u'{} version differs: {} != {}'.format(
+                name, old, new))
+    return found
+
+
+def format_comparison(rows, threshold):
+    """Return the comparison rows as a plain text table."""
+    lines = [u'{:<22}{:>10}{:>14}{:>14}{:>10}'.format(
+        'scenario', 'metric', 'baseline', 'current', 'change')]
+    for name, metric, old, new, change, regressed in rows:
+        lines.append(u'{:<22}{:>10}{:>14.4g}{:>14.4g}{:>+9.1%}{}'.format(
+            name, metric, old, new, change,
+            u' REGRESSED' if regressed else u''))
+    regressions = sum(1 for row in rows if row[-1])
+    lines.append(u'{} regression(s) past the {:.0%} threshold'.format(
+        regressions, threshold))
+    return u'\n'.join(lines)
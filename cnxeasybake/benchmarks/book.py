@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Generate synthetic, textbook-shaped XHTML for benchmarking.
+
+The generated book mimics the structure of a raw cnx book: chapters made of
+pages (sections), each page holding a title, paragraphs with glossary terms,
+figures, key-term definition lists, exercises with solutions, a summary and
+cross-references (``<a class="xref">``) to figures and exercises elsewhere in
+the book. Output is deterministic for a given seed.
+"""
+import random
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+DEFAULT_SIZES = {
+    'chapters': 10,
+    'sections': 5,
+    'figures': 2,
+    'exercises': 3,
+    'terms': 5,
+    'xrefs': 3,
+}
+
+WORDS = [
+    u'absorption', u'acceleration', u'amplitude', u'atom', u'balance',
+    u'buoyancy', u'capacitor', u'catalyst', u'circuit', u'density',
+    u'diffusion', u'electron', u'energy', u'entropy', u'equilibrium',
+    u'force', u'friction', u'frequency', u'gravity', u'gradient',
+    u'half-life', u'heat', u'impulse', u'inertia', u'isotope', u'joule',
+    u'kinetics', u'lattice', u'lever', u'magnetism', u'mass', u'molecule',
+    u'momentum', u'neutron', u'nucleus', u'orbital', u'oscillation',
+    u'photon', u'pressure', u'proton', u'quantum', u'radiation',
+    u'reaction', u'resistance', u'solution', u'spectrum', u'torque',
+    u'ultraviolet', u'vector', u'velocity', u'voltage', u'wavelength',
+    u'work', u'x-ray', u'yield', u'zenith', u'éther', u'ångström',
+    u'ćwiczenie', u'über-field',
+]
+
+FILLER = (u'Some text about the subject that pads the paragraph to a '
+          u'realistic length, as authors tend to write a lot.')
+
+HEADER = (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+          u'<html xmlns="http://www.w3.org/1999/xhtml" lang="en">\n'
+          u'<head><title>Synthetic book</title></head>\n'
+          u'<body data-type="book">\n')
+
+FOOTER = u'</body>\n</html>\n'
+
+
+def figure_id(chapter, section, number):
+    return u'fig-{}-{}-{}'.format(chapter, section, number)
+
+
+def exercise_id(chapter, section, number):
+    return u'exercise-{}-{}-{}'.format(chapter, section, number)
+
+
+def _xref(rnd, sizes):
+    """Return a cross-reference to a random figure or exercise."""
+    chapter = rnd.randint(1, sizes['chapters'])
+    section = rnd.randint(1, sizes['sections'])
+    kinds = [k for k in ('figure', 'exercise') if sizes[k + 's'] > 0]
+    if not kinds:
+        return u''
+    kind = rnd.choice(kinds)
+    if kind == 'figure':
+        target = figure_id(chapter, section,
+                           rnd.randint(1, sizes['figures']))
+    else:
+        target = exercise_id(chapter, section,
+                             rnd.randint(1, sizes['exercises']))
+    return u'<a class="xref" data-ref={} href="#{}">{}</a>'.format(
+        quoteattr(kind), target, kind)
+
+
+def _page(rnd, sizes, chapter, section):
+    """Return the markup of one page (section) of a chapter."""
+    prefix = u'{}-{}'.format(chapter, section)
+    out = [u'<div data-type="page" id="page-{}">'.format(prefix),
+           u'<div data-type="document-title">{} {}</div>'.format(
+               rnd.choice(WORDS).capitalize(), prefix)]
+
+    terms = [rnd.choice(WORDS) for _ in range(sizes['terms'])]
+    for number, term in enumerate(terms, 1):
+        out.append(u'<p>{} <span data-type="term" id="term-{}-{}">{}</span> '
+                   u'{}</p>'.format(FILLER, prefix, number, escape(term),
+                                    FILLER))
+    for _ in range(sizes['xrefs']):
+        out.append(u'<p>As shown in {}, {}</p>'.format(
+            _xref(rnd, sizes), FILLER))
+    for number in range(1, sizes['figures'] + 1):
+        out.append(
+            u'<figure id="{}"><span data-type="title">{}</span>'
+            u'<img src="figure-{}-{}.png" alt="figure"/>'
+            u'<figcaption>{}</figcaption></figure>'.format(
+                figure_id(chapter, section, number),
+                rnd.choice(WORDS).capitalize(), prefix, number, FILLER))
+    for term in terms:
+        out.append(u'<dl class="definition"><dt>{}</dt><dd>{}</dd></dl>'
+                   .format(escape(term), FILLER))
+    for number in range(1, sizes['exercises'] + 1):
+        ex_id = exercise_id(chapter, section, number)
+        out.append(
+            u'<div data-type="exercise" id="{0}">'
+            u'<div data-type="problem" id="{0}-problem"><p>{1}</p></div>'
+            u'<div data-type="solution" id="{0}-solution"><p>{1}</p></div>'
+            u'</div>'.format(ex_id, FILLER))
+    out.append(u'<section data-type="summary"><p>{}</p></section>'
+               .format(FILLER))
+    out.append(u'</div>')
+    return u'\n'.join(out)
+
+
+def generate_book(seed=0, **sizes):
+    """Return a synthetic raw book as UTF-8 encoded XHTML bytes.
+
+    Keyword arguments override the per-book and per-page counts in
+    ``DEFAULT_SIZES``: ``chapters`` per book, ``sections`` per chapter and
+    ``figures``, ``exercises``, ``terms`` and ``xrefs`` per section.
+    """
+    unknown = set(sizes) - set(DEFAULT_SIZES)
+    if unknown:
+        raise TypeError(u'Unknown book sizes: {}'.format(
+            u', '.join(sorted(unknown))))
+    merged = dict(DEFAULT_SIZES)
+    merged.update(sizes)
+    rnd = random.Random(seed)
+
+    out = [HEADER]
+    for chapter in range(1, merged['chapters'] + 1):
+        out.append(u'<div data-type="chapter" id="chapter-{}">\n'
+                   u'<h1 data-type="document-title">{}</h1>\n'.format(
+                       chapter, rnd.choice(WORDS).capitalize()))
+        for section in range(1, merged['sections'] + 1):
+            out.append(_page(rnd, merged, chapter, section))
+            out.append(u'\n')
+        out.append(u'</div>\n')
+    out.append(FOOTER)
+    return u''.join(out).encode('utf-8')
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Measure module import times with ``python -X importtime``."""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+
+here = os.path.abspath(os.path.dirname(__file__))
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(here))
+
+STATEMENTS = ('import cnxeasybake',
+              'import cnxeasybake.scripts.main',
+              'import cnxeasybake.oven')
+
+
+def import_times(statement, python=sys.executable):
+    """Run statement in a fresh interpreter and return its import times.
+
+    Returns an ordered dict mapping each module imported, in import order,
+    to a tuple of its own and its cumulative import time in microseconds.
+    Needs Python 3.7 or later.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [PACKAGE_ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.Popen([python, '-X', 'importtime', '-c', statement],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env)
+    _, err = proc.communicate()
+    err = err.decode('utf-8')
+    if proc.returncode:
+        raise RuntimeError(u'{!r} failed:\n{}'.format(statement, err))
+    times = OrderedDict()
+    for line in err.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+        except ValueError:  # The column header
+            continue
+    return times
+
+
+def main(argv=None):
+    """Print the slowest imports of each of the statements."""
+    for statement in (argv or STATEMENTS):
+        times = import_times(statement)
+        total = sum(own for own, _ in times.values())
+        print(u'{}: {} modules, {:.1f} ms'.format(statement, len(times),
+                                                  total / 1000.0))
+        slowest = sorted(times.items(), key=lambda item: -item[1][1])[:10]
+        for name, (own, cumulative) in slowest:
+            print(u'  {:<40}{:>10.1f}{:>10.1f}'.format(
+                name, own / 1000.0, cumulative / 1000.0))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Time Oven.lookup of counters and strings, after a counter-heavy bake."""
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+from timeit import default_timer as timer
+
+from lxml import etree
+
+from cnxeasybake.oven import Oven
+from cnxeasybake.benchmarks.book import exercise_id, generate_book
+from cnxeasybake.benchmarks.run import SCENARIOS
+
+logger = logging.getLogger('cnx-easybake')
+
+# The counter() and target-counter() lookups of the counters recipe
+LOOKUPS = (
+    ('counter', ('counters', ['chapter'])),
+    ('styled counter', ('counters', ['exercise', 'lower-latin'])),
+    ('missing counter', ('counters', ['subsection'])),
+    ('target-counter', ('counters', ('exercise', None),
+                        exercise_id(1, 1, 1))),
+    ('string', ('strings', 'title')),
+)
+
+
+def baked_oven(html, scenario='counters'):
+    """Return an oven that baked html with the recipe of scenario."""
+    with open(SCENARIOS[scenario], 'rb') as f:
+        css = f.read()
+    oven = Oven(css + b'h1 { string-set: title content(); }')
+    old_level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        oven.bake(etree.XML(html))
+    finally:
+        logger.setLevel(old_level)
+    return oven
+
+
+def time_lookups(oven, number=100000):
+    """Return (name, microseconds per lookup) for each of the LOOKUPS."""
+    results = []
+    lookup = oven.lookup
+    for name, args in LOOKUPS:
+        start = timer()
+        for _ in range(number):
+            lookup(*args)
+        results.append((name, (timer() - start) / number * 1e6))
+    return results
+
+
+def main(argv=None):
+    """Print the time of each kind of lookup."""
+    parser = argparse.ArgumentParser(description="Time counter and string "
+                                                 "lookups")
+    parser.add_argument('--chapters', type=int, default=10,
+                        help='number of chapters (default 10)')
+    parser.add_argument('-n', '--number', type=int, default=100000,
+                        help='lookups of each kind (default 100000)')
+    args = parser.parse_args(argv)
+
+    oven = baked_oven(generate_book(chapters=args.chapters))
+    for name, micros in time_lookups(oven, args.number):
+        print(u'{:<20}{:>8.3f} us'.format(name, micros))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
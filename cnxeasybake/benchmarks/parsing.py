@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Compare parse and bake times of a synthetic book across parser options."""
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from lxml import etree
+
+from cnxeasybake.oven import Oven
+from cnxeasybake.files import make_parser
+from cnxeasybake.benchmarks.book import generate_book
+from cnxeasybake.benchmarks.run import SCENARIOS, median
+
+logger = logging.getLogger('cnx-easybake')
+
+PARSERS = OrderedDict([
+    ('default', lambda: etree.XMLParser()),
+    ('tuned', lambda: make_parser(huge_tree=True)),
+    ('no blank text', lambda: make_parser(huge_tree=True,
+                                          remove_blank_text=True)),
+])
+
+
+def text_nodes(element):
+    """Return the number of text and tail nodes under element."""
+    return sum((node.text is not None) + (node.tail is not None)
+               for node in element.iter())
+
+
+def parse_and_bake(css, html, parser):
+    """Parse html with parser and bake it with css once.
+
+    Returns a dict of the seconds spent parsing and baking, and of the
+    number of text nodes the passes walked.
+    """
+    start = timer()
+    element = etree.fromstring(html, parser)
+    parsed = timer()
+    texts = text_nodes(element)
+    oven = Oven(css)
+    parsed_css = timer()
+    oven.bake(element)
+    return {'parse': parsed - start,
+            'bake': timer() - parsed_css,
+            'texts': texts}
+
+
+def compare_parsers(html, scenario='counters', repeat=3):
+    """Bake html with the recipe of scenario, with each of the PARSERS.
+
+    Returns a list of result dicts, in the order of PARSERS, with the
+    median parse and bake times.
+    """
+    with open(SCENARIOS[scenario], 'rb') as f:
+        css = f.read()
+    results = []
+    old_level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        for name, make in PARSERS.items():
+            runs = [parse_and_bake(css, html, make()) for _ in range(repeat)]
+            result = {'parser': name, 'texts': runs[0]['texts']}
+            for phase in ('parse', 'bake'):
+                result[phase] = median([run[phase] for run in runs])
+            results.append(result)
+    finally:
+        logger.setLevel(old_level)
+    return results
+
+
+def format_report(results):
+    """Return the results as a plain text table."""
+    lines = [u'{:<16}{:>12}{:>12}{:>12}'.format(
+        'parser', 'text nodes', 'parse (s)', 'bake (s)')]
+    for result in results:
+        lines.append(u'{:<16}{:>12}{:>12.3f}{:>12.3f}'.format(
+            result['parser'], result['texts'], result['parse'],
+            result['bake']))
+    return u'\n'.join(lines)
+
+
+def main(argv=None):
+    """Print the parse and bake times with each of the parsers."""
+    parser = argparse.ArgumentParser(description="Compare parser options "
+                                                 "on a synthetic book")
+    parser.add_argument('--chapters', type=int, default=20,
+                        help='number of chapters (default 20)')
+    parser.add_argument('--scenario', choices=list(SCENARIOS),
+                        default='counters',
+                        help='recipe to bake with (default counters)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per parser, the median is reported')
+    args = parser.parse_args(argv)
+
+    html = generate_book(chapters=args.chapters)
+    print(format_report(compare_parsers(html, args.scenario, args.repeat)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
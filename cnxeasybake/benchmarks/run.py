@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Bake synthetic books with representative recipes and report throughput."""
+from __future__ import print_function
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from lxml import etree
+
+from cnxeasybake.oven import Oven
+from cnxeasybake.benchmarks.baseline import (build_report, compare,
+                                             format_comparison, load_report,
+                                             mismatches, save_report)
+from cnxeasybake.benchmarks.book import DEFAULT_SIZES, generate_book
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('cnx-easybake')
+
+here = os.path.abspath(os.path.dirname(__file__))
+RECIPE_DIR = os.path.join(here, 'recipes')
+
+SCENARIOS = OrderedDict(
+    (name, os.path.join(RECIPE_DIR, '{}.css'.format(name)))
+    for name in ('counters', 'group_by', 'index', 'move_to', 'copy_to',
+                 'deferred_and_target'))
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024  # Linux reports kilobytes
+    return peak
+
+
+def median(values):
+    """Return the median of a non-empty list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def bake_once(css, html):
+    """Parse, bake and serialize html with css once.
+
+    Returns a dict of the seconds spent in each of those phases.
+    """
+    start = timer()
+    element = etree.XML(html)
+    parsed = timer()
+    oven = Oven(css)
+    oven.bake(element)
+    baked = timer()
+    etree.tostring(element, method='xml')
+    done = timer()
+    return {'parse': parsed - start,
+            'bake': baked - parsed,
+            'serialize': done - baked}
+
+
+def run_scenario(name, html, repeat=3):
+    """Bake html with the recipe of scenario name, repeat times.
+
+    Returns a result dict with the median phase timings, the bake
+    throughput in elements per second and the peak memory of the process.
+    """
+    with open(SCENARIOS[name], 'rb') as f:
+        css = f.read()
+    elements = sum(1 for _ in etree.XML(html).iter())
+
+    old_level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        runs = [bake_once(css, html) for _ in range(repeat)]
+    finally:
+        logger.setLevel(old_level)
+
+    result = {'scenario': name, 'elements': elements, 'repeat': repeat}
+    for phase in ('parse', 'bake', 'serialize'):
+        result[phase] = median([run[phase] for run in runs])
+    result['throughput'] = elements / result['bake'] if result['bake'] else 0
+    result['peak_rss'] = peak_rss()
+    return result
+
+
+def measure(name, html, repeat=3, isolate=True):
+    """Run a scenario, in a fresh process if isolate is set.
+
+    A separate process per scenario keeps the peak memory of one scenario
+    from hiding that of the next.
+    """
+    if not isolate:
+        return run_scenario(name, html, repeat)
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_scenario, (name, html, repeat))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_report(results):
+    """Return the results as a plain text table."""
+    lines = [u'{:<22}{:>10}{:>12}{:>14}{:>16}'.format(
+        'scenario', 'elements', 'bake (s)', 'elements/s', 'peak RSS (MB)')]
+    for result in results:
+        if result['peak_rss'] is None:
+            rss = u'n/a'
+        else:
+            rss = u'{:.1f}'.format(result['peak_rss'] / 1024.0 / 1024.0)
+        lines.append(u'{:<22}{:>10}{:>12.3f}{:>14.0f}{:>16}'.format(
+            result['scenario'], result['elements'], result['bake'],
+            result['throughput'], rss))
+    return u'\n'.join(lines)
+
+
+def main(argv=None):
+    """Commandline script running the bake benchmarks."""
+    parser = argparse.ArgumentParser(description="Benchmark baking of "
+                                                 "synthetic books")
+    for size in sorted(DEFAULT_SIZES):
+        parser.add_argument('--{}'.format(size), type=int, metavar='N',
+                            default=DEFAULT_SIZES[size],
+                            help='number of {} (default {})'.format(
+                                size, DEFAULT_SIZES[size]))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the synthetic book')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='bakes per scenario, the median is reported')
+    parser.add_argument('--scenario', action='append',
+                        choices=list(SCENARIOS), dest='scenarios',
+                        help='scenario to run (default all), repeatable')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='run all scenarios in this process')
+    parser.add_argument('--write-book', metavar='book.html',
+                        type=argparse.FileType('wb'),
+                        help='also write the generated raw book to a file')
+    parser.add_argument('-o', '--output', metavar='results.json',
+                        type=argparse.FileType('w'),
+                        help='save the results, e.g. as a future baseline')
+    parser.add_argument('-b', '--baseline', metavar='baseline.json',
+                        type=argparse.FileType('r'),
+                        help='compare the results against saved ones, exit '
+                        'non-zero on regressions')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='allowed relative growth of a scenario over '
+                        'the baseline (default 0.1)')
+    args = parser.parse_args(argv)
+
+    sizes = dict((size, getattr(args, size)) for size in DEFAULT_SIZES)
+    html = generate_book(seed=args.seed, **sizes)
+    if args.write_book:
+        args.write_book.write(html)
+        args.write_book.close()
+
+    results = [measure(name, html, args.repeat, not args.no_isolate)
+               for name in (args.scenarios or SCENARIOS)]
+    print(format_report(results))
+
+    report = build_report(results, dict(sizes, seed=args.seed,
+                                        repeat=args.repeat))
+    if args.output:
+        save_report(report, args.output)
+        args.output.close()
+
+    if args.baseline:
+        baseline = load_report(args.baseline)
+        args.baseline.close()
+        for mismatch in mismatches(baseline, report):
+            logger.warning(u'Baseline not comparable: {}'.format(mismatch))
+        rows = compare(baseline, report, args.threshold)
+        print()
+        print(format_comparison(rows, args.threshold))
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
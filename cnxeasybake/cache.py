@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Cache baked output, keyed by the hash of what it is baked from.
+
+The key covers the raw HTML and recipe bytes, the library version and the
+options changing the output, so an entry never needs invalidating: a bake
+with other inputs looks for another key. Output using ``uuid()`` differs
+from bake to bake and is only cached with repeatable ids.
+"""
+import hashlib
+import os
+import tempfile
+
+
+def cache_key(css, html, last_step=None, use_repeatable_ids=False,
+              version=None, remove_blank_text=False, close_empty=True):
+    """Return the hex digest identifying a bake of html with css."""
+    digest = hashlib.sha256()
+    for part in (version, css, html, last_step, use_repeatable_ids,
+                 remove_blank_text, close_empty):
+        if not isinstance(part, bytes):
+            part = u'{}'.format(part).encode('utf-8')
+        # Length prefixed, so that parts can not run into each other
+        digest.update(u'{}:'.format(len(part)).encode('ascii'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def cacheable(oven):
+    """Return whether baking with oven always gives the same output."""
+    from .analysis import analyze
+    return oven.use_repeatable_ids or not any(
+        usage['uuid'] for usage in analyze(oven).values())
+
+
+class OutputCache(object):
+    """Baked output stored in files of a directory, by key."""
+
+    def __init__(self, directory):
+        """Use directory for the cache, created by the first put."""
+        self.directory = directory
+
+    def path(self, key):
+        """Return the path of the file of key."""
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key):
+        """Return the output cached for key, or None."""
+        try:
+            with open(self.path(key), 'rb') as cached:
+                return cached.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, key, output):
+        """Cache output for key.
+
+        The file is written under another name first, so that concurrent
+        bakes never read a partial output.
+        """
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as cached:
+                cached.write(output)
+            os.rename(temp, path)
+        except Exception:
+            os.unlink(temp)
+            raise
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Format counter values in the counter styles of CSS.
+
+Each style is defined like an ``@counter-style`` rule: a system, numeric,
+alphabetic or additive, its symbols, the range of values it represents and
+its padding. A value is formatted once per style, formatting it again is
+a dictionary lookup.
+"""
+
+# Values formatted per style before the style stops caching new ones
+CACHE_SIZE = 10000
+
+
+class CounterStyle(object):
+    """A counter style, after the descriptors of ``@counter-style``."""
+
+    def __init__(self, name, system, symbols, range=(None, None), pad=None,
+                 negative=u'-', out_of_range=None):
+        """Set up the style called name.
+
+        symbols is a string of one symbol per digit, or for the additive
+        system a sequence of (weight, symbol) pairs by decreasing weight.
+        range is the lowest and highest value represented, None for no
+        bound, pad a pair of the minimum length and the symbol to pad
+        with. out_of_range is the warning for values outside the range.
+        """
+        self.name = name
+        self.system = system
+        self.symbols = symbols
+        self.range = range
+        self.pad = pad
+        self.negative = negative
+        self.out_of_range = out_of_range or (
+            u'Counter out of range for {}'.format(name))
+        self.cache = {}
+
+    def in_range(self, value):
+        """Return whether the style can represent value."""
+        low, high = self.range
+        if self.system == 'alphabetic' and (low is None or low < 1):
+            low = 1
+        elif self.system == 'additive' and (low is None or low < 0):
+            low = 0
+        return ((low is None or value >= low) and
+                (high is None or value <= high))
+
+    def format(self, value):
+        """Return the representation of value, None if out of range."""
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+        if not self.in_range(value):
+            return None
+        if value < 0:
+            representation = self.represent(-value)
+            negative = self.negative
+        else:
+            representation = self.represent(value)
+            negative = u''
+        if self.pad is not None:
+            length, symbol = self.pad
+            missing = length - len(representation) - len(negative)
+            if missing > 0:
+                representation = symbol * missing + representation
+        representation = negative + representation
+        if len(self.cache) < CACHE_SIZE:
+            self.cache[value] = representation
+        return representation
+
+    def represent(self, value):
+        """Return the representation of value, a positive integer or 0."""
+        symbols = self.symbols
+        digits = []
+        if self.system == 'numeric':
+            base = len(symbols)
+            while True:
+                value, digit = divmod(value, base)
+                digits.append(symbols[digit])
+                if not value:
+                    break
+            digits.reverse()
+        elif self.system == 'alphabetic':
+            base = len(symbols)
+            while value:
+                value, digit = divmod(value - 1, base)
+                digits.append(symbols[digit])
+            digits.reverse()
+        else:  # additive
+            for weight, symbol in symbols:
+                count, value = divmod(value, weight)
+                digits.append(symbol * count)
+        return u''.join(digits)
+
+
+ROMAN = ((1000, u'M'), (900, u'CM'), (500, u'D'), (400, u'CD'),
+         (100, u'C'), (90, u'XC'), (50, u'L'), (40, u'XL'), (10, u'X'),
+         (9, u'IX'), (5, u'V'), (4, u'IV'), (1, u'I'))
+LATIN = u'abcdefghijklmnopqrstuvwxyz'
+
+ROMAN_OUT_OF_RANGE = u'Number out of range for roman (must be 1..4999)'
+LATIN_OUT_OF_RANGE = u'Counter out of range for latin (must be 1...26)'
+
+
+def _styles():
+    styles = [
+        CounterStyle('decimal', 'numeric', u'0123456789'),
+        CounterStyle('decimal-leading-zero', 'numeric', u'0123456789',
+                     pad=(2, u'0')),
+        CounterStyle('upper-roman', 'additive', ROMAN, range=(1, 4999),
+                     out_of_range=ROMAN_OUT_OF_RANGE),
+        CounterStyle('lower-roman', 'additive',
+                     tuple((weight, symbol.lower())
+                           for weight, symbol in ROMAN),
+                     range=(1, 4999), out_of_range=ROMAN_OUT_OF_RANGE),
+        # The latin styles only go up to z, as they always did
+        CounterStyle('lower-latin', 'alphabetic', LATIN, range=(1, 26),
+                     out_of_range=LATIN_OUT_OF_RANGE),
+        CounterStyle('upper-latin', 'alphabetic', LATIN.upper(),
+                     range=(1, 26), out_of_range=LATIN_OUT_OF_RANGE),
+        CounterStyle('lower-greek', 'alphabetic',
+                     u'αβγδεζηθ'
+                     u'ικλμνξοπ'
+                     u'ρστυφχψω'),
+        CounterStyle('cjk-decimal', 'numeric',
+                     u'〇一二三四五六七'
+                     u'八九', range=(0, None)),
+    ]
+    counter_styles = dict((style.name, style) for style in styles)
+    counter_styles['lower-alpha'] = counter_styles['lower-latin']
+    counter_styles['upper-alpha'] = counter_styles['upper-latin']
+    return counter_styles
+
+
+COUNTER_STYLES = _styles()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Explain what baking a document does, pass by pass.
+
+An ExplainOven records, for each pass, the elements each rule matches, the
+actions by type, the items put in and taken out of each pending bucket, and
+the operations that get slow on large books: inserts into sorted or grouped
+targets, wrapping elements with ``::outside`` and deep copies (``copy-to``,
+``node-set`` and ``content()`` in ``::before`` and ``::after``).
+
+By default the actions are counted but not applied, which costs the walks
+of the passes and none of the changes to the tree: the document is left
+unchanged, the counts of the first pass are exact and those of the later
+passes estimates, as they match the document as it was before baking.
+Baking instead costs a full bake, and gives exact counts for every pass.
+"""
+from collections import OrderedDict
+
+from tinycss2 import ast, serialize
+
+from .oven import Oven
+
+# Kinds of actions, in report order
+ACTION_TYPES = ('move', 'copy', 'nodeset', 'attrib', 'string', 'content',
+                'clear', 'tag')
+# Costly operations, in report order
+COSTLY_OPERATIONS = ('sorted_inserts', 'outside_wraps', 'deep_copies')
+# Functions of content taking items out of a bucket
+DRAINING_FUNCTIONS = ('pending', 'nodes', 'clear')
+
+
+def empty_plan(rules):
+    """Return the plan of a pass with rules, before it matches anything.
+
+    A dict of the number of ``matches`` of each rule, ``(line, selector)``,
+    the number of ``actions`` of each type, ``[filled, drained]`` item
+    counts of each bucket in ``buckets`` and the number of each of the
+    ``costly`` operations.
+    """
+    matches = OrderedDict()
+    for rule, _, _ in rules:
+        matches[rule] = 0
+    return {
+        'matches': matches,
+        'actions': OrderedDict((action, 0) for action in ACTION_TYPES),
+        'buckets': OrderedDict(),
+        'costly': OrderedDict((name, 0) for name in COSTLY_OPERATIONS),
+    }
+
+
+class ExplainOven(Oven):
+    """An oven recording what it does, see explain."""
+
+    def explain(self, element, last_step=None, bake=False):
+        """Return the plan of each pass baking element, in pass order.
+
+        element is left unchanged, the plans after the first pass are
+        estimates. With bake, element is baked as by Oven.bake and the
+        plans are exact. See empty_plan for the plan of a pass.
+        """
+        self.plans = OrderedDict(
+            (step, empty_plan(self.rules.get(step, ())))
+            for step in self.steps_before(last_step))
+        self.baking = bake
+        close_empty = self.close_empty
+        self.close_empty = close_empty and bake
+        try:
+            self.bake(element, last_step)
+        finally:
+            self.close_empty = close_empty
+        return self.plans
+
+    def current_plan(self):
+        """Return the plan of the pass being matched."""
+        return self.plans[self.state['current_step']]
+
+    def count_bucket(self, bucket, filled=0, drained=0):
+        """Count items put in and taken out of bucket in the current pass."""
+        counts = self.current_plan()['buckets'].setdefault(bucket, [0, 0])
+        counts[0] += filled
+        counts[1] += drained
+
+    def record_coverage(self, rule):
+        """Count the element matched by rule."""
+        Oven.record_coverage(self, rule)
+        matches = self.current_plan()['matches']
+        matches[rule] = matches.get(rule, 0) + 1
+
+    def apply_actions(self, step):
+        """Count the actions of the pass, then apply them if baking."""
+        plan = self.plans[step]
+        actions = plan['actions']
+        costly = plan['costly']
+        target = None
+        for action, value in self.state[step]['actions']:
+            if action == 'target':
+                target = value
+                if target.location == 'outside':
+                    costly['outside_wraps'] += 1
+                continue
+            actions[action] = actions.get(action, 0) + 1
+            if action in ('move', 'copy', 'nodeset'):
+                if target.sort is not None:
+                    costly['sorted_inserts'] += 1
+                if action != 'move':
+                    costly['deep_copies'] += 1
+            elif action == 'content' and value is not None:
+                costly['deep_copies'] += 1
+        if self.baking:
+            Oven.apply_actions(self, step)
+
+    def do_node_set(self, element, decl, pseudo):
+        """Count the item put in the bucket, then implement node-set."""
+        self.count_bucket(serialize(decl.value).strip(), filled=1)
+        Oven.do_node_set(self, element, decl, pseudo)
+
+    def do_copy_to(self, element, decl, pseudo):
+        """Count the item put in the bucket, then implement copy-to."""
+        self.count_bucket(serialize(decl.value).strip(), filled=1)
+        Oven.do_copy_to(self, element, decl, pseudo)
+
+    def do_move_to(self, element, decl, pseudo):
+        """Count the item put in the bucket, then implement move-to."""
+        self.count_bucket(serialize(decl.value).strip(), filled=1)
+        Oven.do_move_to(self, element, decl, pseudo)
+
+    def do_content(self, element, decl, pseudo):
+        """Count the items taken out of buckets, then implement content."""
+        for term in decl.value:
+            if (type(term) is ast.FunctionBlock and
+                    term.name in DRAINING_FUNCTIONS):
+                bucket = serialize(term.arguments)
+                items, _ = self.lookup('pending', bucket)
+                if items:
+                    self.count_bucket(bucket, drained=len(items))
+        Oven.do_content(self, element, decl, pseudo)
+
+
+def format_report(plans, estimated=False):
+    """Return the plans of explain as plain text.
+
+    With estimated, the report notes that the passes after the first are
+    estimates.
+    """
+    lines = []
+    if estimated and len(plans) > 1:
+        lines.append(u'passes after the first matched against the unbaked '
+                     u'document, their counts are estimates')
+    for step, plan in plans.items():
+        matches = plan['matches']
+        lines.append(u'pass {}: {} rules, {} matches'.format(
+            step, len(matches), sum(matches.values())))
+        for (line, selector), count in matches.items():
+            lines.append(u'  {:>8}  line {}: {}'.format(
+                count, line, selector.strip()))
+        actions = [u'{} {}'.format(action, count)
+                   for action, count in plan['actions'].items() if count]
+        lines.append(u'  {:<16}{}'.format(
+            'actions', u', '.join(actions) or 'none'))
+        for bucket, (filled, drained) in plan['buckets'].items():
+            lines.append(u'  {:<16}{}: filled {}, drained {}'.format(
+                'bucket', bucket, filled, drained))
+        costly = [u'{} {}'.format(name.replace('_', ' '), count)
+                  for name, count in plan['costly'].items() if count]
+        lines.append(u'  {:<16}{}'.format(
+            'costly', u', '.join(costly) or 'none'))
+    return u'\n'.join(lines)
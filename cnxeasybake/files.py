@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Read raw HTML and write baked HTML, as bytes, compressed or not.
+
+Paths ending in ``.gz``, ``.bz2`` or ``.xz`` are compressed with gzip,
+bzip2 or xz, and ``-`` stands for stdin or stdout. Uncompressed files are
+read by libxml2 itself, without a copy in Python nor a text decoding layer.
+
+HTML is parsed with the parsers of ``make_parser``, which never resolve
+entities nor collect ids, and can remove blank text between elements or
+lift the libxml2 limits on huge documents.
+"""
+import bz2
+import gzip
+import io
+import sys
+import threading
+
+from lxml import etree
+
+try:
+    import lzma
+except ImportError:  # Python 2
+    lzma = None
+
+if sys.version_info > (3,):
+    basestring = (str, bytes)
+
+
+def _open_xz(path, mode):
+    if lzma is None:
+        raise ValueError(u"Can not open {}: xz needs Python 3".format(path))
+    return lzma.open(path, mode)
+
+
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.BZ2File,
+    '.xz': _open_xz,
+}
+
+
+def opener(path):
+    """Return the function opening the compressed file path, or None."""
+    for suffix, function in OPENERS.items():
+        if path.endswith(suffix):
+            return function
+    return None
+
+
+def open_file(path, mode='rb'):
+    """Open path as a binary file, (de)compressing it by its suffix."""
+    if path == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        return getattr(stream, 'buffer', stream)
+    return (opener(path) or io.open)(path, mode)
+
+
+# The parsers of each thread, an lxml parser parses one document at a time
+_local = threading.local()
+
+
+def make_parser(huge_tree=False, remove_blank_text=False,
+                remove_comments=False, remove_pis=False):
+    """Return the parser for these options, created once per thread.
+
+    huge_tree lifts the libxml2 limits on depth and text size, for books
+    of hundreds of megabytes. remove_blank_text drops the whitespace-only
+    text between elements outside of mixed content, which no pass then has
+    to walk: only use it for HTML whose layout whitespace does not matter
+    to the recipe. Entities are never resolved, nor ids collected, the
+    passes look elements up by their own index.
+
+    A parser is locked while it parses, so pass the one returned to other
+    threads as ``parser.copy()``.
+    """
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    key = (huge_tree, remove_blank_text, remove_comments, remove_pis)
+    parser = parsers.get(key)
+    if parser is None:
+        parser = parsers[key] = etree.XMLParser(
+            huge_tree=huge_tree, remove_blank_text=remove_blank_text,
+            remove_comments=remove_comments, remove_pis=remove_pis,
+            resolve_entities=False, collect_ids=False)
+    return parser
+
+
+def read_html(source, parser=None):
+    """Parse the tree of source, a path or a file object.
+
+    The parser defaults to the one of ``make_parser()`` for this thread.
+    """
+    if parser is None:
+        parser = make_parser()
+    if isinstance(source, basestring):
+        if source != '-' and opener(source) is None:
+            return etree.parse(source, parser)
+        source = open_file(source)
+    return etree.parse(getattr(source, 'buffer', source), parser)
+
+
+def read_bytes(source):
+    """Return the uncompressed content of source, a path or file object."""
+    if isinstance(source, basestring):
+        if source == '-':
+            return open_file(source).read()
+        with open_file(source) as html_in:
+            return html_in.read()
+    return getattr(source, 'buffer', source).read()
+
+
+def write_bytes(data, target):
+    """Write data to target, a path or a file object."""
+    if isinstance(target, basestring):
+        if target == '-':
+            target = sys.stdout
+        else:
+            with open_file(target, 'wb') as html_out:
+                html_out.write(data)
+            return
+    if hasattr(target, 'buffer'):
+        target.flush()
+        target.buffer.write(data)
+        target.buffer.flush()
+    elif isinstance(target, io.TextIOBase):
+        target.write(data.decode('utf-8'))
+    else:
+        target.write(data)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Bake a book again, recomputing only the partitions that changed.
+
+An IncrementalBaker remembers, for each pass of its last bake, the baked
+html of every partition (such as a chapter). Baking the next version of
+the document, it compares the raw partitions with the previous ones:
+
+- a pass that stays inside the partitions (see the partition module) is
+  baked only on the partitions that changed, the others keep their
+  previous result,
+- any other pass is baked on the whole document, and the partitions it
+  bakes differently than last time count as changed from then on, so
+  that content depending on their counters, strings or buckets is
+  recomputed.
+
+The whole document is baked again when the document changed outside the
+partitions, when a pass changed it differently outside the partitions or
+when a partition left content in a bucket for the rest of the book.
+"""
+from logging import INFO
+
+from lxml import etree
+
+from .oven import Oven, close_empty_elements, log
+from .partition import PartitionBaker, _replace, find_partitions
+
+
+class Unbounded(Exception):
+    """A change can not be kept inside the partitions it was made in."""
+
+
+def skeleton(element, partitions):
+    """Serialize element without the content of its partitions.
+
+    The partitions are left as empty elements, with their attributes.
+    """
+    contents = []
+    for wrapper in partitions:
+        partition = wrapper.etree_element
+        contents.append((partition.text, list(partition)))
+        partition.text = None
+        for child in list(partition):
+            partition.remove(child)
+    try:
+        return etree.tostring(element)
+    finally:
+        for wrapper, (text, children) in zip(partitions, contents):
+            wrapper.etree_element.text = text
+            wrapper.etree_element.extend(children)
+
+
+def start_tag(wrapper):
+    """Return the tag and attributes of a wrapped element, comparably."""
+    element = wrapper.etree_element
+    return element.tag, sorted(element.attrib.items())
+
+
+def serialize_partitions(partitions, previous=None):
+    """Serialize partitions, reusing the equal strings of previous."""
+    htmls = []
+    for index, wrapper in enumerate(partitions):
+        html = etree.tostring(wrapper.etree_element, with_tail=False)
+        if previous is not None and previous[index] == html:
+            html = previous[index]
+        htmls.append(html)
+    return htmls
+
+
+class IncrementalBaker(PartitionBaker):
+    """Bake new versions of a document, reusing the previous bake."""
+
+    def __init__(self, css_in, selector, use_repeatable_ids=False):
+        """Bake with the recipe css_in, split by the CSS selector."""
+        super(IncrementalBaker, self).__init__(
+            css_in, selector, workers=1,
+            use_repeatable_ids=use_repeatable_ids)
+        self.partition_oven = Oven(self.css, use_repeatable_ids)
+        # Passes that left content in buckets while baking one partition
+        self.unbounded = set()
+        self.last_bake = None
+
+    def bake(self, element, last_step=None):
+        """Bake the HTML tree element, reusing the last bake if possible.
+
+        Returns a list of (pass, reason) for each pass baked, the reason is
+        None for passes baked only on the changed partitions.
+        """
+        if isinstance(element, etree._ElementTree):
+            element = element.getroot()
+        steps = self.oven.steps_before(last_step)
+        partitions, _ = find_partitions(element, self.selectors)
+        raw = serialize_partitions(partitions)
+        outline = skeleton(element, partitions)
+
+        last_bake = self.last_bake
+        if last_bake is None:
+            reason = u'no previous bake'
+        elif last_bake['steps'] != steps:
+            reason = u'baking other passes'
+        elif last_bake['skeleton'][0] != outline:
+            reason = u'changed outside the partitions'
+        else:
+            raw_html = etree.tostring(element)
+            try:
+                return self.bake_changed(element, steps, raw)
+            except Unbounded as e:
+                reason = e.args[0]
+                _replace(element, raw_html)
+        log(INFO, u'Baking all partitions: {}'.format(reason).encode('utf-8'))
+        return self.bake_all(element, steps, raw, outline, reason)
+
+    def bake_all(self, element, steps, raw, outline, reason):
+        """Bake every pass on the whole document, recording the result."""
+        oven = self.oven
+        oven.clear_state()
+        oven.state['steps'] = steps
+        bake = {'steps': steps, 'raw': raw, 'skeleton': [outline],
+                'reasons': [], 'snapshots': [], 'tags': []}
+        report = []
+        for step in steps:
+            partitions, outside = find_partitions(element, self.selectors)
+            check = self.check(step, partitions, outside)
+            if check is None and step in self.unbounded:
+                check = u'buckets are emptied outside their partition'
+            bake['reasons'].append(check)
+            oven.bake_step(element, step)
+            self.record(bake, element)
+            report.append((step, reason))
+        if self.oven.close_empty:
+            close_empty_elements(element)
+        bake['output'] = etree.tostring(element)
+        self.last_bake = bake
+        return report
+
+    def record(self, bake, element):
+        """Record the partitions of element after a pass of bake."""
+        partitions, _ = find_partitions(element, self.selectors)
+        previous = bake['snapshots'][-1] if bake['snapshots'] else bake['raw']
+        if len(previous) != len(partitions):
+            previous = None
+        bake['snapshots'].append(serialize_partitions(partitions, previous))
+        bake['tags'].append([start_tag(wrapper) for wrapper in partitions])
+        bake['skeleton'].append(skeleton(element, partitions))
+
+    def bake_changed(self, element, steps, raw):
+        """Bake only what the changed partitions affect, see bake.
+
+        Raises Unbounded if the changes reach outside the partitions.
+        """
+        last_bake = self.last_bake
+        dirty = set(index for index, html in enumerate(raw)
+                    if html != last_bake['raw'][index])
+        log(INFO, u'Partitions changed: {}'.format(
+            u', '.join(str(index) for index in sorted(dirty)) or u'none'
+        ).encode('utf-8'))
+        # The html each unchanged partition of the tree has now
+        current = list(last_bake['raw'])
+        bake = dict(last_bake, snapshots=[], tags=[], raw=[
+            html if index in dirty else current[index]
+            for index, html in enumerate(raw)])
+        oven = self.oven
+        oven.clear_state()
+        oven.state['steps'] = steps
+        report = []
+        for position, step in enumerate(steps):
+            if not dirty:
+                # The rest of the bake goes as last time
+                _replace(element, last_bake['output'])
+                bake['snapshots'].extend(last_bake['snapshots'][position:])
+                bake['tags'].extend(last_bake['tags'][position:])
+                report.extend((rest, None) for rest in steps[position:])
+                self.last_bake = bake
+                return report
+            partitions, _ = find_partitions(element, self.selectors)
+            reason = last_bake['reasons'][position]
+            if reason is None:
+                for index in sorted(dirty):
+                    self.bake_partition(element, step, partitions[index])
+            else:
+                self.restore(partitions, dirty, current,
+                             last_bake['snapshots'][position - 1]
+                             if position else last_bake['raw'])
+                oven.bake_step(element, step)
+                partitions, _ = find_partitions(element, self.selectors)
+                if (skeleton(element, partitions) !=
+                        last_bake['skeleton'][position + 1]):
+                    raise Unbounded(u'pass {} changed the document outside '
+                                    u'the partitions'.format(step))
+                dirty = set(range(len(partitions)))
+            snapshot = last_bake['snapshots'][position]
+            dirty = self.compare(partitions, dirty, current, snapshot,
+                                 last_bake['tags'][position], step)
+            snapshot = list(snapshot)
+            for index in dirty:
+                snapshot[index] = current[index]
+            bake['snapshots'].append(snapshot)
+            bake['tags'].append(last_bake['tags'][position])
+            report.append((step, reason))
+        partitions, _ = find_partitions(element, self.selectors)
+        self.restore(partitions, dirty, current,
+                     last_bake['snapshots'][-1] if steps else last_bake['raw'])
+        if self.oven.close_empty:
+            close_empty_elements(element)
+        bake['output'] = etree.tostring(element)
+        self.last_bake = bake
+        return report
+
+    def bake_partition(self, element, step, partition):
+        """Bake a pass staying inside the partitions on one of them."""
+        oven = self.partition_oven
+        oven.clear_state()
+        oven.bake_step(element, step, partition)
+        self.oven.mark_changed(partition.etree_element)
+        if oven.state[step]['pending']:
+            self.unbounded.add(step)
+            raise Unbounded(u'pass {} left content in a bucket'.format(step))
+
+    def restore(self, partitions, dirty, current, snapshot):
+        """Put the recorded html in the unchanged partitions."""
+        for index, wrapper in enumerate(partitions):
+            if index not in dirty and current[index] is not snapshot[index]:
+                _replace(wrapper.etree_element, snapshot[index])
+                self.oven.mark_changed(wrapper.etree_element)
+                current[index] = snapshot[index]
+
+    def compare(self, partitions, dirty, current, snapshot, tags, step):
+        """Return the partitions baked differently than last time.
+
+        Partitions baked the same way as last time are no longer dirty.
+        Raises Unbounded if a pass changed the tag or attributes of a
+        partition differently, or the number of partitions.
+        """
+        if len(partitions) != len(snapshot):
+            raise Unbounded(u'pass {} changed the partitions'.format(step))
+        changed = set()
+        for index in dirty:
+            wrapper = partitions[index]
+            if start_tag(wrapper) != tags[index]:
+                raise Unbounded(u'pass {} changed partition {} itself'.format(
+                    step, index))
+            html = etree.tostring(wrapper.etree_element, with_tail=False)
+            if html == snapshot[index]:
+                current[index] = snapshot[index]
+            else:
+                changed.add(index)
+                current[index] = html
+        return changed
@@ -3,19 +3,22 @@
 import logging
 from logging import WARN, ERROR, INFO, DEBUG
 import sys
+import threading
 
 from lxml import etree
 import tinycss2
 from tinycss2 import serialize, parse_declaration_list, ast
 import cssselect2
-from cssselect2 import ElementWrapper
+from cssselect2 import ElementWrapper, SORT_KEY, ascii_lower
 from cssselect2.parser import parse
 from cssselect2.compiler import CompiledSelector
 from cssselect2.extensions import extensions
 from copy import deepcopy
-from icu import Locale, Collator, UnicodeString
 from uuid import uuid4
 
+from .counter_styles import COUNTER_STYLES
+from .variables import UNSET, VariableStore
+
 verbose = False
 
 logger = logging.getLogger('cnx-easybake')
@@ -25,17 +28,28 @@ def prefixify(tag):
     return '{http://www.w3.org/1999/xhtml}' + tag
 
 
-SELF_CLOSING_TAGS = list(map(prefixify, ['area', 'base', 'br', 'col',
-                                         'command', 'embed', 'hr', 'img',
-                                         'input', 'keygen', 'link', 'meta',
-                                         'param', 'source', 'track', 'wbr']))
+SELF_CLOSING_TAGS = frozenset(map(prefixify, [
+    'area', 'base', 'br', 'col', 'command', 'embed', 'hr', 'img', 'input',
+    'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr']))
+
+# Elements without any child node, text, comment or element
+EMPTY_ELEMENTS = etree.XPath('descendant-or-self::*[not(node())]')
+
+# The id attributes of an element and its descendants
+ID_ATTRIBUTES = etree.XPath('descendant-or-self::*/@id')
 
 
 IS_PY3 = sys.version_info > (3,)
 
+# What Oven.lookup returns for variables not set
+NULL_VALUES = {'strings': '', 'counters': 0, 'pending': (None, None)}
+
 
 if IS_PY3:
     basestring = (str, bytes)
+    text_type = str
+else:
+    text_type = unicode  # noqa: F821
 
 
 def to_str(s):
@@ -105,6 +119,11 @@ class TargetVal():
         self.vtype = vtype
         self.vstyle = vstyle
 
+    @property
+    def key(self):
+        """What the value depends on, the same for the same reference."""
+        return (self.el_id, self.vname, self.vtype, self.vstyle)
+
     def __str__(self):
         """String value."""
         if IS_PY3:
@@ -128,18 +147,175 @@ class TargetVal():
         return r
 
 
+class CachedElementWrapper(ElementWrapper):
+    """An ElementWrapper keeping the wrappers of its children.
+
+    Later walks of the tree reuse the wrappers, with their cached ids,
+    classes and languages, except for the elements in the shared set
+    changed and their descendants, which are wrapped again.
+    """
+
+    def __init__(self, etree_element, parent, index, previous,
+                 in_html_document, content_language=None):
+        """Wrap etree_element, sharing the changed set of parent."""
+        super(CachedElementWrapper, self).__init__(
+            etree_element, parent, index, previous, in_html_document,
+            content_language)
+        self.changed = parent.changed if parent is not None else set()
+        self.children = None
+
+    def iter_children(self):
+        """Return an iterator of the wrappers of the child elements."""
+        if self.children is None:
+            self.children = list(
+                super(CachedElementWrapper, self).iter_children())
+        elif self.changed:
+            previous = None
+            for index, child in enumerate(self.children):
+                if child.etree_element in self.changed:
+                    child = type(self)(child.etree_element, parent=self,
+                                       index=index, previous=previous,
+                                       in_html_document=self.in_html_document)
+                    self.children[index] = child
+                else:
+                    child.previous = previous
+                previous = child
+        return iter(self.children)
+
+
+class IndexedMatcher(cssselect2.Matcher):
+    """A Matcher also finding selectors by the attribute values of elements.
+
+    Selectors whose subject has neither id nor class but tests an
+    attribute for equality, like ``div[data-type="chapter"]``, are kept by
+    attribute name and value. An element is only tested against those
+    matching its own attribute values, instead of against every selector
+    of its tag.
+    """
+
+    def __init__(self):
+        """Start without any selector."""
+        super(IndexedMatcher, self).__init__()
+        # Attribute name to value to selector entries
+        self.attribute_selectors = {}
+
+    def add_selector(self, selector, payload, attribute=None):
+        """Add a selector, by the (name, value) of attribute if given.
+
+        attribute is the subject_attribute of the parsed selector.
+        """
+        if (attribute is None or selector.id is not None or
+                selector.class_name is not None):
+            return super(IndexedMatcher, self).add_selector(selector,
+                                                            payload)
+        self.order += 1
+        if selector.never_matches:
+            return
+        name, value = attribute
+        self.attribute_selectors.setdefault(name, {}).setdefault(
+            value, []).append((selector.test, selector.specificity,
+                               self.order, selector.pseudo_element, payload))
+
+    def match(self, element):
+        """Return the matches of element, like Matcher.match."""
+        relevant_selectors = []
+
+        if element.id is not None:
+            relevant_selectors.append(self.id_selectors.get(element.id, []))
+
+        for class_name in element.classes:
+            relevant_selectors.append(self.class_selectors.get(class_name, []))
+
+        get = element.etree_element.get
+        for name, selectors in self.attribute_selectors.items():
+            value = get(name)
+            if value is not None and value in selectors:
+                relevant_selectors.append(selectors[value])
+
+        relevant_selectors.append(
+            self.lower_local_name_selectors.get(
+                ascii_lower(element.local_name), []))
+        relevant_selectors.append(
+            self.namespace_selectors.get(element.namespace_url, []))
+        relevant_selectors.append(self.other_selectors)
+
+        results = [
+            (specificity, order, pseudo, payload)
+            for selector_list in relevant_selectors
+            for test, specificity, order, pseudo, payload in selector_list
+            if test(element)
+        ]
+        results.sort(key=SORT_KEY)
+        return results
+
+
+class BakeContext():
+    """The mutable state of one bake.
+
+    The parsed recipe of an oven does not change while baking, everything
+    a bake changes lives here: the variable stores and recipe actions, the
+    coverage lines and the repeatable id counter, and the wrapped tree
+    with the elements changed since it was last walked.
+    """
+
+    def __init__(self, oven):
+        """Set up a clear state for baking with oven."""
+        self.coverage_lines = list(oven.parsed_coverage_lines)
+        self.repeatable_id_counter = 0
+        self.wrapper = None
+        self.changed = set()
+        self.state = {}
+        self.state['steps'] = list(oven.steps)
+        self.state['current_step'] = None
+        self.state['scope'] = []
+        self.state['counters'] = VariableStore()
+        self.state['strings'] = VariableStore()
+        for step in oven.matchers:
+            self.state[step] = {}
+            self.state[step]['pending'] = {}
+            self.state[step]['actions'] = []
+            self.state[step]['counters'] = \
+                self.state['counters'].variables(step)
+            self.state[step]['strings'] = \
+                self.state['strings'].variables(step)
+            # FIXME rather than boolean should ref HTML tree
+            self.state[step]['recipe'] = False
+
+
 class Oven():
     """Collate and number HTML with CSS3.
 
     An object that parses and stores rules defined in CSS3 and can apply
     them to an HTML file.
+
+    One oven can bake in several threads at once: each thread bakes with
+    its own BakeContext, which state, coverage_lines and
+    repeatable_id_counter refer to. Do not update the CSS while baking.
+
+    Adjacent passes that do not interact are matched in one walk of the
+    tree, unless fuse_passes is false; pass_groups lists the passes baked
+    together.
+
+    Baked empty elements get a closing tag, unless close_empty is false,
+    when the output is only ever parsed as XHTML.
     """
 
-    def __init__(self, css_in=None, use_repeatable_ids=False):
+    def __init__(self, css_in=None, use_repeatable_ids=False,
+                 fuse_passes=True, close_empty=True):
         """Initialize oven, with optional inital CSS."""
-        self.coverage_lines = []
+        self._local = threading.local()
+        # Coverage lines recorded while parsing, bakes add their own
+        self.parsed_coverage_lines = []
         self.use_repeatable_ids = use_repeatable_ids
-        self.repeatable_id_counter = 0
+        # Sorted names of the passes in the recipe
+        self.steps = []
+        # The rules of each pass, as matcher payloads:
+        # ((line, selector), declarations, label)
+        self.rules = {}
+        self.fuse_passes = fuse_passes
+        self.close_empty = close_empty
+        # Tuples of passes baked in one walk, in pass order
+        self.pass_groups = []
         # Store the CSS namespaces (and prefixed namespaces)
         self.css_namespaces = {}
 
@@ -149,6 +325,33 @@ class Oven():
             self.matchers = {}
             self.clear_state()
 
+    @property
+    def context(self):
+        """Return the BakeContext of the current thread."""
+        try:
+            return self._local.context
+        except AttributeError:
+            return self.clear_state()
+
+    @property
+    def state(self):
+        """Return the recipe state of the current thread."""
+        return self.context.state
+
+    @property
+    def coverage_lines(self):
+        """Return the coverage lines of the current thread."""
+        return self.context.coverage_lines
+
+    @property
+    def repeatable_id_counter(self):
+        """Return the last repeatable id of the current thread."""
+        return self.context.repeatable_id_counter
+
+    @repeatable_id_counter.setter
+    def repeatable_id_counter(self, value):
+        self.context.repeatable_id_counter = value
+
     def generate_id(self):
         """Generate a fresh id"""
         if self.use_repeatable_ids:
@@ -158,40 +361,25 @@ class Oven():
             return str(uuid4())
 
     def clear_state(self):
-        """Clear the recipe state."""
-        self.state = {}
-        self.state['steps'] = []
-        self.state['current_step'] = None
-        self.state['scope'] = []
-        self.state['counters'] = {}
-        self.state['strings'] = {}
-        for step in self.matchers:
-            self.state[step] = {}
-            self.state[step]['pending'] = {}
-            self.state[step]['actions'] = []
-            self.state[step]['counters'] = {}
-            self.state[step]['strings'] = {}
-            # FIXME rather than boolean should ref HTML tree
-            self.state[step]['recipe'] = False
+        """Clear the recipe state of the current thread and return it."""
+        self._local.context = BakeContext(self)
+        return self._local.context
 
     def update_css(self, css_in=None, clear_css=False):
         """Add additional CSS rules, optionally replacing all."""
         if clear_css:
             self.matchers = {}
+            self.rules = {}
+            self.steps = []
+            self.pass_groups = []
+            self.parsed_coverage_lines = []
 
         # CSS is changing, so clear processing state
         self.clear_state()
 
         if css_in is None:
             return
-        try:
-            with open(css_in, 'rb') as f:  # is it a path/filename?
-                css = f.read()
-        except (IOError, TypeError):
-            try:
-                css = css_in.read()  # Perhaps a file obj?
-            except AttributeError:
-                css = css_in         # Treat it as a string
+        css = read_css(css_in)
 
         # Namespaces defined in the CSS
         if clear_css:
@@ -250,16 +438,19 @@ class Oven():
                                 extras.insert(0, label)
                             label = '_'.join(extras)
 
+                        payload = (
+                            (rule.source_line + sel.source_line_offset,
+                             serialize(rule.prelude).replace('\n', ' ')),
+                            decls, label)
                         for step in steps:
                             if step not in self.matchers:
-                                self.matchers[step] = cssselect2.Matcher()
+                                self.matchers[step] = IndexedMatcher()
+                                self.rules[step] = []
                             self.record_coverage_zero(rule,
                                                       sel.source_line_offset)
                             self.matchers[step].add_selector(
-                                 csel,
-                                 ((rule.source_line + sel.source_line_offset,
-                                   serialize(rule.prelude).replace('\n', ' ')),
-                                  decls, label))
+                                csel, payload, subject_attribute(sel))
+                            self.rules[step].append(payload)
             elif rule.type == 'comment':
                 pass
             elif rule.type == 'error':
@@ -279,6 +470,7 @@ class Oven():
                     steps.sort(key=int)
                     steps.insert(0, '0')
                     self.matchers['0'] = self.matchers.pop('default')
+                    self.rules['0'] = self.rules.pop('default')
                 except ValueError:
                     steps.insert(0, 'default')
             else:
@@ -287,103 +479,204 @@ class Oven():
                 except ValueError:
                     pass  # already sorted alpha
 
+        self.steps = steps
+        if self.fuse_passes:
+            from .analysis import fusion_groups
+            self.pass_groups = fusion_groups(self)
+        else:
+            self.pass_groups = [(step,) for step in steps]
         self.clear_state()
-        self.state['steps'] = steps
         log(DEBUG, 'Passes: {}'.format(to_str(steps)))
-
-    def bake(self, element, last_step=None):
-        """Apply recipes to HTML tree. Will build recipes if needed."""
-
-        if last_step is not None:
-            try:
-                self.state['steps'] = [s for s in self.state['steps']
-                                       if int(s) < int(last_step)]
-            except ValueError:
-                self.state['steps'] = [s for s in self.state['steps']
-                                       if s < last_step]
-        for step in self.state['steps']:
-            self.state['current_step'] = step
-            self.state['scope'].insert(0, step)
-            # Need to wrap each loop, since tree may have changed
-            wrapped_html_tree = ElementWrapper.from_html_root(element)
-
-            if not self.state[step]['recipe']:
-                recipe = self.build_recipe(wrapped_html_tree, step)
-            else:
-                recipe = self.state[step]
-
-            log(DEBUG, u'Recipe {} length: {}'.format(
-                step, len(recipe['actions'])).encode('utf-8'))
-            target = None
-            old_content = {}
-            node_counts = {}
-            for action, value in recipe['actions']:
-                if action == 'target':
-                    target = value
-                    old_content = {}
-                elif action == 'tag':
-                    target.tree.tag = value
-                elif action == 'clear':
-                    old_content['text'] = target.tree.text
-                    target.tree.text = None
-                    old_content['children'] = []
-                    for child in target.tree:
-                        old_content['children'].append(child)
-                        target.tree.remove(child)
-                elif action == 'content':
-                    if value is not None:
-                        append_string(target, value.text)
-                        for child in value:
-                            target.tree.append(child)
-                    elif old_content:
-                        append_string(target, old_content['text'])
-                        for child in old_content['children']:
-                            target.tree.append(child)
-                elif action == 'attrib':
-                    attname, vals = value
-                    strval = u''.join([u'{}'.format(s) for s in vals])
-                    target.tree.set(attname, strval)
-                elif action == 'string':
-                    strval = u''.join([u'{}'.format(s) for s in value])
-                    if target.location == 'before':
-                        prepend_string(target, strval)
-                    else:
-                        append_string(target, strval)
-                elif action == 'move':
-                    grouped_insert(target, value)
-                elif action == 'copy':
-                    mycopy = copy_w_id_suffix(value)
-                    mycopy.tail = None
-                    grouped_insert(target, mycopy)
-                elif action == 'nodeset':
-                    node_counts[value] = node_counts.setdefault(value, 0) + 1
-                    suffix = u'_copy_{}'.format(node_counts[value])
-                    mycopy = copy_w_id_suffix(value, suffix)
-                    mycopy.tail = None
-                    grouped_insert(target, mycopy)
-                else:
-                    log(WARN, u'Missing action {}'.format(
-                        action).encode('utf-8'))
+        for group in self.pass_groups:
+            if len(group) > 1:
+                log(INFO, u'Fused passes: {}'.format(
+                    u', '.join(to_str(list(group)))).encode('utf-8'))
+
+    def bake(self, element, last_step=None, before_step=None):
+        """Apply recipes to HTML tree. Will build recipes if needed.
+
+        Starts from a clear state, so one oven can bake many documents, one
+        after the other or from several threads at once. If given,
+        before_step is called with the name of each pass before it runs; an
+        exception it raises aborts the bake.
+        """
+        self.clear_state()
+        self.state['steps'] = self.steps_before(last_step)
+        steps = set(self.state['steps'])
+        for group in self.pass_groups:
+            group = tuple(step for step in group if step in steps)
+            if before_step is not None:
+                for step in group:
+                    before_step(step)
+            if len(group) == 1:
+                self.bake_step(element, group[0])
+            elif group:
+                self.bake_step(element, group)
 
         # Do numbering
 
         # Do label/link updates
 
-        # Add an empty string to each element just to make sure the element
-        # is closed. This is useful for browsers that parse the output
-        # as HTML5 rather than as XHTML5.
-        #
-        # One use-case would be users that inject the content into an
-        # existing HTML (not XHTML) document.
-        walkAll = element.iter()
-        for elt in walkAll:
-            if elt.tag not in SELF_CLOSING_TAGS:
-                if len(elt) == 0 and not elt.text:
-                    elt.text = ''
+        if self.close_empty:
+            close_empty_elements(element)
+
+    def steps_before(self, last_step=None):
+        """Return the passes to run when stopping just before last_step."""
+        if last_step is None:
+            return list(self.steps)
+        try:
+            return [s for s in self.steps if int(s) < int(last_step)]
+        except ValueError:
+            return [s for s in self.steps if s < last_step]
+
+    def bake_step(self, element, step, partition=None):
+        """Run one pass of the recipe over the HTML tree element.
+
+        With a tuple of passes, their rules are matched in one walk of the
+        tree, then their actions are applied one pass after the other.
+        With partition, the ElementWrapper of an element of the tree, only
+        rules matching it or its descendants are applied; the rest of the
+        tree is still seen by the selectors.
+        """
+        steps = step if isinstance(step, tuple) else (step,)
+        for current in steps:
+            self.state['current_step'] = current
+            self.state['scope'].insert(0, current)
+        self.state['counters'].set_scope(self.state['scope'])
+        self.state['strings'].set_scope(self.state['scope'])
+        if partition is not None:
+            wrapped_html_tree = partition
+        else:
+            wrapped_html_tree = self.wrap(element)
+
+        if not self.state[steps[0]]['recipe']:
+            self.build_recipe(wrapped_html_tree, step)
+        self.context.changed.clear()
+        for current in steps:
+            self.apply_actions(current)
+
+    def wrap(self, element):
+        """Return the wrapper of the HTML tree element for this bake.
+
+        The wrappers of the previous walk are reused, but for the elements
+        changed since then, see mark_changed. An ElementTree is wrapped from
+        its root element.
+        """
+        if isinstance(element, etree._ElementTree):
+            element = element.getroot()
+        context = self.context
+        wrapper = context.wrapper
+        if (wrapper is None or wrapper.etree_element is not element or
+                element in context.changed):
+            wrapper = CachedElementWrapper.from_html_root(element)
+            wrapper.changed = context.changed
+            context.wrapper = wrapper
+        return wrapper
+
+    def mark_changed(self, element):
+        """Wrap element and its descendants again on the next walk.
+
+        Anything changing the children, tag or attributes of an element of
+        the tree between passes of a bake, other than the passes
+        themselves, must call this.
+        """
+        self.context.changed.add(element)
+
+    def apply_actions(self, step):
+        """Apply the actions of the recipe of a pass to the HTML tree."""
+        recipe = self.state[step]
+        log(DEBUG, u'Recipe {} length: {}'.format(
+            step, len(recipe['actions'])).encode('utf-8'))
+        target = None
+        old_content = {}
+        node_counts = {}
+        # Cross-references resolved in this pass, the state is final
+        resolved = {}
+        changed = self.context.changed
+        for action, value in recipe['actions']:
+            if action == 'target':
+                target = value
+                old_content = {}
+                continue
+            if action != 'string':
+                changed.add(target.tree)
+                if target.location == 'outside':
+                    changed.add(target.tree.getparent())
+                if action == 'move':
+                    changed.add(value.getparent())
+            if action == 'tag':
+                target.tree.tag = value
+            elif action == 'clear':
+                old_content['text'] = target.tree.text
+                target.tree.text = None
+                old_content['children'] = []
+                for child in target.tree:
+                    old_content['children'].append(child)
+                    target.tree.remove(child)
+            elif action == 'content':
+                if value is not None:
+                    append_string(target, value.text)
+                    for child in value:
+                        target.tree.append(child)
+                elif old_content:
+                    append_string(target, old_content['text'])
+                    for child in old_content['children']:
+                        target.tree.append(child)
+            elif action == 'attrib':
+                attname, vals = value
+                strval = self.join_values(vals, resolved)
+                target.tree.set(attname, strval)
+            elif action == 'string':
+                strval = self.join_values(value, resolved)
+                if target.location == 'before':
+                    prepend_string(target, strval)
+                else:
+                    append_string(target, strval)
+            elif action == 'move':
+                grouped_insert(target, value)
+            elif action == 'copy':
+                mycopy = copy_w_id_suffix(value)
+                mycopy.tail = None
+                grouped_insert(target, mycopy)
+            elif action == 'nodeset':
+                node_counts[value] = node_counts.setdefault(value, 0) + 1
+                suffix = u'_copy_{}'.format(node_counts[value])
+                mycopy = copy_w_id_suffix(value, suffix)
+                mycopy.tail = None
+                grouped_insert(target, mycopy)
+            else:
+                log(WARN, u'Missing action {}'.format(
+                    action).encode('utf-8'))
+
+    def join_values(self, values, resolved):
+        """Return the string of values, a string or a list of values.
+
+        Cross-references are looked up once per target, name and style,
+        their strings are kept in the dict resolved. References to unknown
+        ids are looked up, and warned about, each time.
+        """
+        if isinstance(values, text_type):
+            return values
+        strings = []
+        for value in values:
+            if isinstance(value, TargetVal):
+                key = value.key
+                string = resolved.get(key)
+                if string is None:
+                    string = value.__unicode__()
+                    if value.el_id in self.state[value.vtype].snapshots:
+                        resolved[key] = string
+                strings.append(string)
+            elif isinstance(value, text_type):
+                strings.append(value)
+            else:
+                strings.append(u'{}'.format(value))
+        return u''.join(strings)
 
     def record_coverage_zero(self, rule, offset):
         """Add entry to coverage saying this selector was parsed"""
-        self.coverage_lines.append('DA:{},0'.format(rule.source_line + offset))
+        self.parsed_coverage_lines.append(
+            'DA:{},0'.format(rule.source_line + offset))
 
     def record_coverage(self, rule):
         """Add entry to coverage saying this selector was matched"""
@@ -408,6 +701,34 @@ class Oven():
         matching occurs when entering a node, declaration methods are ran
         either before or after recursing into its children, depending on the
         presence of a pseudo-element and its value.
+
+        With a tuple of steps, the rules of all these passes are matched in
+        the same walk, one pass after the other on each element.
+        """
+        steps = step if isinstance(step, tuple) else (step,)
+        matched = []
+        for current in steps:
+            self.state['current_step'] = current
+            matched.append(self.enter_element(element, current))
+
+        # Recurse
+        for el in element.iter_children():
+            _state = self.build_recipe(el, step, depth=depth+1)  # noqa
+
+        for current, matching_rules in zip(steps, matched):
+            self.state['current_step'] = current
+            self.leave_element(element, current, matching_rules)
+
+        if depth == 0:
+            for current in steps:
+                # FIXME should ref HTML tree
+                self.state[current]['recipe'] = True
+        return self.state[steps[-1]]
+
+    def enter_element(self, element, step):
+        """Apply the rules of step that run before the children of element.
+
+        Returns the matching rules, by label, for leave_element.
         """
         element_id = element.etree_element.get('id')
 
@@ -431,16 +752,7 @@ class Oven():
 
         # Store all variables (strings and counters) before children
         if element_id:
-            temp_counters = {}
-            temp_strings = {}
-            for s_step in self.state['scope']:
-                temp_counters[s_step] = {
-                        'counters': deepcopy(self.state[s_step]['counters'])}
-                temp_strings[s_step] = {
-                        'strings': deepcopy(self.state[s_step]['strings'])}
-
-            self.state['counters'][element_id] = temp_counters
-            self.state['strings'][element_id] = temp_strings
+            self.snapshot_variables(element_id)
 
         # Do before
         if 'before' in matching_rules:
@@ -453,10 +765,11 @@ class Oven():
                     method(element, decl, 'before')
                 # deal w/ pending_elements, per rule
                 self.pop_pending_if_empty(element)
+        return matching_rules
 
-        # Recurse
-        for el in element.iter_children():
-            _state = self.build_recipe(el, step, depth=depth+1)  # noqa
+    def leave_element(self, element, step, matching_rules):
+        """Apply the rules of step that run after the children of element."""
+        element_id = element.etree_element.get('id')
 
         # Do after
         if 'after' in matching_rules:
@@ -495,16 +808,6 @@ class Oven():
              'outside_deferred' in matching_rules or
              'inside_deferred' in matching_rules):
 
-            # store strings and counters, in case a deferred rule changes one
-            if element_id:
-                temp_counters = {}
-                temp_strings = {}
-                for s_step in self.state['scope']:
-                    temp_counters[s_step] = {
-                        'counters': deepcopy(self.state[s_step]['counters'])}
-                    temp_strings[s_step] = {
-                        'strings': deepcopy(self.state[s_step]['strings'])}
-
             # Do straight up deferred
             if 'deferred' in matching_rules:
                 for rule, declarations in matching_rules.get('deferred'):
@@ -559,21 +862,15 @@ class Oven():
                         method = self.find_method(decl)
                         method(element, decl, 'inside')
 
-            # Did a deferred rule change a stored variable?
+            # Targets see the variables as the deferred rules left them
             if element_id:
-                for s_step in self.state['scope']:
-                    for counter, val in self.state[s_step]['counters'].items():
-                        if (counter not in temp_counters or
-                                temp_counters[counter] != val):
-                            self.state['counters'][element_id][s_step]['counters'][counter] = val  # NOQA
-                    for string, val in self.state[s_step]['strings'].items():
-                        if (string not in temp_strings or
-                                temp_strings[string] != val):
-                            self.state['strings'][element_id][s_step]['strings'][string] = val  # NOQA
+                self.snapshot_variables(element_id)
 
-        if depth == 0:
-            self.state[step]['recipe'] = True  # FIXME should ref HTML tree
-        return self.state[step]
+    def snapshot_variables(self, element_id):
+        """Store the strings and counters in scope for element_id."""
+        scope = self.state['scope']
+        self.state['counters'].snapshot(element_id, scope)
+        self.state['strings'].snapshot(element_id, scope)
 
     # Need target incase any declarations impact it
 
@@ -639,71 +936,54 @@ class Oven():
         is not found in the current steps store, earlier steps will be
         checked. If not found, '', 0, or (None, None) is returned.
         """
-        nullvals = {'strings': '', 'counters': 0, 'pending': (None, None)}
-        nullval = nullvals[vtype]
+        nullval = NULL_VALUES[vtype]
         vstyle = None
 
+        if vtype == 'pending':
+            for step in self.state['scope']:
+                if vname in self.state[step]['pending']:
+                    return (self.state[step]['pending'][vname], step)
+            return nullval
+
         if vtype == 'counters':
             if len(vname) > 1:
                 vname, vstyle = vname
             else:
                 vname = vname[0]
 
+        store = self.state[vtype]
         if target_id is not None:
             try:
-                state = self.state[vtype][target_id]
-                steps = self.state[vtype][target_id].keys()
+                val = store.lookup_snapshot(target_id, vname)
             except KeyError:
                 log(WARN, u'Bad ID target lookup {}'.format(
                     target_id).encode('utf-8'))
                 return nullval
-
         else:
-            state = self.state
-            steps = self.state['scope']
+            val = store.lookup(vname)
 
-        for step in steps:
-            if vname in state[step][vtype]:
-                if vtype == 'pending':
-                    return(state[step][vtype][vname], step)
-                else:
-                    val = state[step][vtype][vname]
-                    if vstyle is not None:
-                        return self.counter_style(val, vstyle)
-                    return val
-        else:
+        if val is UNSET:
             return nullval
+        if vstyle is not None:
+            return self.counter_style(val, vstyle)
+        return val
 
     def counter_style(self, val, style):
-        """Return counter value in given style."""
-        if style == 'decimal-leading-zero':
-            if val < 10:
-                valstr = "0{}".format(val)
-            else:
-                valstr = str(val)
-        elif style == 'lower-roman':
-            valstr = _to_roman(val).lower()
-        elif style == 'upper-roman':
-            valstr = _to_roman(val)
-        elif style == 'lower-latin' or style == 'lower-alpha':
-            if 1 <= val <= 26:
-                valstr = chr(val + 96)
-            else:
-                log(WARN, 'Counter out of range for latin (must be 1...26)')
-                valstr = str(val)
-        elif style == 'upper-latin' or style == 'upper-alpha':
-            if 1 <= val <= 26:
-                valstr = chr(val + 64)
-            else:
-                log(WARN, 'Counter out of range for latin (must be 1...26)')
-                valstr = str(val)
-        elif style == 'decimal':
-            valstr = str(val)
-        else:
+        """Return counter value in given style.
+
+        Values the style can not represent, and unknown styles, fall back
+        to decimal.
+        """
+        counter_style = COUNTER_STYLES.get(style)
+        if counter_style is None:
             log(WARN, u"ERROR: Counter numbering not supported for"
                 u" list type {}. Using decimal.".format(
                     style).encode('utf-8'))
-            valstr = str(val)
+            return str(val)
+        valstr = counter_style.format(val)
+        if valstr is None:
+            log(WARN, counter_style.out_of_range)
+            return str(val)
         return valstr
 
     def eval_string_value(self, element, value):
@@ -1332,6 +1612,18 @@ def split(li, *splitters):
     return [subl for subl in _itersplit(li, splitters) if subl]
 
 
+def read_css(css_in):
+    """Return the CSS of a path, file object or string as bytes."""
+    try:
+        with open(css_in, 'rb') as f:  # is it a path/filename?
+            return f.read()
+    except (IOError, TypeError):
+        try:
+            return css_in.read()  # Perhaps a file obj?
+        except AttributeError:
+            return css_in         # Treat it as a string
+
+
 def css_to_func(css, flags, css_namespaces, lang):
     """Convert a css selector to an xpath, supporting pseudo elements."""
     from cssselect import parse, HTMLTranslator
@@ -1359,6 +1651,7 @@ def css_to_func(css, flags, css_namespaces, lang):
 
     def toupper(u):
         """Use icu library for locale sensitive uppercasing (python2)."""
+        from icu import Locale, UnicodeString
         loc = Locale(lang) if lang else Locale()
         return UnicodeString(u).toUpper(loc).encode('utf-8').decode('utf-8')
 
@@ -1387,6 +1680,22 @@ def css_to_func(css, flags, css_namespaces, lang):
     return func
 
 
+def close_empty_elements(element):
+    """Make sure all elements that are not void get a closing tag.
+
+    Adds an empty string to each empty element. This is useful for browsers
+    that parse the output as HTML5 rather than as XHTML5. One use-case would
+    be users that inject the content into an existing HTML (not XHTML)
+    document.
+
+    Only the empty elements are selected, by XPath, without wrapping every
+    element of the tree.
+    """
+    for elt in EMPTY_ELEMENTS(element):
+        if elt.tag not in SELF_CLOSING_TAGS:
+            elt.text = ''
+
+
 def append_string(t, string):
     """Append a string to a node, as text or tail of last child."""
     node = t.tree
@@ -1413,9 +1722,14 @@ def prepend_string(t, string):
         node.text = string
 
 
+def make_collator(lang):
+    """Return an ICU collator for lang, importing ICU on first use."""
+    from icu import Collator, Locale
+    return Collator.createInstance(Locale(lang) if lang else Locale())
+
+
 def grouped_insert(t, value):
     """Insert value into the target tree 't' with correct grouping."""
-    collator = Collator.createInstance(Locale(t.lang) if t.lang else Locale())
     if value.tail is not None:
         val_prev = value.getprevious()
         if val_prev is not None:
@@ -1427,6 +1741,7 @@ def grouped_insert(t, value):
         value.tail = None
     if t.isgroup and t.sort(value) is not None:
         if t.groupby:
+            collator = make_collator(t.lang)
             for child in t.tree:
                 if child.get('class') == 'group-by':
                     # child[0] is the label span
@@ -1484,8 +1799,7 @@ def insert_sort(node, target):
 
     Uses sort function and language from target"""
     sort = target.sort
-    lang = target.lang
-    collator = Collator.createInstance(Locale(lang) if lang else Locale())
+    collator = make_collator(target.lang)
     for child in target.tree:
         if collator.compare(sort(child) or '', sort(node) or '') > 0:
             child.addprevious(node)
@@ -1502,9 +1816,7 @@ def insert_group(node, target):
     and a second child that will be accumulated in the group.
     """
     group = target.sort
-    lang = target.lang
-
-    collator = Collator.createInstance(Locale(lang) if lang else Locale())
+    collator = make_collator(target.lang)
     for child in target.tree:
         order = collator.compare(group(child) or '', group(node) or '')
         if order == 0:
@@ -1565,39 +1877,33 @@ def extract_selector_info(sel):
     return (steps, extras)
 
 
-# convert integer to Roman numeral.
-# From http://www.diveintopython.net/unit_testing/romantest.html
-def _to_roman(num):
-    """Convert integer to roman numerals."""
-    roman_numeral_map = (
-        ('M',  1000),
-        ('CM', 900),
-        ('D',  500),
-        ('CD', 400),
-        ('C',  100),
-        ('XC', 90),
-        ('L',  50),
-        ('XL', 40),
-        ('X',  10),
-        ('IX', 9),
-        ('V',  5),
-        ('IV', 4),
-        ('I',  1)
-    )
-    if not (0 < num < 5000):
-        log(WARN, 'Number out of range for roman (must be 1..4999)')
-        return str(num)
-    result = ''
-    for numeral, integer in roman_numeral_map:
-        while num >= integer:
-            result += numeral
-            num -= integer
-    return result
+def subject_attribute(sel):
+    """Return the (name, value) an attribute of the subject must equal.
+
+    The first ``[name="value"]`` test of the last compound selector of the
+    parsed selector sel, without namespace and with a lowercase name, else
+    None.
+    """
+    from cssselect2.parser import AttributeSelector, CombinedSelector
+    node = sel.parsed_tree
+    if isinstance(node, CombinedSelector):
+        node = node.right
+    for simple_selector in getattr(node, 'simple_selectors', ()):
+        if (isinstance(simple_selector, AttributeSelector) and
+                simple_selector.operator == '=' and
+                simple_selector.namespace == '' and
+                simple_selector.name == simple_selector.lower_name):
+            return simple_selector.name, simple_selector.value
+    return None
 
 
 def copy_w_id_suffix(elem, suffix="_copy"):
-    """Make a deep copy of the provided tree, altering ids."""
+    """Make a deep copy of the provided tree, altering ids.
+
+    The id attributes of the copy are found by one compiled XPath, each
+    result knows its element, no element without id is wrapped.
+    """
     mycopy = deepcopy(elem)
-    for id_elem in mycopy.xpath('//*[@id]'):
-        id_elem.set('id', id_elem.get('id') + suffix)
+    for id_value in ID_ATTRIBUTES(mycopy):
+        id_value.getparent().set('id', id_value + suffix)
     return mycopy
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Bake the partitions of a book, such as its chapters, in parallel.
+
+A partition selector (``div[data-type="chapter"]``) splits the document
+into partitions, the outermost elements it matches. A pass that only works
+inside each partition is baked on all partitions at once, in worker
+processes, and the baked partitions are put back into the document. Other
+passes bake serially, or make the bake fail in strict mode.
+
+A pass bakes in parallel only if:
+
+- none of its rules match an element outside the partitions,
+- it uses no ``target-*()`` references, and no ``uuid()`` with repeatable
+  ids, which number across the book,
+- it shares no counter, string or bucket with another pass,
+- every counter it uses is reset, and every string it reads is set, by a
+  rule matching each partition element itself,
+- no rule wraps (``::outside``) or moves a partition element,
+- every bucket filled in a partition is emptied in that partition.
+
+Each worker is sent a skeleton of the document holding only its own
+partitions, see skeleton, so a pass costs about one copy of the book
+whatever the number of workers.
+"""
+import logging
+import multiprocessing
+import sys
+from copy import deepcopy
+from logging import INFO
+
+from cssselect2 import ElementWrapper, compile_selector_list
+from lxml import etree
+
+from .analysis import analyze, names, rule_usage
+from .oven import Oven, close_empty_elements, log, read_css
+
+logger = logging.getLogger('cnx-easybake')
+
+if sys.version_info > (3,):
+    basestring = str
+
+# The recipe and partition selector of a worker process
+_oven = None
+_selectors = None
+
+
+class PartitionError(ValueError):
+    """A pass can not be baked one partition at a time."""
+
+
+def find_partitions(element, selectors):
+    """Split the tree into partitions.
+
+    Returns the ElementWrappers of the outermost elements matching the
+    compiled selectors and of the elements outside them, both in tree
+    order.
+    """
+    partitions = []
+    outside = []
+
+    def walk(wrapper):
+        if any(selector.test(wrapper) for selector in selectors):
+            partitions.append(wrapper)
+        else:
+            outside.append(wrapper)
+            for child in wrapper.iter_children():
+                walk(child)
+
+    walk(ElementWrapper.from_html_root(element))
+    return partitions, outside
+
+
+def skeleton(element, partitions):
+    """Return what selectors see of the tree element around partitions.
+
+    A new tree with copies of the partitions, etree elements of the tree,
+    and of their ancestors, with the child elements of these ancestors as
+    stubs: their tag and attributes, without content but for a space of
+    text if they were not empty. The head, giving the language of the
+    document, is copied whole. Selectors match the partitions of the
+    skeleton as they match the partitions of the tree, whatever they test
+    of their ancestors and siblings.
+
+    Returns the skeleton and the copies of the partitions, in tree order.
+    """
+    partitions = set(partitions)
+    ancestors = set(ancestor for partition in partitions
+                    for ancestor in partition.iterancestors())
+    copies = []
+
+    def copy(original, parent):
+        if original in partitions or (
+                parent is not None and parent.getparent() is None and
+                etree.QName(original).localname == 'head'):
+            new = deepcopy(original)
+            new.tail = None
+            parent.append(new)
+            if original in partitions:
+                copies.append(new)
+            return new
+        if parent is None:
+            new = etree.Element(original.tag, original.attrib,
+                                nsmap=original.nsmap)
+        else:
+            new = etree.SubElement(parent, original.tag, original.attrib)
+        if original in ancestors:
+            new.text = original.text
+            for child in original:
+                if isinstance(child.tag, basestring):
+                    copy(child, new)
+        elif original.text or len(original):
+            new.text = original.text or u' '
+        return new
+
+    return copy(element, None), copies
+
+
+def _init_worker(css, use_repeatable_ids, selector):
+    """Parse the recipe and the partition selector in a worker process."""
+    global _oven, _selectors
+    _oven = Oven(css, use_repeatable_ids)
+    _selectors = compile_selector_list(selector, _oven.css_namespaces)
+
+
+def _bake_partitions(html, step, indexes):
+    """Bake one pass on some partitions of a document, in a worker.
+
+    Returns the baked partition elements as bytes, or None if one of them
+    left content in a bucket for the rest of the book.
+    """
+    element = etree.fromstring(html)
+    partitions, _ = find_partitions(element, _selectors)
+    results = []
+    for index in indexes:
+        _oven.clear_state()
+        _oven.bake_step(element, step, partitions[index])
+        if _oven.state[step]['pending']:
+            return None
+        results.append(etree.tostring(partitions[index].etree_element,
+                                      with_tail=False))
+    return results
+
+
+def _bake_chunk(task):
+    """Unpack the arguments of _bake_partitions, for Pool.map."""
+    return _bake_partitions(*task)
+
+
+def _replace(partition, html):
+    """Replace the content of partition with the baked partition html."""
+    baked = etree.fromstring(html)
+    partition.tag = baked.tag
+    partition.attrib.clear()
+    partition.attrib.update(baked.attrib)
+    partition.text = baked.text
+    for child in list(partition):
+        partition.remove(child)
+    for child in list(baked):
+        partition.append(child)
+
+
+class PartitionBaker(object):
+    """Bake passes that stay inside partitions in worker processes."""
+
+    def __init__(self, css_in, selector, workers=None,
+                 use_repeatable_ids=False, strict=False):
+        """Bake with the recipe css_in, split by the CSS selector.
+
+        With strict, a pass that can not be baked one partition at a time
+        raises a PartitionError instead of baking serially.
+        """
+        self.css = read_css(css_in)
+        self.selector = selector
+        self.workers = workers or multiprocessing.cpu_count()
+        self.use_repeatable_ids = use_repeatable_ids
+        self.strict = strict
+        self.oven = Oven(self.css, use_repeatable_ids)
+        self.selectors = compile_selector_list(selector,
+                                               self.oven.css_namespaces)
+        self.usages = analyze(self.oven)
+        self.pool = None
+
+    def shared_names(self, step):
+        """Return the names step shares with other passes, sorted."""
+        used = names(self.usages[step])
+        shared = set()
+        for other in self.oven.steps:
+            if other != step:
+                shared |= used & names(self.usages[other])
+        return sorted(u'{} {}'.format(kind, name) for kind, name in shared)
+
+    def check(self, step, partitions, outside):
+        """Return why step can not bake one partition at a time, or None."""
+        usage = self.usages[step]
+        if not partitions:
+            return u'no partitions match {}'.format(self.selector)
+        if usage['targets']:
+            return u'uses target-* references'
+        if usage['uuid'] and self.use_repeatable_ids:
+            return u'numbers repeatable ids across partitions'
+        shared = self.shared_names(step)
+        if shared:
+            return u'shares {} with other passes'.format(u', '.join(shared))
+
+        matcher = self.oven.matchers[step]
+        for wrapper in outside:
+            for _, _, _, (rule, _, _) in matcher.match(wrapper):
+                return u'rule {} matches outside the partitions'.format(
+                    rule[1].strip())
+
+        used_counters = (usage['counters_incremented'] |
+                         usage['counters_read'])
+        for wrapper in partitions:
+            reset = set()
+            strings = set()
+            for _, _, _, (rule, declarations, label) in \
+                    matcher.match(wrapper):
+                rule_use = rule_usage(declarations)
+                if label is not None and 'outside' in label:
+                    return u'rule {} wraps a partition'.format(
+                        rule[1].strip())
+                if label in (None, 'deferred') and rule_use['moves']:
+                    return u'rule {} moves a partition'.format(
+                        rule[1].strip())
+                if label is None:
+                    reset |= rule_use['counters_reset']
+                    strings |= rule_use['strings_set']
+            missing = used_counters - reset
+            if missing:
+                return u'counters {} carry over between partitions'.format(
+                    u', '.join(sorted(missing)))
+            missing = usage['strings_read'] - strings
+            if missing:
+                return u'strings {} carry over between partitions'.format(
+                    u', '.join(sorted(missing)))
+
+    def bake_parallel(self, element, step, partitions):
+        """Bake step on all partitions in the workers.
+
+        Returns False, leaving the document as it was, if a partition left
+        content in a bucket.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.workers, _init_worker,
+                (self.css, self.use_repeatable_ids, self.selector))
+        chunk = (len(partitions) + self.workers - 1) // self.workers
+        tasks = []
+        for start in range(0, len(partitions), chunk):
+            tree, copies = skeleton(element, [
+                wrapper.etree_element
+                for wrapper in partitions[start:start + chunk]])
+            copies = set(copies)
+            found, _ = find_partitions(tree, self.selectors)
+            indexes = [index for index, wrapper in enumerate(found)
+                       if wrapper.etree_element in copies]
+            tasks.append((etree.tostring(tree), step, indexes))
+        results = self.pool.map(_bake_chunk, tasks)
+        if any(result is None for result in results):
+            return False
+        baked = [html for result in results for html in result]
+        for wrapper, html in zip(partitions, baked):
+            _replace(wrapper.etree_element, html)
+            self.oven.mark_changed(wrapper.etree_element)
+        return True
+
+    def bake(self, element, last_step=None):
+        """Bake the HTML tree element, in parallel where possible.
+
+        Returns a list of (pass, reason) for each pass baked, the reason is
+        None for passes baked one partition at a time.
+        """
+        if isinstance(element, etree._ElementTree):
+            element = element.getroot()
+        oven = self.oven
+        oven.clear_state()
+        oven.state['steps'] = oven.steps_before(last_step)
+        report = []
+        for step in oven.state['steps']:
+            partitions, outside = find_partitions(element, self.selectors)
+            reason = self.check(step, partitions, outside)
+            if reason is None and not self.bake_parallel(element, step,
+                                                         partitions):
+                reason = u'buckets are emptied outside their partition'
+            if reason is not None:
+                if self.strict:
+                    raise PartitionError(u'Pass {}: {}'.format(step, reason))
+                log(INFO, u'Baking pass {} serially: {}'.format(
+                    step, reason).encode('utf-8'))
+                oven.bake_step(element, step)
+            else:
+                log(INFO, u'Baked pass {} on {} partitions'.format(
+                    step, len(partitions)).encode('utf-8'))
+            report.append((step, reason))
+        if self.oven.close_empty:
+            close_empty_elements(element)
+        return report
+
+    def close(self):
+        """Stop the worker processes."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
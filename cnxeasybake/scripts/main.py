@@ -4,24 +4,74 @@ from __future__ import print_function
 
 import argparse
 import logging
+import os
 import sys
-from lxml import etree
-
-from cnxeasybake import Oven, __version__
 
 logger = logging.getLogger('cnx-easybake')
 
 
 def easybake(css_in, html_in=sys.stdin, html_out=sys.stdout, last_step=None,
-             coverage_file=None, use_repeatable_ids=False):
-    """Process the given HTML file stream with the css stream."""
-    html_doc = etree.parse(html_in)
-    oven = Oven(css_in, use_repeatable_ids)
-    oven.bake(html_doc, last_step)
+             coverage_file=None, use_repeatable_ids=False, partition=None,
+             workers=None, cache_dir=None, huge_tree=False,
+             remove_blank_text=False, close_empty=True):
+    """Process the given HTML file stream with the css stream.
+
+    html_in and html_out can also be paths, compressed by their suffix
+    (.gz, .bz2 or .xz), or - for stdin and stdout. With a partition
+    selector, passes that stay inside the partitions are baked in parallel
+    worker processes. With a cache directory, output cached for the same
+    HTML, recipe and options is copied instead of baking, unless writing a
+    coverage file. huge_tree and remove_blank_text configure the parser,
+    see cnxeasybake.files.make_parser. Without close_empty, empty elements
+    are left self-closed, for consumers parsing the output as XHTML.
+    """
+    from io import BytesIO
+    from lxml import etree
+    from cnxeasybake.files import (
+        make_parser, read_bytes, read_html, write_bytes)
+
+    cache = None
+    if cache_dir is not None and coverage_file is None:
+        from cnxeasybake import __version__
+        from cnxeasybake.cache import OutputCache, cache_key
+        css_in = css_in.read()
+        html = read_bytes(html_in)
+        key = cache_key(css_in, html, last_step, use_repeatable_ids,
+                        __version__, remove_blank_text, close_empty)
+        cache = OutputCache(cache_dir)
+        baked = cache.get(key)
+        if baked is not None:
+            logger.info(u'Using the output cached as {}'.format(key))
+            write_bytes(baked + b'\n', html_out)
+            return
+        html_in = BytesIO(html)
+
+    from cnxeasybake import Oven
+
+    html_doc = read_html(html_in, make_parser(huge_tree, remove_blank_text))
+    if partition:
+        from cnxeasybake.partition import PartitionBaker
+        baker = PartitionBaker(css_in, partition, workers,
+                               use_repeatable_ids)
+        oven = baker.oven
+        oven.close_empty = close_empty
+        try:
+            baker.bake(html_doc, last_step)
+        finally:
+            baker.close()
+    else:
+        oven = Oven(css_in, use_repeatable_ids, close_empty=close_empty)
+        oven.bake(html_doc, last_step)
 
     # serialize out HTML
-    print(etree.tostring(html_doc, method="xml").decode('utf-8'),
-          file=html_out)
+    baked = etree.tostring(html_doc, method="xml")
+    if cache is not None:
+        from cnxeasybake.cache import cacheable
+        if cacheable(oven):
+            cache.put(key, baked)
+        else:
+            logger.info(u'Not caching the output, it has uuids')
+    write_bytes(baked + b'\n', html_out)
 
     # generate CSS coverage_file file
     if coverage_file:
@@ -41,24 +91,233 @@ class FileTypeExt(argparse.FileType):
         return super(FileTypeExt, self).__call__(string)
 
 
+class VersionAction(argparse.Action):
+    """Report the library version, looking it up only when asked for."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        super(VersionAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default,
+            nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from cnxeasybake import __version__
+        print(__version__)
+        parser.exit()
+
+
+def setup_logging(quiet=False, debug=False):
+    """Log to stderr, at the level chosen by the quiet and debug options."""
+    formatter = logging.Formatter('%(name)s %(levelname)s %(message)s')
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    use_quiet_log = (quiet and logging.ERROR)
+    use_debug_log = (debug and logging.DEBUG)
+
+    # Debug option takes higher priority than quiet warnings option
+    logger.setLevel(use_debug_log or use_quiet_log or logging.WARNING)
+
+
+def input_path(value):
+    """Check that an input path, or - for stdin, can be read."""
+    if value != '-' and not os.path.isfile(value):
+        raise argparse.ArgumentTypeError(
+            "can't open '{}'".format(value))
+    return value
+
+
+def recipe_arg(value):
+    """Parse a recipe given as [<id>=]<path>, the id defaults to its name."""
+    if '=' in value:
+        recipe_id, path = value.split('=', 1)
+    else:
+        path = value
+        recipe_id = os.path.splitext(os.path.basename(path))[0]
+    if not os.path.isfile(path):
+        raise argparse.ArgumentTypeError(
+            "can't open '{}'".format(path))
+    return recipe_id, os.path.abspath(path)
+
+
+def serve(argv=None):
+    """Commandline script serving bake requests with warm recipes."""
+    parser = argparse.ArgumentParser(
+        prog='cnx-easybake serve',
+        description="Bake raw HTML sent over HTTP, keeping the recipes "
+                    "parsed in memory between requests")
+    parser.add_argument('-r', '--recipe', action='append', required=True,
+                        type=recipe_arg, metavar='[<id>=]recipe.css',
+                        help='CSS3 recipe to serve, repeatable. The id '
+                        'defaults to the file name without extension')
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument('--socket', metavar='path.sock',
+                        help='listen on a Unix domain socket')
+    listen.add_argument('--port', type=int,
+                        help='listen on a TCP port (0 picks a free one)')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on with --port '
+                        '(default 127.0.0.1)')
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+                        help='number of bake processes (default one per CPU)')
+    parser.add_argument('--path-root', metavar='DIR',
+                        help='bake files under DIR named by the path query '
+                        'parameter (default: refuse path requests)')
+    parser.add_argument('--use-repeatable-ids', action='store_true',
+                        help="use repeatable id attributes instead of uuids "
+                        "which is useful for diffing")
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help='Send debugging info to stderr')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Quiet all on stderr except errors")
+    args = parser.parse_args(argv)
+    setup_logging(args.quiet, args.debug)
+    if args.path_root is not None and not os.path.isdir(args.path_root):
+        parser.error("--path-root: no such directory '{}'"
+                     .format(args.path_root))
+
+    from cnxeasybake.server import Baker, make_server
+
+    baker = Baker(dict(args.recipe), args.workers, args.use_repeatable_ids,
+                  args.path_root)
+    server = make_server(baker, args.socket, args.host, args.port)
+    if not args.quiet:
+        if args.socket:
+            where = args.socket
+        else:
+            where = 'http://{}:{}'.format(*server.server_address[:2])
+        print('Serving {} on {}'.format(', '.join(sorted(baker.recipes)),
+                                        where), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        baker.close()
+        if args.socket:
+            os.unlink(args.socket)
+
+
+def analyze(argv=None):
+    """Commandline script reporting what the passes of a recipe use."""
+    parser = argparse.ArgumentParser(
+        prog='cnx-easybake analyze',
+        description="Report the counters, strings and buckets each pass of "
+                    "a recipe uses, the dependencies between passes and the "
+                    "passes fused into one walk, or its dead rules")
+    parser.add_argument("css_rules",
+                        type=argparse.FileType('rb'),
+                        help="CSS3 ruleset stylesheet recipe")
+    parser.add_argument('--json', action='store_true',
+                        help='report as JSON')
+    parser.add_argument('--lint', action='store_true',
+                        help='report the rules and declarations that do '
+                        'nothing instead, exiting with status 1 if any')
+    parser.add_argument('-s', '--stop-at', action='store', metavar='<pass>',
+                        help='lint as if baking stopped just before given '
+                        'pass name')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Quiet all on stderr except errors")
+    args = parser.parse_args(argv)
+    setup_logging(args.quiet)
+
+    from cnxeasybake import Oven
+    from cnxeasybake.analysis import (
+        analyze, format_lint, format_report, lint, to_json)
+
+    try:
+        oven = Oven(args.css_rules)
+    finally:
+        args.css_rules.close()
+    if args.lint:
+        problems = lint(oven, args.stop_at)
+        if args.json:
+            import json
+            print(json.dumps([{'line': line, 'message': message}
+                              for line, message in problems], indent=2))
+        elif problems:
+            print(format_lint(problems))
+        return 1 if problems else 0
+    usages = analyze(oven)
+    if args.json:
+        import json
+        print(json.dumps(to_json(usages, oven.pass_groups), indent=2))
+    else:
+        print(format_report(usages, oven.pass_groups))
+
+
+def watch(args):
+    """Bake whenever the files given on the command line change."""
+    from cnxeasybake.files import make_parser
+    from cnxeasybake.watch import Watcher
+
+    args.css_rules.close()
+    watcher = Watcher(args.css_rules.name, args.html_in, args.html_out,
+                      args.stop_at,
+                      args.use_repeatable_ids, args.partition,
+                      None if args.quiet else sys.stderr,
+                      not args.xhtml,
+                      make_parser(args.huge_tree, args.remove_blank_text))
+    if not args.quiet:
+        print('Watching {} and {}'.format(args.css_rules.name, args.html_in),
+              file=sys.stderr)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def explain(args):
+    """Report what baking html_in does, pass by pass.
+
+    Actions are only counted, unless asked to bake html_in into html_out.
+    """
+    from lxml import etree
+    from cnxeasybake.explain import ExplainOven, format_report
+    from cnxeasybake.files import make_parser, read_html, write_bytes
+
+    bake = args.explain == 'bake'
+    html_doc = read_html(args.html_in, make_parser(args.huge_tree,
+                                                   args.remove_blank_text))
+    oven = ExplainOven(args.css_rules, args.use_repeatable_ids,
+                       close_empty=not args.xhtml)
+    plans = oven.explain(html_doc, args.stop_at, bake)
+    if bake:
+        write_bytes(etree.tostring(html_doc, method="xml") + b'\n',
+                    args.html_out)
+    print(format_report(plans, estimated=not bake))
+
+
 def main(argv=None):
     """Commandline script wrapping Baker."""
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'serve':
+        return serve(argv[1:])
+    if argv and argv[0] == 'analyze':
+        return analyze(argv[1:])
+
     parser = argparse.ArgumentParser(description="Process raw HTML to baked"
                                                  " (embedded numbering and"
-                                                 " collation)")
-    parser.add_argument('-v', '--version', action="version",
-                        version=__version__, help='Report the library version')
+                                                 " collation)",
+                                     epilog="Run 'cnx-easybake serve -h' "
+                                     "for baking from a persistent server "
+                                     "and 'cnx-easybake analyze -h' for the "
+                                     "dependencies between passes and dead "
+                                     "rules.")
+    parser.add_argument('-v', '--version', action=VersionAction,
+                        help='Report the library version')
     parser.add_argument("css_rules",
                         type=argparse.FileType('rb'),
                         help="CSS3 ruleset stylesheet recipe")
-    parser.add_argument("html_in", nargs="?",
-                        type=argparse.FileType('r'),
+    parser.add_argument("html_in", nargs="?", type=input_path,
                         help="raw HTML file to bake (default stdin)",
-                        default=sys.stdin)
+                        default='-')
     parser.add_argument("html_out", nargs="?",
-                        type=argparse.FileType('w'),
                         help="baked HTML file output (default stdout)",
-                        default=sys.stdout)
+                        default='-')
     parser.add_argument('-s', '--stop-at', action='store', metavar='<pass>',
                         help='Stop baking just before given pass name')
     parser.add_argument('-d', '--debug', action='store_true',
@@ -72,32 +331,76 @@ def main(argv=None):
     parser.add_argument('--use-repeatable-ids', action='store_true',
                         help="use repeatable id attributes instead of uuids "
                         "which is useful for diffing")
+    parser.add_argument('-p', '--partition', metavar='<selector>',
+                        help="bake passes that stay inside the elements "
+                        "matching this selector (e.g. chapters) in parallel")
+    parser.add_argument('-w', '--workers', type=int, metavar='<n>',
+                        help="worker processes for --partition (default: "
+                        "one per CPU)")
+    parser.add_argument('--cache-dir', metavar='<dir>',
+                        help="copy the output cached in this directory for "
+                        "the same html_in, recipe and options instead of "
+                        "baking, caching it after baking otherwise")
+    parser.add_argument('--watch', action='store_true',
+                        help="bake again whenever the recipe or html_in "
+                        "changes, until interrupted")
+    parser.add_argument('--huge-tree', action='store_true',
+                        help="lift the parser limits on deep trees and "
+                        "long texts, for very large books")
+    parser.add_argument('--remove-blank-text', action='store_true',
+                        help="drop whitespace-only text between elements "
+                        "when parsing, if the recipe does not depend on it")
+    parser.add_argument('--xhtml', action='store_true',
+                        help="leave empty elements self-closed instead of "
+                        "closing them for HTML parsers, when the output is "
+                        "parsed as XHTML")
+    parser.add_argument('--explain', action='store_const', const='match',
+                        help="report the rules matched, actions, buckets "
+                        "and costly operations of each pass instead of "
+                        "baking, estimating the passes after the first")
+    parser.add_argument('--explain-bake', action='store_const',
+                        const='bake', dest='explain',
+                        help="like --explain with exact counts for all "
+                        "passes, at the cost of a full bake writing "
+                        "html_out")
     args = parser.parse_args(argv)
+    if args.partition and args.coverage_file:
+        parser.error('--coverage-file can not be used with --partition')
+    if args.explain and (args.watch or args.coverage_file or
+                         args.partition):
+        parser.error('--explain can not be used with --watch, '
+                     '--coverage-file or --partition')
+    if args.explain == 'bake' and args.html_out == '-':
+        parser.error('--explain-bake needs an html_out file')
+    if args.watch:
+        if args.html_in == '-' or args.html_out == '-':
+            parser.error('--watch needs html_in and html_out files')
+        if args.coverage_file:
+            parser.error('--coverage-file can not be used with --watch')
+    if args.watch or args.explain:
+        for option, value in (('--cache-dir', args.cache_dir),
+                              ('--workers', args.workers)):
+            if value is not None:
+                parser.error('{} can not be used with --watch or --explain'
+                             .format(option))
+    setup_logging(args.quiet, args.debug)
 
-    formatter = logging.Formatter('%(name)s %(levelname)s %(message)s')
-    handler = logging.StreamHandler(sys.stderr)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-
-    use_quiet_log = (args.quiet and logging.ERROR)
-    use_debug_log = (args.debug and logging.DEBUG)
-
-    # Debug option takes higher priority than quiet warnings option
-    logger.setLevel(use_debug_log or use_quiet_log or logging.WARNING)
+    if args.watch:
+        return watch(args)
 
     try:
+        if args.explain:
+            return explain(args)
         easybake(args.css_rules, args.html_in, args.html_out, args.stop_at,
-                 args.coverage_file, args.use_repeatable_ids)
+                 args.coverage_file, args.use_repeatable_ids, args.partition,
+                 args.workers, args.cache_dir, args.huge_tree,
+                 args.remove_blank_text, not args.xhtml)
     finally:
         if args.css_rules:
             args.css_rules.close()
-        if args.html_in:
-            args.html_in.close()
-        if args.html_out:
-            args.html_out.close()
         if args.coverage_file:
             args.coverage_file.close()
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Serve baking over HTTP from a persistent process.
+
+Recipes are parsed once per worker process and kept warm in memory. Bake
+requests are handed to a pool of worker processes, so several documents
+bake at the same time. The server listens on a Unix domain socket or on a
+localhost TCP port and answers:
+
+    GET  /health              {"status": "ok"}
+    GET  /stats               request, error and per recipe timing counts
+    GET  /recipes             the ids of the loaded recipes
+    POST /bake/<recipe-id>    bake the raw HTML in the request body, or the
+                              file named by the ``path`` query parameter;
+                              ``stop-at`` is passed on as the last step.
+                              Responds with the baked HTML.
+
+Any client reaching the socket or port could name any file the server can
+read, so ``path`` is refused unless the Baker has a ``path_root``, and then
+only names files under that directory.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import stat
+import threading
+import time
+from io import BytesIO
+from timeit import default_timer as timer
+
+try:
+    from http.client import HTTPConnection
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import parse_qs, unquote, urlsplit
+except ImportError:  # Python 2
+    from httplib import HTTPConnection
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urllib import unquote
+    from urlparse import parse_qs, urlsplit
+
+logger = logging.getLogger('cnx-easybake')
+
+# The warm recipes of a worker process: recipe id -> Oven
+_ovens = {}
+
+
+def _init_worker(recipes, use_repeatable_ids):
+    """Parse all recipes once, when a worker process starts."""
+    from .oven import Oven
+    # Interrupts are for the server process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for recipe_id, css_path in recipes.items():
+        _ovens[recipe_id] = Oven(css_path, use_repeatable_ids)
+
+
+def _bake(recipe_id, html=None, path=None, last_step=None):
+    """Bake one document in a worker process.
+
+    Returns a dict with either the baked ``html`` and the ``seconds`` the
+    bake took, or an ``error`` message and the HTTP ``status`` to report.
+    """
+    from lxml import etree
+    from .files import read_html
+    try:
+        html_doc = read_html(path if path is not None else BytesIO(html))
+    except (IOError, etree.XMLSyntaxError) as error:
+        return {'status': 400, 'error': u'Bad input: {}'.format(error)}
+    try:
+        start = timer()
+        _ovens[recipe_id].bake(html_doc, last_step)
+        seconds = timer() - start
+    except Exception as error:
+        logger.exception(u'Bake with recipe {} failed'.format(recipe_id))
+        return {'status': 500, 'error': u'Bake failed: {!r}'.format(error)}
+    return {'html': etree.tostring(html_doc, method='xml'),
+            'seconds': seconds}
+
+
+class Baker(object):
+    """Bake with warm recipes in a pool of worker processes."""
+
+    def __init__(self, recipes, workers=None, use_repeatable_ids=False,
+                 path_root=None):
+        """Start workers baking with recipes, a dict of id to CSS path.
+
+        Documents are only read from paths under the directory path_root,
+        and not at all without it.
+        """
+        self.recipes = dict(recipes)
+        self.path_root = path_root and os.path.realpath(path_root)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.workers, _init_worker,
+                                         (self.recipes, use_repeatable_ids))
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.recipe_stats = dict((recipe_id, {'bakes': 0, 'seconds': 0.0})
+                                 for recipe_id in self.recipes)
+
+    def count(self, result):
+        """Record a request and its result in the stats."""
+        with self.lock:
+            self.requests += 1
+            if 'error' in result:
+                self.errors += 1
+
+    def resolve(self, path):
+        """Return the real path of path under path_root, or None.
+
+        A relative path is taken from path_root. None is returned without a
+        path_root, or when path, links followed, is outside of it.
+        """
+        if self.path_root is None:
+            return None
+        resolved = os.path.realpath(os.path.join(self.path_root, path))
+        if not resolved.startswith(self.path_root.rstrip(os.sep) + os.sep):
+            return None
+        return resolved
+
+    def bake(self, recipe_id, html=None, path=None, last_step=None):
+        """Bake html bytes, or the file at path, with a loaded recipe.
+
+        Returns the result dict of the worker, see ``_bake``, or a 403
+        error when path is not under path_root, see resolve.
+        """
+        if recipe_id not in self.recipes:
+            result = {'status': 404,
+                      'error': u'Unknown recipe: {}'.format(recipe_id)}
+            self.count(result)
+            return result
+        if path is not None:
+            resolved = self.resolve(path)
+            if resolved is None:
+                if self.path_root is None:
+                    message = u'Path requests are not enabled'
+                else:
+                    message = u'Path not under {}: {}'.format(
+                        self.path_root, path)
+                result = {'status': 403, 'error': message}
+                self.count(result)
+                return result
+            path = resolved
+        with self.lock:
+            self.in_flight += 1
+        try:
+            result = self.pool.apply(_bake,
+                                     (recipe_id, html, path, last_step))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        self.count(result)
+        if 'seconds' in result:
+            with self.lock:
+                self.recipe_stats[recipe_id]['bakes'] += 1
+                self.recipe_stats[recipe_id]['seconds'] += result['seconds']
+        return result
+
+    def stats(self):
+        """Return a snapshot of the request counts and bake timings."""
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'uptime': time.time() - self.started,
+                'workers': self.workers,
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'recipes': dict((recipe_id, dict(stats))
+                                for recipe_id, stats
+                                in self.recipe_stats.items()),
+            }
+
+    def close(self):
+        """Stop the worker processes."""
+        self.pool.terminate()
+        self.pool.join()
+
+
+class BakeRequestHandler(BaseHTTPRequestHandler):
+    """Answer HTTP requests with the Baker of the server."""
+
+    server_version = 'cnx-easybake'
+
+    def send_body(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data, sort_keys=True)
+                       .encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        """Report health, stats or recipes."""
+        path = urlsplit(self.path).path
+        baker = self.server.baker
+        if path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif path == '/stats':
+            self.send_json(200, baker.stats())
+        elif path == '/recipes':
+            self.send_json(200, {'recipes': sorted(baker.recipes)})
+        else:
+            self.send_json(404, {'error': u'Not found: {}'.format(path)})
+
+    def do_POST(self):
+        """Bake the posted document, or the document at ?path=."""
+        url = urlsplit(self.path)
+        if not url.path.startswith('/bake/'):
+            self.send_json(404, {'error': u'Not found: {}'.format(url.path)})
+            return
+        recipe_id = unquote(url.path[len('/bake/'):])
+        query = dict((key, values[-1])
+                     for key, values in parse_qs(url.query).items())
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_json(411, {'error': u'Content-Length required'})
+            return
+        html = self.rfile.read(int(length))
+        if 'path' not in query and not html:
+            self.send_json(400, {'error': u'No HTML posted and no path'})
+            return
+
+        result = self.server.baker.bake(recipe_id, html or None,
+                                        query.get('path'),
+                                        query.get('stop-at'))
+        if 'error' in result:
+            self.send_json(result['status'], {'error': result['error']})
+        else:
+            self.send_body(200, result['html'],
+                           'application/xhtml+xml; charset=utf-8',
+                           [('X-Bake-Seconds',
+                             '{:.6f}'.format(result['seconds']))])
+
+    def log_message(self, format, *args):
+        """Log requests to the cnx-easybake logger, at debug level."""
+        logger.debug(format % args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server on a TCP port, one thread per request."""
+
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """HTTP server on a Unix domain socket, one thread per request."""
+
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        request, _ = UnixStreamServer.get_request(self)
+        return request, ('local', 0)
+
+
+def make_server(baker, socket_path=None, host='127.0.0.1', port=0):
+    """Return an HTTP server for baker on socket_path or on host:port.
+
+    A stale socket file left at socket_path is replaced.
+    """
+    if socket_path is not None:
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)
+        except OSError:
+            pass
+        server = ThreadingUnixHTTPServer(socket_path, BakeRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), BakeRequestHandler)
+    server.baker = baker
+    return server
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP client connection over a Unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the asyncio baking API."""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from io import BytesIO
+
+from lxml import etree
+
+here = os.path.abspath(os.path.dirname(__file__))
+TWO_PASS_CSS = os.path.join(here, 'rulesets', 'two_pass.css')
+
+
+def _read(name):
+    with open(os.path.join(here, 'html', name), 'rb') as f:
+        return f.read()
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio API needs Python 3.5')
+class BakeAsyncTestCase(unittest.TestCase):
+    """Bake from an event loop."""
+
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tmpdir = tempfile.mkdtemp()
+        self.html = _read('two_pass_raw.html')
+        self.expected = self.bake_directly()
+
+    def tearDown(self):
+        import asyncio
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        shutil.rmtree(self.tmpdir)
+
+    def bake_directly(self):
+        from ..oven import Oven
+        html_doc = etree.parse(BytesIO(self.html))
+        Oven(TWO_PASS_CSS).bake(html_doc)
+        return etree.tostring(html_doc, method='xml')
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_bake_bytes(self):
+        from ..aio import bake_async
+        self.assertEqual(self.wait(bake_async(TWO_PASS_CSS, self.html)),
+                         self.expected)
+
+    def test_parser(self):
+        """Bytes are parsed like files, with the configured parser."""
+        from ..aio import AsyncBaker
+        from ..files import make_parser
+        html = (b'<!DOCTYPE html [<!ENTITY e "E">]>'
+                b'<html><body> <p>&e;</p></body></html>')
+        css = b'p { class: "a"; }'
+        baker = AsyncBaker(1)
+        try:
+            baked = self.wait(baker.bake(css, html))
+        finally:
+            baker.close()
+        self.assertIn(b'<body> <p class="a">&e;</p></body>', baked)
+        baker = AsyncBaker(1, parser=make_parser(remove_blank_text=True))
+        try:
+            baked = self.wait(baker.bake(css, html))
+        finally:
+            baker.close()
+        self.assertIn(b'<body><p class="a">&e;</p></body>', baked)
+
+    def test_parser_not_shared(self):
+        """Each bake parses with its own copy of the configured parser."""
+        from .. import aio
+        from ..files import make_parser
+        configured = make_parser(remove_blank_text=True)
+        parsers = []
+        parse = aio._parse
+
+        def recording_parse(source, parser=None):
+            parsers.append(parser)
+            return parse(source, parser)
+
+        aio._parse = recording_parse
+        baker = aio.AsyncBaker(2, parser=configured)
+        try:
+            self.wait(baker.bake(TWO_PASS_CSS, self.html))
+            self.wait(baker.bake(TWO_PASS_CSS, self.html))
+        finally:
+            aio._parse = parse
+            baker.close()
+        self.assertEqual(len(parsers), 2)
+        self.assertIsNot(parsers[0], configured)
+        self.assertIsNot(parsers[0], parsers[1])
+
+    def test_bake_with_oven(self):
+        from ..aio import bake_async
+        from ..oven import Oven
+        oven = Oven(TWO_PASS_CSS)
+        self.assertEqual(self.wait(bake_async(oven, self.html)),
+                         self.expected)
+        self.assertEqual(self.wait(bake_async(oven, self.html)),
+                         self.expected)
+
+    def test_paths_and_files(self):
+        from ..aio import bake_async
+        source = os.path.join(self.tmpdir, 'raw.html')
+        sink = os.path.join(self.tmpdir, 'baked.html')
+        with open(source, 'wb') as f:
+            f.write(self.html)
+        self.assertIsNone(self.wait(bake_async(TWO_PASS_CSS, source, sink)))
+        with open(sink, 'rb') as f:
+            self.assertEqual(f.read(), self.expected)
+
+        output = BytesIO()
+        self.wait(bake_async(TWO_PASS_CSS, BytesIO(self.html), output))
+        self.assertEqual(output.getvalue(), self.expected)
+
+    def test_bake_tree(self):
+        from ..aio import bake_async
+        html_doc = etree.parse(BytesIO(self.html))
+        self.assertEqual(self.wait(bake_async(TWO_PASS_CSS, html_doc)),
+                         self.expected)
+        self.assertEqual(etree.tostring(html_doc, method='xml'),
+                         self.expected)
+
+    def test_cancel_between_passes(self):
+        import asyncio
+        from ..aio import AsyncBaker
+        from ..oven import Oven
+        oven = Oven(TWO_PASS_CSS)
+        started = threading.Event()
+        release = threading.Event()
+        steps = []
+        build_recipe = oven.build_recipe
+
+        def blocking_build_recipe(element, step, depth=0):
+            if depth == 0:
+                steps.append(step)
+                started.set()
+                release.wait(5)
+            return build_recipe(element, step, depth=depth)
+
+        oven.build_recipe = blocking_build_recipe
+        baker = AsyncBaker(1)
+        try:
+            task = self.loop.create_task(baker.bake(oven, self.html))
+            self.wait(self.loop.run_in_executor(None, started.wait, 5))
+            task.cancel()
+            # The task sees the cancellation before the pass finishes
+            self.loop.call_soon(release.set)
+            with self.assertRaises(asyncio.CancelledError):
+                self.wait(task)
+        finally:
+            baker.close()
+        self.assertEqual(steps, [oven.steps[0]])
+        self.assertGreater(len(oven.steps), 1)
+
+    def test_bounded_concurrency(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from .. import aio
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+        parse = aio._parse
+
+        def slow_parse(source, parser=None):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return parse(source, parser)
+
+        aio._parse = slow_parse
+        executor = ThreadPoolExecutor(8)
+        baker = aio.AsyncBaker(2, executor)
+        try:
+            results = self.wait(asyncio.gather(*[
+                baker.bake(TWO_PASS_CSS, self.html) for _ in range(6)]))
+        finally:
+            aio._parse = parse
+            executor.shutdown()
+        self.assertEqual(results, [self.expected] * 6)
+        self.assertEqual(peak[0], 2)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the static analysis of recipes."""
+import json
+import os
+import unittest
+
+from lxml import etree
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+RECIPE = b'''
+body { counter-reset: chapter; string-set: book-title "Physics"; }
+div[data-type="chapter"] {
+  counter-increment: chapter;
+  string-set: chapter-title content();
+}
+:pass(2) div[data-type="exercise"] { move-to: eoc; }
+:pass(2) div[data-type="chapter"]::after {
+  content: "Chapter " counter(chapter) pending(eoc);
+}
+:pass(3) a.xref::after { content: target-string(attr(href), chapter-title); }
+:pass(4) div[data-type="note"] { copy-to: eoc; }
+:pass(5) table { class: "os-table"; }
+'''
+
+# Passes 0, 2 and 3 can share a walk, pass 4 reads the class pass 0 sets
+FUSION_RECIPE = b'''
+body { counter-reset: figure; }
+figure { class: "os-figure"; counter-increment: figure; }
+figcaption { string-set: caption content(); }
+:pass(2) span[data-type="term"] { attr-title: "term"; }
+:pass(3) body { counter-reset: caption; }
+:pass(3) figure { counter-increment: caption; }
+:pass(3) figcaption::before { content: "Figure " counter(caption) " "; }
+:pass(4) .os-figure::after { content: "End of figure"; }
+'''
+
+
+class AnalysisTestCase(unittest.TestCase):
+    """Find what passes read and write."""
+
+    def analyze(self, css=RECIPE):
+        from ..analysis import analyze
+        from ..oven import Oven
+        return analyze(Oven(css))
+
+    def test_rule_usage(self):
+        from tinycss2 import parse_declaration_list
+        from ..analysis import rule_usage
+        declarations = parse_declaration_list(
+            'counter-reset: a b 2; counter-increment: c; '
+            'string-set: s1 "x", s2 string(s3); move-to: bucket; '
+            'content: counter(d, lower-roman) pending(other) uuid() '
+            'first-letter(string(s4)) target-counter(attr(href), e)',
+            skip_whitespace=True)
+        usage = rule_usage(declarations)
+        self.assertEqual(usage['counters_reset'], set(['a', 'b']))
+        self.assertEqual(usage['counters_incremented'], set(['c']))
+        self.assertEqual(usage['counters_read'], set(['d', 'e']))
+        self.assertEqual(usage['strings_set'], set(['s1', 's2']))
+        self.assertEqual(usage['strings_read'], set(['s3', 's4']))
+        self.assertEqual(usage['buckets_filled'], set(['bucket']))
+        self.assertEqual(usage['buckets_drained'], set(['other']))
+        self.assertTrue(usage['moves'])
+        self.assertTrue(usage['uuid'])
+        self.assertTrue(usage['targets'])
+
+    def test_passes(self):
+        usages = self.analyze()
+        self.assertEqual(list(usages), ['0', '2', '3', '4', '5'])
+        self.assertEqual(usages['0']['counters_reset'], set(['chapter']))
+        self.assertEqual(usages['0']['strings_set'],
+                         set(['book-title', 'chapter-title']))
+        self.assertEqual(usages['2']['counters_read'], set(['chapter']))
+        self.assertEqual(usages['2']['buckets_filled'], set(['eoc']))
+        self.assertEqual(usages['2']['buckets_drained'], set(['eoc']))
+        self.assertEqual(usages['3']['strings_read'],
+                         set(['chapter-title']))
+
+    def test_dependencies(self):
+        from ..analysis import dependencies, independent
+        usages = self.analyze()
+        self.assertEqual(dependencies(usages), [
+            ('0', '2', 'counter', 'chapter'),
+            ('0', '3', 'string', 'chapter-title'),
+            ('2', '4', 'bucket', 'eoc'),
+        ])
+        self.assertTrue(independent(usages, '3', '5'))
+        self.assertTrue(independent(usages, '2', '3'))
+        self.assertFalse(independent(usages, '2', '4'))
+
+    def test_reports(self):
+        from ..analysis import format_report, to_json
+        usages = self.analyze()
+        report = format_report(usages)
+        self.assertIn(u'pass 2\n  counters read         chapter\n', report)
+        self.assertIn(u'  0 -> 3: string chapter-title', report)
+        self.assertNotIn(u'fused passes', report)
+        report = format_report(usages, [('0', '2'), ('3',)])
+        self.assertIn(u'fused passes\n  0, 2', report)
+        data = json.loads(json.dumps(to_json(usages)))
+        self.assertEqual(data['passes']['2']['buckets_filled'], ['eoc'])
+        self.assertNotIn('fused', data)
+        data = to_json(usages, [('0', '2'), ('3',)])
+        self.assertEqual(data['fused'], [['0', '2']])
+        self.assertEqual(data['dependencies'][2],
+                         {'from': '2', 'to': '4', 'kind': 'bucket',
+                          'name': 'eoc'})
+
+    def test_cli(self):
+        from .test_cli import captured_output
+        from ..scripts.main import main
+        with captured_output() as (out, err):
+            main(['analyze', '--json',
+                  os.path.join(here, 'rulesets', 'two_pass.css')])
+            stdout = str(out.getvalue())
+        data = json.loads(stdout)
+        self.assertEqual(list(data['passes']),
+                         ['counter(mine)', 'first', 'second'])
+        self.assertEqual(data['dependencies'],
+                         [{'from': 'first', 'to': 'second',
+                           'kind': 'string', 'name': 'onestring'}])
+        self.assertEqual(data['fused'], [])
+
+
+class FusionTestCase(unittest.TestCase):
+    """Share one walk between passes that do not interact."""
+
+    def groups(self, css):
+        from ..oven import Oven
+        return Oven(css).pass_groups
+
+    def test_fusion_groups(self):
+        self.assertEqual(self.groups(FUSION_RECIPE),
+                         [('0', '2', '3'), ('4',)])
+
+    def test_attribute_read(self):
+        self.assertEqual(self.groups(b'''
+            table { class: "os-table"; }
+            :pass(2) .os-table { data-label: "Table"; }
+            '''), [('0',), ('2',)])
+        self.assertEqual(self.groups(b'''
+            table { attr-title: "Table"; }
+            :pass(2) table::after { content: attr(title); }
+            '''), [('0',), ('2',)])
+
+    def test_copies(self):
+        self.assertEqual(self.groups(b'''
+            table { class: "os-table"; }
+            :pass(2) caption { string-set: title content(); }
+            :pass(3) table { copy-to: tables; }
+            '''), [('0', '2', '3')])
+        self.assertEqual(self.groups(b'''
+            table { class: "os-table"; }
+            :pass(2) table::after { content: content(); }
+            '''), [('0',), ('2',)])
+
+    def test_changes_tree(self):
+        self.assertEqual(self.groups(RECIPE),
+                         [('0',), ('2',), ('3',), ('4',), ('5',)])
+        self.assertEqual(self.groups(b'''
+            figure::before { content: "Figure"; }
+            :pass(2) table { class: "os-table"; }
+            '''), [('0',), ('2',)])
+
+    def test_shared_names(self):
+        self.assertEqual(self.groups(b'''
+            figure { counter-increment: figure; }
+            :pass(2) figcaption::before { content: counter(figure); }
+            '''), [('0',), ('2',)])
+
+    def test_same_output(self):
+        from ..benchmarks.book import generate_book
+        from ..oven import Oven
+        html = generate_book(chapters=3, sections=2, xrefs=1)
+        baked = []
+        for fuse_passes in (True, False):
+            oven = Oven(FUSION_RECIPE, fuse_passes=fuse_passes)
+            html_doc = etree.XML(html)
+            oven.bake(html_doc)
+            baked.append(etree.tostring(html_doc))
+        self.assertEqual(baked[0], baked[1])
+        self.assertIn(b'Figure 2 ', baked[0])
+        self.assertIn(b'class="os-figure"', baked[0])
+
+    def test_last_step(self):
+        from ..oven import Oven
+        oven = Oven(FUSION_RECIPE)
+        html_doc = etree.XML(b'<html><body><figure><figcaption>A'
+                             b'</figcaption></figure></body></html>')
+        steps = []
+        oven.bake(html_doc, '3', before_step=steps.append)
+        self.assertEqual(steps, ['0', '2'])
+        self.assertNotIn(b'Figure', etree.tostring(html_doc))
+
+
+LINT_RECIPE = b'''
+div[data-type="exercise"] { move-to: eoc; }
+div[data-type="note"] { copy-to: notes; }
+div[data-type="chapter"]::after {
+  content: pending(eoc) pending(glossary);
+  colour: red;
+}
+:pass(2) div[data-type="chapter"]::after { content: nodes(notes); }
+:pass(3) body::after { content: pending(eoc); }
+'''
+
+
+class LintTestCase(unittest.TestCase):
+    """Find the dead rules of a recipe."""
+
+    def lint(self, last_step=None):
+        from ..analysis import lint
+        from ..oven import Oven
+        return lint(Oven(LINT_RECIPE), last_step)
+
+    def test_lint(self):
+        self.assertEqual(self.lint(), [
+            (5, u'pending(glossary) drains a bucket no pass fills'),
+            (6, u'unknown declaration colour is ignored'),
+        ])
+
+    def test_last_step(self):
+        """Rules of passes not baked, and their buckets, are dead."""
+        self.assertEqual(self.lint('3'), [
+            (5, u'pending(glossary) drains a bucket no pass fills'),
+            (6, u'unknown declaration colour is ignored'),
+            (9, u':pass(3) body::after is in pass 3, not baked'),
+        ])
+        self.assertEqual(self.lint('2')[0],
+                         (3, u'copy-to: notes fills a bucket no pass drains'))
+
+    def test_cli(self):
+        from .test_cli import captured_output
+        from ..scripts.main import main
+        with captured_output() as (out, err):
+            status = main(['analyze', '--lint',
+                           os.path.join(here, 'rulesets', 'clear.css')])
+            stdout = str(out.getvalue())
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            stdout, 'line 7: clear(notrash) drains a bucket no pass fills\n')
+        with captured_output() as (out, err):
+            status = main(['analyze', '--lint', '--json',
+                           os.path.join(here, 'rulesets', 'two_pass.css')])
+            stdout = str(out.getvalue())
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(stdout), [])
+
+    def test_exit_status(self):
+        """Running the cli module exits with the lint status."""
+        import subprocess
+        import sys
+        command = [sys.executable, '-m', 'cnxeasybake.scripts.main',
+                   'analyze', '--lint', '-q']
+        root = os.path.dirname(os.path.dirname(here))
+        for ruleset, status in (('clear.css', 1), ('two_pass.css', 0)):
+            with open(os.devnull, 'wb') as devnull:
+                self.assertEqual(subprocess.call(
+                    command + [os.path.join(here, 'rulesets', ruleset)],
+                    stdout=devnull, cwd=root), status)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the benchmark book generator and runner."""
+import unittest
+
+from lxml import etree
+
+
+SMALL_BOOK = dict(chapters=2, sections=2, figures=1, exercises=1, terms=2,
+                  xrefs=2)
+
+XHTML = {'h': 'http://www.w3.org/1999/xhtml'}
+
+
+class GenerateBookTest(unittest.TestCase):
+    """Check the shape of generated books."""
+
+    @property
+    def target(self):
+        from ..benchmarks.book import generate_book
+        return generate_book
+
+    def test_counts(self):
+        """Generated book has the requested number of parts."""
+        html = etree.XML(self.target(**SMALL_BOOK))
+        self.assertEqual(len(html.xpath('//h:div[@data-type="chapter"]',
+                                        namespaces=XHTML)), 2)
+        self.assertEqual(len(html.xpath('//h:div[@data-type="page"]',
+                                        namespaces=XHTML)), 4)
+        self.assertEqual(len(html.xpath('//h:figure', namespaces=XHTML)), 4)
+        self.assertEqual(len(html.xpath('//h:span[@data-type="term"]',
+                                        namespaces=XHTML)), 8)
+        self.assertEqual(len(html.xpath('//h:a[@class="xref"]',
+                                        namespaces=XHTML)), 8)
+
+    def test_xrefs_resolve(self):
+        """Every cross-reference points at an existing id."""
+        html = etree.XML(self.target(**SMALL_BOOK))
+        ids = set(html.xpath('//@id'))
+        for href in html.xpath('//h:a[@class="xref"]/@href',
+                               namespaces=XHTML):
+            self.assertIn(href[1:], ids)
+
+    def test_deterministic(self):
+        """Same seed gives the same book, a different one does not."""
+        self.assertEqual(self.target(seed=3, **SMALL_BOOK),
+                         self.target(seed=3, **SMALL_BOOK))
+        self.assertNotEqual(self.target(seed=3, **SMALL_BOOK),
+                            self.target(seed=4, **SMALL_BOOK))
+
+    def test_unknown_size(self):
+        """Unknown sizes are rejected."""
+        self.assertRaises(TypeError, self.target, pages=3)
+
+
+class RunScenarioTest(unittest.TestCase):
+    """Run every benchmark scenario on a small book."""
+
+    def test_scenarios(self):
+        from ..benchmarks.book import generate_book
+        from ..benchmarks.run import SCENARIOS, run_scenario
+        html = generate_book(**SMALL_BOOK)
+        for name in SCENARIOS:
+            result = run_scenario(name, html, repeat=1)
+            self.assertEqual(result['scenario'], name)
+            self.assertEqual(result['elements'],
+                             len(list(etree.XML(html).iter())))
+            self.assertGreater(result['throughput'], 0)
+
+
+class CompareParsersTest(unittest.TestCase):
+    """Bake a small book with each of the parsers."""
+
+    def test_compare_parsers(self):
+        from ..benchmarks.book import generate_book
+        from ..benchmarks.parsing import PARSERS, compare_parsers
+        html = generate_book(**SMALL_BOOK)
+        results = compare_parsers(html, repeat=1)
+        self.assertEqual([result['parser'] for result in results],
+                         list(PARSERS))
+        texts = dict((result['parser'], result['texts'])
+                     for result in results)
+        self.assertEqual(texts['default'], texts['tuned'])
+        self.assertLess(texts['no blank text'], texts['default'])
+
+
+class TimeLookupsTest(unittest.TestCase):
+    """Time the lookups after baking a small book."""
+
+    def test_time_lookups(self):
+        from ..benchmarks.book import generate_book
+        from ..benchmarks.lookup import LOOKUPS, baked_oven, time_lookups
+        oven = baked_oven(generate_book(**SMALL_BOOK))
+        self.assertEqual([name for name, _ in time_lookups(oven, 10)],
+                         [name for name, _ in LOOKUPS])
+        self.assertEqual(oven.lookup(*LOOKUPS[0][1]), 2)
+        self.assertEqual(oven.lookup(*LOOKUPS[1][1]), u'b')
+        self.assertEqual(oven.lookup(*LOOKUPS[2][1]), 0)
+        self.assertEqual(oven.lookup(*LOOKUPS[3][1]), 1)
+
+
+def _report(**bake_times):
+    return {
+        'format': 1,
+        'machine': {'fingerprint': 'abc'},
+        'versions': {'lxml': '4.4.3'},
+        'book': {'chapters': 1},
+        'scenarios': dict((name, {'scenario': name, 'bake': bake,
+                                  'peak_rss': 1000})
+                          for name, bake in bake_times.items()),
+    }
+
+
+class BaselineTest(unittest.TestCase):
+    """Compare benchmark results against stored baselines."""
+
+    def test_compare(self):
+        """Only growth past the threshold is a regression."""
+        from ..benchmarks.baseline import compare
+        baseline = _report(counters=1.0, index=1.0, move_to=1.0)
+        current = _report(counters=1.05, index=1.5, new=1.0)
+        rows = compare(baseline, current, threshold=0.1)
+        self.assertEqual(
+            [(name, metric, regressed)
+             for name, metric, _, _, _, regressed in rows],
+            [('counters', 'bake', False), ('counters', 'peak_rss', False),
+             ('index', 'bake', True), ('index', 'peak_rss', False)])
+
+    def test_mismatches(self):
+        """Differences in book, machine and versions are reported."""
+        from ..benchmarks.baseline import mismatches
+        baseline = _report(counters=1.0)
+        current = _report(counters=1.0)
+        self.assertEqual(mismatches(baseline, current), [])
+        current['machine']['fingerprint'] = 'def'
+        current['versions']['lxml'] = '4.5.0'
+        current['book']['chapters'] = 2
+        self.assertEqual(len(mismatches(baseline, current)), 3)
+
+    def test_save_load(self):
+        """Saved reports load back, unknown formats are rejected."""
+        from io import StringIO
+        from ..benchmarks.baseline import (build_report, load_report,
+                                           save_report)
+        report = build_report([{'scenario': 'counters', 'bake': 1.0}],
+                              {'chapters': 1})
+        self.assertIn('lxml', report['versions'])
+        self.assertIn('fingerprint', report['machine'])
+        fp = StringIO()
+        save_report(report, fp)
+        fp.seek(0)
+        self.assertEqual(load_report(fp), report)
+        self.assertRaises(ValueError, load_report, StringIO(u'{"format": 0}'))
+
+    def test_main_exit_status(self):
+        """The benchmark command fails when a scenario regressed."""
+        import json
+        import os
+        import tempfile
+        from ..benchmarks.run import main
+        from .test_cli import captured_output
+        fd, path = tempfile.mkstemp('.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        args = ['--chapters', '1', '--sections', '1', '-r', '1',
+                '--no-isolate', '--scenario', 'counters']
+
+        with captured_output():
+            self.assertEqual(main(args + ['-o', path]), 0)
+            self.assertEqual(main(args + ['-b', path, '-t', '1000']), 0)
+
+            with open(path) as f:
+                report = json.load(f)
+            report['scenarios']['counters']['bake'] /= 1e6
+            with open(path, 'w') as f:
+                json.dump(report, f)
+            self.assertEqual(main(args + ['-b', path]), 1)
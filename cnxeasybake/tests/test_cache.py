@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the baked output cache."""
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+
+class CacheTestCase(unittest.TestCase):
+    """Cache output by the hash of the inputs."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache_key(self):
+        from ..cache import cache_key
+        key = cache_key(b'css', b'html', None, False, '1.0')
+        self.assertEqual(key, cache_key(b'css', b'html', None, False, '1.0'))
+        self.assertNotEqual(key, cache_key(b'cs', b'shtml', None, False,
+                                           '1.0'))
+        self.assertNotEqual(key, cache_key(b'css', b'html', '2', False,
+                                           '1.0'))
+        self.assertNotEqual(key, cache_key(b'css', b'html', None, True,
+                                           '1.0'))
+        self.assertNotEqual(key, cache_key(b'css', b'html', None, False,
+                                           '1.1'))
+        self.assertNotEqual(key, cache_key(b'css', b'html', None, False,
+                                           '1.0', True))
+        self.assertNotEqual(key, cache_key(b'css', b'html', None, False,
+                                           '1.0', False, False))
+
+    def test_get_put(self):
+        from ..cache import OutputCache
+        cache = OutputCache(os.path.join(self.tmpdir, 'cache'))
+        self.assertIsNone(cache.get('abcd'))
+        cache.put('abcd', b'<html/>')
+        self.assertEqual(cache.get('abcd'), b'<html/>')
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'cache', 'ab')),
+                         ['abcd.html'])
+
+    def test_cacheable(self):
+        from ..cache import cacheable
+        from ..oven import Oven
+        self.assertTrue(cacheable(Oven(b'div { class: "a"; }')))
+        self.assertFalse(cacheable(Oven(b'div::after { content: uuid(); }')))
+        self.assertTrue(cacheable(Oven(b'div::after { content: uuid(); }',
+                                       use_repeatable_ids=True)))
+
+    def bake(self, ruleset, *options):
+        """Bake with the cli, returning the output."""
+        from .test_cli import captured_output
+        from ..scripts.main import main
+        output = os.path.join(self.tmpdir, 'baked.html')
+        with captured_output():
+            main(list(options) + [
+                '--cache-dir', os.path.join(self.tmpdir, 'cache'),
+                os.path.join(here, 'rulesets', ruleset + '.css'),
+                os.path.join(here, 'html', ruleset + '_raw.html'), output])
+        with open(output, 'rb') as baked:
+            return baked.read()
+
+    def cached(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        if not os.path.isdir(cache_dir):
+            return []
+        return [name for directory in os.listdir(cache_dir)
+                for name in os.listdir(os.path.join(cache_dir, directory))]
+
+    def test_cli(self):
+        baked = self.bake('move_to')
+        self.assertEqual(len(self.cached()), 1)
+        with mock.patch('cnxeasybake.oven.Oven.bake') as bake:
+            self.assertEqual(self.bake('move_to'), baked)
+        self.assertFalse(bake.called)
+        self.bake('move_to', '--stop-at', '2')
+        self.assertEqual(len(self.cached()), 2)
+
+    def test_cli_uuids(self):
+        self.bake('uuid')
+        self.assertEqual(self.cached(), [])
+        baked = self.bake('uuid', '--use-repeatable-ids')
+        self.assertEqual(len(self.cached()), 1)
+        self.assertEqual(self.bake('uuid', '--use-repeatable-ids'), baked)
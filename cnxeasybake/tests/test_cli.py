@@ -132,6 +132,101 @@ class CliTestCase(unittest.TestCase):
         else:
             self.assertIn("error: too few arguments", stderr)
 
+    def test_partition(self):
+        """Partitioned bakes write the same output as serial ones."""
+        os.chdir(here)
+        outputs = []
+        for extra in ([], ['--partition', 'div[data-type="chapter"]',
+                           '--workers', '2']):
+            with captured_output() as (out, err):
+                with tempfile.NamedTemporaryFile() as tf:
+                    args = extra + ['-q', 'rulesets/move_to.css',
+                                    'html/move_to_raw.html', tf.name]
+                    self.target(args)
+                    outputs.append(tf.file.read())
+                stderr = str(err.getvalue())
+            self.assertEqual(stderr, '')
+        self.assertEqual(outputs[0], outputs[1])
+
+        with captured_output() as (out, err):
+            args = ['--partition', 'body', '-c', os.devnull,
+                    'rulesets/move_to.css', 'html/move_to_raw.html']
+            with self.assertRaises(SystemExit):
+                self.target(args)
+            stderr = str(err.getvalue())
+        self.assertIn('--coverage-file can not be used with --partition',
+                      stderr)
+
+    def test_explain(self):
+        """Report the passes instead of baking."""
+        os.chdir(here)
+        with captured_output() as (out, err):
+            with tempfile.NamedTemporaryFile() as tf:
+                args = ['--explain', 'rulesets/move_to.css',
+                        'html/move_to_raw.html', tf.name]
+                self.target(args)
+                self.assertEqual(tf.file.read(), b'')
+            stdout = str(out.getvalue())
+            stderr = str(err.getvalue())
+
+        self.assertEqual(stderr, '')
+        self.assertIn('pass default: 2 rules, 4 matches\n', stdout)
+        self.assertIn('eoc-key-terms: filled 3, drained 3\n', stdout)
+
+        with captured_output() as (out, err):
+            with tempfile.NamedTemporaryFile() as tf:
+                args = ['--explain-bake', 'rulesets/move_to.css',
+                        'html/move_to_raw.html', tf.name]
+                self.target(args)
+                with open('html/move_to_baked.html', 'rb') as f:
+                    self.assertEqual(tf.file.read(), f.read())
+            stdout = str(out.getvalue())
+        self.assertIn('pass default: 2 rules, 4 matches\n', stdout)
+
+    def test_ignored_options(self):
+        """Options --watch and --explain would ignore are refused."""
+        os.chdir(here)
+        for mode, option in (('--watch', ['--cache-dir', 'cache']),
+                             ('--explain', ['--cache-dir', 'cache']),
+                             ('--watch', ['--workers', '2']),
+                             ('--explain', ['--workers', '2'])):
+            with captured_output() as (out, err):
+                args = [mode] + option + ['rulesets/move_to.css',
+                                          'html/move_to_raw.html', 'out.html']
+                with self.assertRaises(SystemExit):
+                    self.target(args)
+                stderr = str(err.getvalue())
+            self.assertIn('{} can not be used with --watch or --explain'
+                          .format(option[0]), stderr)
+
+    def test_serve_usage(self):
+        """Check serve needs recipes and somewhere to listen."""
+        os.chdir(here)
+        with captured_output() as (out, err):
+            args = ['serve', '--port', '0']
+            try:
+                self.target(args)
+            except SystemExit:
+                pass
+            stdout = str(out.getvalue())
+            stderr = str(err.getvalue())
+
+        self.assertEqual(stdout, '')
+        self.assertIn('cnx-easybake serve', stderr)
+        self.assertIn('--recipe', stderr)
+
+    def test_serve_path_root(self):
+        """Check serve needs an existing --path-root directory."""
+        os.chdir(here)
+        with captured_output() as (out, err):
+            args = ['serve', '--port', '0', '--recipe',
+                    'rulesets/move_to.css', '--path-root', 'missing']
+            with self.assertRaises(SystemExit):
+                self.target(args)
+            stderr = str(err.getvalue())
+
+        self.assertIn("--path-root: no such directory 'missing'", stderr)
+
     def test_help(self):
         """Check help usage message."""
         os.chdir(here)
@@ -145,7 +240,10 @@ class CliTestCase(unittest.TestCase):
             stderr = str(err.getvalue())
 
         usage_message = """[-h] [-v] [-s <pass>] [-d] [-q] [-c coverage.lcov]
-                [--use-repeatable-ids]
+                [--use-repeatable-ids] [-p <selector>] [-w <n>]
+                [--cache-dir <dir>] [--watch] [--huge-tree]
+                [--remove-blank-text] [--xhtml] [--explain]
+                [--explain-bake]
                 css_rules [html_in] [html_out]
 
 Process raw HTML to baked (embedded numbering and collation)
@@ -167,6 +265,29 @@ optional arguments:
                         with '+', append coverage info.
   --use-repeatable-ids  use repeatable id attributes instead of uuids which is
                         useful for diffing
+  -p <selector>, --partition <selector>
+                        bake passes that stay inside the elements matching
+                        this selector (e.g. chapters) in parallel
+  -w <n>, --workers <n>
+                        worker processes for --partition (default: one per
+                        CPU)
+  --cache-dir <dir>     copy the output cached in this directory for the same
+                        html_in, recipe and options instead of baking, caching
+                        it after baking otherwise
+  --watch               bake again whenever the recipe or html_in changes,
+                        until interrupted
+  --huge-tree           lift the parser limits on deep trees and long texts,
+                        for very large books
+  --remove-blank-text   drop whitespace-only text between elements when
+                        parsing, if the recipe does not depend on it
+  --xhtml               leave empty elements self-closed instead of closing
+                        them for HTML parsers, when the output is parsed as
+                        XHTML
+  --explain             report the rules matched, actions, buckets and costly
+                        operations of each pass instead of baking, estimating
+                        the passes after the first
+  --explain-bake        like --explain with exact counts for all passes, at
+                        the cost of a full bake writing html_out
 """
 
         self.assertEqual(stderr, '')
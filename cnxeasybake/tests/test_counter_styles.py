@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the counter styles."""
+import unittest
+
+
+class CounterStylesTestCase(unittest.TestCase):
+    """Format values in each of the counter styles."""
+
+    def format(self, style, value):
+        from ..counter_styles import COUNTER_STYLES
+        return COUNTER_STYLES[style].format(value)
+
+    def test_decimal(self):
+        self.assertEqual(self.format('decimal', 0), u'0')
+        self.assertEqual(self.format('decimal', -12), u'-12')
+        self.assertEqual(self.format('decimal-leading-zero', 7), u'07')
+        self.assertEqual(self.format('decimal-leading-zero', 123), u'123')
+        self.assertEqual(self.format('decimal-leading-zero', -7), u'-7')
+
+    def test_roman(self):
+        self.assertEqual(self.format('upper-roman', 1994), u'MCMXCIV')
+        self.assertEqual(self.format('upper-roman', 4999), u'MMMMCMXCIX')
+        self.assertEqual(self.format('lower-roman', 49), u'xlix')
+        self.assertIsNone(self.format('lower-roman', 0))
+        self.assertIsNone(self.format('upper-roman', 5000))
+
+    def test_latin(self):
+        self.assertEqual(self.format('lower-latin', 1), u'a')
+        self.assertEqual(self.format('lower-alpha', 26), u'z')
+        self.assertEqual(self.format('upper-alpha', 3), u'C')
+        self.assertIsNone(self.format('lower-latin', 27))
+        self.assertIsNone(self.format('upper-latin', 0))
+
+    def test_greek(self):
+        self.assertEqual(self.format('lower-greek', 1), u'α')
+        self.assertEqual(self.format('lower-greek', 24), u'ω')
+        self.assertEqual(self.format('lower-greek', 25), u'αα')
+        self.assertEqual(self.format('lower-greek', 50), u'ββ')
+        self.assertIsNone(self.format('lower-greek', 0))
+
+    def test_cjk_decimal(self):
+        self.assertEqual(self.format('cjk-decimal', 0), u'〇')
+        self.assertEqual(self.format('cjk-decimal', 2016),
+                         u'二〇一六')
+        self.assertIsNone(self.format('cjk-decimal', -1))
+
+    def test_cached(self):
+        from ..counter_styles import COUNTER_STYLES
+        style = COUNTER_STYLES['upper-roman']
+        self.assertEqual(style.format(12), u'XII')
+        self.assertEqual(style.cache[12], u'XII')
+
+    def test_oven_fallback(self):
+        from ..oven import Oven
+        oven = Oven()
+        self.assertEqual(oven.counter_style(3, 'lower-greek'), u'γ')
+        self.assertEqual(oven.counter_style(30, 'lower-latin'), '30')
+        self.assertEqual(oven.counter_style(3, 'klingon'), '3')
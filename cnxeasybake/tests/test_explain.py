@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for explaining what a bake does."""
+import unittest
+
+from lxml import etree
+
+RECIPE = b'''
+div[data-type="exercise"] { move-to: eoc; }
+div[data-type="chapter"]::after {
+  content: pending(eoc);
+  sort-by: h2;
+}
+:pass(2) figure { copy-to: figures; }
+:pass(2) figure::outside { class: "os-figure"; }
+:pass(2) body::after { content: pending(figures); }
+:pass(2) p { data-x: "y"; }
+'''
+
+HTML = b'''<html><body>
+<div data-type="chapter"><div data-type="exercise"><h2>b</h2></div>
+<div data-type="exercise"><h2>a</h2></div><figure>1</figure></div>
+<div data-type="chapter"><figure>2</figure></div>
+</body></html>'''
+
+
+class ExplainTestCase(unittest.TestCase):
+    """Report what each pass does."""
+
+    def explain(self, html=HTML, last_step=None, bake=True):
+        from ..explain import ExplainOven
+        oven = ExplainOven(RECIPE)
+        return oven.explain(etree.XML(html), last_step, bake)
+
+    def test_unchanged(self):
+        """Without baking, the document explained is left unchanged."""
+        from ..explain import ExplainOven
+        html_doc = etree.XML(HTML)
+        ExplainOven(RECIPE).explain(html_doc)
+        self.assertEqual(etree.tostring(html_doc), HTML)
+
+    def test_bake(self):
+        """Baking bakes the document as an Oven does."""
+        from ..explain import ExplainOven
+        from ..oven import Oven
+        html_doc = etree.XML(HTML)
+        ExplainOven(RECIPE).explain(html_doc, bake=True)
+        baked = etree.XML(HTML)
+        Oven(RECIPE).bake(baked)
+        self.assertEqual(etree.tostring(html_doc), etree.tostring(baked))
+
+    def test_estimates(self):
+        """Without baking, the first pass is exact, later ones estimated."""
+        plans = self.explain(bake=False)
+        exact = self.explain()
+        self.assertEqual(plans['0'], exact['0'])
+        # Pass 2 matches the figures of the unbaked document too
+        self.assertEqual(plans['2']['matches'], exact['2']['matches'])
+
+    def test_plans(self):
+        """Count matches, actions, bucket items and costly operations."""
+        plans = self.explain()
+        self.assertEqual(list(plans), ['0', '2'])
+        first, second = plans['0'], plans['2']
+        self.assertEqual(list(first['matches'].items()), [
+            ((2, u'div[data-type="exercise"] '), 2),
+            ((3, u'div[data-type="chapter"]::after '), 2)])
+        # The exercises and the two ::after elements, all sorted by h2
+        self.assertEqual(
+            dict((action, count) for action, count in first['actions'].items()
+                 if count),
+            {'move': 5})
+        self.assertEqual(first['buckets'], {'eoc': [2, 2]})
+        self.assertEqual(dict(first['costly']), {
+            'sorted_inserts': 5, 'outside_wraps': 0, 'deep_copies': 0})
+
+        self.assertEqual(len(second['matches']), 4)
+        self.assertEqual(list(second['matches'].values()), [2, 2, 1, 0])
+        self.assertEqual(
+            dict((action, count) for action, count in second['actions'].items()
+                 if count),
+            {'move': 3, 'copy': 2, 'attrib': 2})
+        self.assertEqual(second['buckets'], {'figures': [2, 2]})
+        self.assertEqual(dict(second['costly']), {
+            'sorted_inserts': 0, 'outside_wraps': 2, 'deep_copies': 2})
+
+    def test_last_step(self):
+        """Only the passes before last_step are explained."""
+        self.assertEqual(list(self.explain(last_step='2')), ['0'])
+
+    def test_format_report(self):
+        """The report has a section per pass."""
+        from ..explain import format_report
+        report = format_report(self.explain())
+        self.assertIn(u'pass 0: 2 rules, 4 matches', report)
+        self.assertIn(u'  actions         move 5\n', report)
+        self.assertIn(u'  bucket          eoc: filled 2, drained 2', report)
+        self.assertIn(u'  costly          outside wraps 2, deep copies 2',
+                      report)
+        self.assertIn(u'         0  line 10: :pass(2) p', report)
+        self.assertNotIn(u'estimates', report)
+        report = format_report(self.explain(bake=False), estimated=True)
+        self.assertTrue(report.startswith(
+            u'passes after the first matched against the unbaked document, '
+            u'their counts are estimates\npass 0: 2 rules, 4 matches\n'))
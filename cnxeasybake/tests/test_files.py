@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for reading and writing compressed or plain files."""
+import bz2
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from lxml import etree
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+HTML = (u'<!DOCTYPE html>\n<html xmlns="http://www.w3.org/1999/xhtml">'
+        u'<body><p>Caf\xe9</p></body></html>').encode('utf-8')
+
+IS_PY3 = sys.version_info > (3,)
+
+
+class FilesTestCase(unittest.TestCase):
+    """Read and write paths and file objects."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def suffixes(self):
+        suffixes = ['', '.gz', '.bz2']
+        if IS_PY3:
+            suffixes.append('.xz')
+        return suffixes
+
+    def test_read_html(self):
+        from ..files import open_file, read_html
+        expected = etree.tostring(etree.parse(io.BytesIO(HTML)))
+        for suffix in self.suffixes():
+            path = self.path('raw.html' + suffix)
+            with open_file(path, 'wb') as html_out:
+                html_out.write(HTML)
+            self.assertEqual(etree.tostring(read_html(path)), expected)
+        self.assertEqual(etree.tostring(read_html(io.BytesIO(HTML))),
+                         expected)
+
+    def test_read_plain_path(self):
+        """Uncompressed paths are parsed from the file, with their URL."""
+        from ..files import read_html
+        path = self.path(u'caf\xe9 raw.html')
+        with io.open(path, 'wb') as html_out:
+            html_out.write(HTML)
+        tree = read_html(path)
+        self.assertEqual(etree.tostring(tree),
+                         etree.tostring(etree.parse(io.BytesIO(HTML))))
+        self.assertEqual(tree.xpath('string()'), u'Caf\xe9')
+        self.assertTrue(tree.docinfo.URL.endswith('raw.html'))
+
+    def test_make_parser(self):
+        from ..files import make_parser, read_html
+        self.assertIs(make_parser(), make_parser())
+        self.assertIsNot(make_parser(), make_parser(huge_tree=True))
+        html = (b'<html>\n <body>\n  <p>a <em>b</em> <em>c</em></p>\n'
+                b' </body>\n</html>')
+        self.assertEqual(
+            etree.tostring(read_html(io.BytesIO(html),
+                                     make_parser(remove_blank_text=True))),
+            b'<html><body><p>a <em>b</em> <em>c</em></p></body></html>')
+        self.assertEqual(etree.tostring(read_html(io.BytesIO(html))), html)
+
+    def test_make_parser_per_thread(self):
+        """Threads do not share parsers, which parse one at a time."""
+        import threading
+        from ..files import make_parser
+        parsers = []
+        thread = threading.Thread(
+            target=lambda: parsers.extend([make_parser(), make_parser()]))
+        thread.start()
+        thread.join()
+        self.assertIs(parsers[0], parsers[1])
+        self.assertIsNot(parsers[0], make_parser())
+
+    def test_entities_not_resolved(self):
+        from ..files import read_html
+        path = self.path('secret.txt')
+        with open(path, 'wb') as secret:
+            secret.write(b'secret')
+        html = (u'<!DOCTYPE html [<!ENTITY s SYSTEM "{}">]>'
+                u'<html><p>&s;</p></html>').format(path).encode('utf-8')
+        self.assertNotIn(b'secret</p>',
+                         etree.tostring(read_html(io.BytesIO(html))))
+
+    def test_compressed(self):
+        from ..files import write_bytes
+        write_bytes(HTML, self.path('baked.html.gz'))
+        with gzip.open(self.path('baked.html.gz'), 'rb') as baked:
+            self.assertEqual(baked.read(), HTML)
+        write_bytes(HTML, self.path('baked.html.bz2'))
+        with bz2.BZ2File(self.path('baked.html.bz2'), 'rb') as baked:
+            self.assertEqual(baked.read(), HTML)
+
+    def test_read_bytes(self):
+        from ..files import read_bytes, write_bytes
+        write_bytes(HTML, self.path('raw.html.gz'))
+        self.assertEqual(read_bytes(self.path('raw.html.gz')), HTML)
+        self.assertEqual(read_bytes(io.BytesIO(HTML)), HTML)
+
+    def test_empty_file(self):
+        from ..files import read_html
+        open(self.path('empty.html'), 'wb').close()
+        with self.assertRaises(etree.XMLSyntaxError):
+            read_html(self.path('empty.html'))
+
+    def test_write_streams(self):
+        from ..files import write_bytes
+        binary = io.BytesIO()
+        write_bytes(HTML, binary)
+        self.assertEqual(binary.getvalue(), HTML)
+        text = io.StringIO()
+        write_bytes(HTML, text)
+        self.assertEqual(text.getvalue(), HTML.decode('utf-8'))
+
+    def test_cli(self):
+        from .test_cli import captured_output
+        from ..scripts.main import main
+        outputs = []
+        for suffix in ('', '.gz'):
+            raw = os.path.join(here, 'html', 'move_to_raw.html')
+            if suffix:
+                with open(raw, 'rb') as html_in:
+                    with gzip.open(self.path('raw.html.gz'), 'wb') as f:
+                        f.write(html_in.read())
+                raw = self.path('raw.html.gz')
+            baked = self.path('baked.html' + suffix)
+            with captured_output():
+                main([os.path.join(here, 'rulesets', 'move_to.css'), raw,
+                      baked])
+            with (gzip.open if suffix else open)(baked, 'rb') as html_out:
+                outputs.append(html_out.read())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertTrue(outputs[0].startswith(b'<html'))
+
+    def test_cli_parser_options(self):
+        from .test_cli import captured_output
+        from ..scripts.main import main
+        baked = self.path('baked.html')
+        with captured_output():
+            main([os.path.join(here, 'rulesets', 'move_to.css'),
+                  os.path.join(here, 'html', 'move_to_raw.html'), baked,
+                  '--huge-tree', '--remove-blank-text'])
+        with open(baked, 'rb') as html_out:
+            output = html_out.read()
+        self.assertTrue(output.startswith(b'<html'))
+        self.assertNotIn(b'>\n', output[:-1])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Import-time tests: heavy dependencies are only imported when needed."""
+import sys
+import unittest
+
+HEAVY = ('icu', 'cssselect', 'cssselect2', 'tinycss2', 'lxml.etree',
+         'cnxeasybake.oven', 'cnxeasybake._version')
+
+BAKE = '''
+from lxml import etree
+from cnxeasybake import Oven
+html = etree.XML(b'<html><body><p>b</p><p>a</p></body></html>')
+Oven({!r}).bake(html)
+'''
+
+MOVE_CSS = b'p { move-to: ps; } body::after { content: pending(ps); }'
+
+SORT_CSS = b'p { move-to: ps; } body::after { content: pending(ps); ' \
+           b'sort-by: p; }'
+
+
+@unittest.skipUnless(sys.version_info >= (3, 7), 'needs python -X importtime')
+class ImportTimeTest(unittest.TestCase):
+    """Check what gets imported, with python -X importtime."""
+
+    def import_times(self, statement):
+        from ..benchmarks.importtime import import_times
+        return import_times(statement)
+
+    def assertNotImported(self, modules, times):
+        imported = [module for module in modules if module in times]
+        self.assertEqual(imported, [], 'Imported {} ({:.1f} ms in total)'
+                         .format(', '.join(imported),
+                                 sum(t[0] for t in times.values()) / 1000.0))
+
+    def test_package(self):
+        """Importing the package imports neither the oven nor versioneer."""
+        self.assertNotImported(HEAVY, self.import_times('import cnxeasybake'))
+
+    def test_cli(self):
+        """The command line script defers its imports until baking."""
+        times = self.import_times('import cnxeasybake.scripts.main')
+        self.assertIn('cnxeasybake.scripts.main', times)
+        self.assertNotImported(HEAVY, times)
+
+    def test_oven(self):
+        """The oven defers ICU and cssselect until they are used."""
+        times = self.import_times('import cnxeasybake.oven')
+        self.assertIn('lxml.etree', times)
+        self.assertNotImported(('icu', 'cssselect'), times)
+
+    def test_bake_without_sorting(self):
+        """Baking without sort-by or group-by does not need ICU."""
+        times = self.import_times(BAKE.format(MOVE_CSS))
+        self.assertNotImported(('icu', 'cssselect'), times)
+
+    def test_bake_with_sorting(self):
+        """Sorting imports ICU and cssselect."""
+        times = self.import_times(BAKE.format(SORT_CSS))
+        self.assertIn('icu', times)
+        self.assertIn('cssselect', times)
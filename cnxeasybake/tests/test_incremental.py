@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for baking only the changed partitions again."""
+import logging
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from lxml import etree
+
+from .test_partition import CHAPTER, EOC_CSS, LAST_CHAPTER_CSS
+
+logger = logging.getLogger('cnx-easybake')
+
+# Figures are numbered across the book, end of chapter collation stays in
+# each chapter
+BOOK_CSS = b'''
+body { counter-reset: figure; }
+figure { counter-increment: figure; }
+figcaption::before { content: "Figure " counter(figure) " "; }
+:pass(2) div[data-type="chapter"] dl.definition { move-to: eoc-terms; }
+:pass(2) div[data-type="chapter"]::after {
+  class: eoc-terms;
+  content: pending(eoc-terms);
+}
+'''
+
+
+class IncrementalBakerTestCase(unittest.TestCase):
+    """Compare incremental bakes with full ones."""
+
+    def setUp(self):
+        from ..benchmarks.book import generate_book
+        self.html = generate_book(chapters=4, sections=2, xrefs=1)
+        self.old_level = logger.level
+        logger.setLevel(logging.ERROR)
+
+    def tearDown(self):
+        logger.setLevel(self.old_level)
+
+    def edit(self, chapter, html=None):
+        """Return the book with text added to a chapter."""
+        html_doc = etree.XML(html or self.html)
+        paragraph = html_doc.xpath(
+            '//*[@id="chapter-{}"]//*[local-name()="p"]'.format(chapter))[0]
+        paragraph.text = u'Edited. ' + paragraph.text
+        return etree.tostring(html_doc)
+
+    def assertBakes(self, baker, html, reasons):
+        """Bake incrementally, expecting the full output and reasons."""
+        from ..oven import Oven
+        html_doc = etree.XML(html)
+        Oven(baker.css).bake(html_doc)
+        expected = etree.tostring(html_doc)
+
+        html_doc = etree.XML(html)
+        report = baker.bake(html_doc)
+        self.assertEqual(etree.tostring(html_doc), expected)
+        self.assertEqual(len(report), len(reasons))
+        for (_, reason), expected_reason in zip(report, reasons):
+            if expected_reason is None:
+                self.assertIsNone(reason)
+            else:
+                self.assertIn(expected_reason, reason)
+
+    def baker(self, css):
+        from ..incremental import IncrementalBaker
+        return IncrementalBaker(css, CHAPTER)
+
+    def test_first_bake(self):
+        baker = self.baker(EOC_CSS)
+        self.assertBakes(baker, self.html, ['no previous bake'] * 2)
+
+    def test_unchanged(self):
+        baker = self.baker(EOC_CSS)
+        baker.bake(etree.XML(self.html))
+        self.assertBakes(baker, self.html, [None, None])
+
+    def test_changed_partition(self):
+        baker = self.baker(EOC_CSS)
+        baker.bake(etree.XML(self.html))
+        self.assertBakes(baker, self.edit(2), ['matches outside', None])
+        with mock.patch.object(baker, 'bake_partition',
+                               wraps=baker.bake_partition) as bake_partition:
+            self.assertBakes(baker, self.edit(3, self.edit(2)),
+                             ['matches outside', None])
+        self.assertEqual(bake_partition.call_count, 1)
+
+    def test_changes_carry_over(self):
+        """Adding a figure renumbers the figures of later chapters."""
+        baker = self.baker(BOOK_CSS)
+        baker.bake(etree.XML(self.html))
+        html_doc = etree.XML(self.html)
+        figure = html_doc.xpath('//*[local-name()="figure"]')[0]
+        figure.addnext(etree.fromstring(etree.tostring(figure)))
+        self.assertBakes(baker, etree.tostring(html_doc),
+                         ['matches outside', None])
+
+    def test_changed_outside(self):
+        baker = self.baker(EOC_CSS)
+        baker.bake(etree.XML(self.html))
+        html_doc = etree.XML(self.html)
+        html_doc[1].set('class', 'edited')
+        self.assertBakes(baker, etree.tostring(html_doc),
+                         ['changed outside the partitions'] * 2)
+
+    def test_bucket_emptied_outside(self):
+        baker = self.baker(LAST_CHAPTER_CSS)
+        baker.bake(etree.XML(self.html))
+        self.assertBakes(baker, self.edit(1), ['left content in a bucket'])
+        self.assertBakes(baker, self.edit(2), ['emptied outside'])
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Tests for the Oven class."""
+import logging
 import unittest
 import os
 import tempfile
@@ -13,6 +14,8 @@ try:
 except ImportError:
     import mock
 
+logger = logging.getLogger('cnx-easybake')
+
 
 @contextmanager
 def _tempinput(data):
@@ -124,6 +127,149 @@ class OvenBakeTest(unittest.TestCase):
 
         oven.bake(html_doc)
 
+    def test_bake_twice(self):
+        """Test one oven bakes several documents the same way."""
+        from lxml import etree
+        oven = self.target_cls(CSS_TWO_STEP)
+        for _ in range(2):
+            html_doc = etree.XML(HTML)
+            oven.bake(html_doc)
+            self.assertEqual(etree.tostring(html_doc).decode('utf-8'),
+                             HTML_TWO_STEP)
+
+    def test_wrappers_reused(self):
+        """Test passes only wrap changed elements again."""
+        self.check_wrappers_reused(lambda html: html)
+
+    def test_wrappers_reused_tree(self):
+        """Test passes over an ElementTree reuse the wrappers of its root."""
+        self.check_wrappers_reused(lambda html: html.getroottree())
+
+    def check_wrappers_reused(self, to_input):
+        from lxml import etree
+        oven = self.target_cls(b'''
+            div.a { class: "b"; }
+            :pass(2) div.b::after { content: "x"; }
+            :pass(3) p { data-x: "y"; }
+            ''', fuse_passes=False)
+        html_doc = etree.XML(b'<html><body><div class="a"><p>1</p></div>'
+                             b'<section><p>2</p></section></body></html>')
+        div, section = html_doc[0]
+        oven.clear_state()
+        wrappers = []
+        for step in oven.steps:
+            oven.bake_step(to_input(html_doc), step)
+            wrappers.append(dict((wrapper.etree_element, wrapper) for wrapper
+                                 in oven.wrap(to_input(html_doc))
+                                 .iter_subtree()))
+        self.assertIs(wrappers[0][section], wrappers[1][section])
+        self.assertIs(wrappers[0][section[0]], wrappers[1][section[0]])
+        self.assertIsNot(wrappers[0][div], wrappers[1][div])
+        self.assertEqual(wrappers[1][div].classes, set(['b']))
+        self.assertIsNot(wrappers[1][div], wrappers[2][div])
+        self.assertIs(wrappers[1][section], wrappers[2][section])
+        self.assertIsNot(wrappers[1][section[0]], wrappers[2][section[0]])
+        self.assertEqual(etree.tostring(html_doc),
+                         b'<html><body><div class="b"><p data-x="y">1</p>'
+                         b'<div>x</div></div><section><p data-x="y">2</p>'
+                         b'</section></body></html>')
+
+    def test_close_empty(self):
+        """Test empty elements get a closing tag, unless void."""
+        from lxml import etree
+        raw = (b'<html xmlns="http://www.w3.org/1999/xhtml"><body><div/>'
+               b'<br/><p><!-- c --></p><span/></body></html>')
+        html_doc = etree.XML(raw)
+        self.target_cls(b'div { class: "a"; }').bake(html_doc)
+        self.assertEqual(etree.tostring(html_doc),
+                         b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+                         b'<div class="a"></div><br/><p><!-- c --></p>'
+                         b'<span></span></body></html>')
+        html_doc = etree.XML(raw)
+        self.target_cls(b'div { class: "a"; }',
+                        close_empty=False).bake(html_doc)
+        self.assertEqual(etree.tostring(html_doc),
+                         b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+                         b'<div class="a"/><br/><p><!-- c --></p><span/>'
+                         b'</body></html>')
+
+
+class OvenThreadTest(unittest.TestCase):
+    """Bake with one oven from several threads at once."""
+
+    # Counters, cross-references and repeatable ids all live in the state
+    CSS_EXTRA = b'''div[data-type="chapter"]::after {
+  attr-id: uuid();
+  content: "End of chapter " uuid();
+}
+'''
+
+    def setUp(self):
+        from ..benchmarks.run import SCENARIOS
+        with open(SCENARIOS['counters'], 'rb') as f:
+            self.css = f.read() + self.CSS_EXTRA
+        self.old_level = logger.level
+        logger.setLevel(logging.ERROR)
+
+    def tearDown(self):
+        logger.setLevel(self.old_level)
+
+    def bake(self, oven, html):
+        from lxml import etree
+        html_doc = etree.XML(html)
+        oven.bake(html_doc)
+        return etree.tostring(html_doc), oven.get_coverage_report()
+
+    def test_bake_threads(self):
+        """Concurrent bakes match bakes with fresh ovens."""
+        import threading
+        from ..oven import Oven
+        from ..benchmarks.book import generate_book
+        htmls = [generate_book(seed, chapters=seed + 1, sections=2)
+                 for seed in range(4)]
+        expected = [self.bake(Oven(self.css, True), html) for html in htmls]
+
+        oven = Oven(self.css, True)
+        results = {}
+        errors = []
+        start = threading.Event()
+
+        def worker(index):
+            try:
+                start.wait()
+                for _ in range(3):
+                    result = self.bake(oven, htmls[index])
+                    results.setdefault(index, []).append(result)
+            except Exception as error:  # pragma: no cover
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker, args=(index,))
+                   for index in range(len(htmls))]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for index, result in enumerate(expected):
+            self.assertEqual(results[index], [result] * 3)
+
+    def test_context_per_thread(self):
+        """Each thread has its own state and repeatable id counter."""
+        import threading
+        from ..oven import Oven
+        oven = Oven(CSS, True)
+        oven.generate_id()
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append((oven.generate_id(),
+                                        oven.state['steps'])))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [('autobaked-1', ['default'])])
+        self.assertEqual(oven.generate_id(), 'autobaked-2')
+
 
 class TargetValTest(unittest.TestCase):
     @property
@@ -146,3 +292,88 @@ class TargetValTest(unittest.TestCase):
             collator.lookup.return_value = test_input
             tv = self.target_cls(collator, None, None, None)
             self.assertEqual(str(tv), test_output)
+
+    def test_resolved_once(self):
+        """Test each cross-reference is looked up once per pass"""
+        from lxml import etree
+        from ..oven import Oven
+        oven = Oven(b'''
+            h1 { string-set: title content(); }
+            a { content: target-string(attr(href), title); }
+            a::after { content: " (" target-string(attr(href), title) ")"; }
+            ''')
+        html_doc = etree.XML(b'<body><h1 id="t">Title</h1><a href="#t"/>'
+                             b'<a href="#t"/><a href="#missing"/></body>')
+        with mock.patch.object(Oven, 'lookup', autospec=True,
+                               side_effect=Oven.lookup) as lookup:
+            oven.bake(html_doc)
+        targets = [call[0][3] for call in lookup.call_args_list
+                   if len(call[0]) > 3]
+        self.assertEqual(targets, ['t'] + ['missing'] * 2)
+        self.assertEqual(etree.tostring(html_doc),
+                         b'<body><h1 id="t">Title</h1><a href="#t">Title'
+                         b'<div> (Title)</div></a><a href="#t">Title'
+                         b'<div> (Title)</div></a><a href="#missing">'
+                         b'<div> ()</div></a></body>')
+
+
+class CopyWithIdSuffixTest(unittest.TestCase):
+    @property
+    def target(self):
+        from ..oven import copy_w_id_suffix
+        return copy_w_id_suffix
+
+    def test_copy(self):
+        """Test the ids of the copy are suffixed, not those of the original"""
+        from lxml import etree
+        html_doc = etree.XML(b'<body><div id="a"><p>x</p><!-- c -->'
+                             b'<p id="b">y</p></div><p id="c"/></body>')
+        mycopy = self.target(html_doc[0], '_copy_2')
+        self.assertEqual(etree.tostring(mycopy),
+                         b'<div id="a_copy_2"><p>x</p><!-- c -->'
+                         b'<p id="b_copy_2">y</p></div>')
+        self.assertEqual(html_doc.xpath('//@id'), ['a', 'b', 'c'])
+        self.assertEqual(self.target(html_doc[0][0]).get('id'), None)
+
+
+class IndexedMatcherTest(unittest.TestCase):
+    SELECTORS = (
+        'div[data-type="chapter"]', 'div[data-type="chapter"]::after',
+        'section > [data-type="note"].x', 'p[data-type="note"]', 'p',
+        '[data-Type="note"]', '[data-type~="note"]', 'div#a[data-type="x"]',
+        '*', ':not([data-type="chapter"])',
+    )
+
+    def test_subject_attribute(self):
+        """Test only equality of the subject's attributes is indexed"""
+        from cssselect2.parser import parse
+        from ..oven import subject_attribute
+        self.assertEqual(
+            [subject_attribute(sel) for text in self.SELECTORS
+             for sel in parse(text)],
+            [('data-type', 'chapter'), ('data-type', 'chapter'),
+             ('data-type', 'note'), ('data-type', 'note'), None, None, None,
+             ('data-type', 'x'), None, None])
+
+    def test_same_matches(self):
+        """Test matches are those, in the order, of a Matcher"""
+        import cssselect2
+        from cssselect2.parser import parse
+        from lxml import etree
+        from ..oven import IndexedMatcher, subject_attribute
+        matcher = cssselect2.Matcher()
+        indexed = IndexedMatcher()
+        for text in self.SELECTORS:
+            for sel in parse(text):
+                compiled = cssselect2.compiler.CompiledSelector(sel)
+                matcher.add_selector(compiled, text)
+                indexed.add_selector(compiled, text, subject_attribute(sel))
+        self.assertEqual(sorted(indexed.attribute_selectors['data-type']),
+                         ['chapter', 'note'])
+        html_doc = etree.XML(
+            b'<body><div data-type="chapter"><section><p data-type="note" '
+            b'class="x">1</p><div id="a" data-type="x"/></section></div>'
+            b'<p data-type="exercise"/><p/></body>')
+        for wrapper in cssselect2.ElementWrapper.from_xml_root(
+                html_doc).iter_subtree():
+            self.assertEqual(indexed.match(wrapper), matcher.match(wrapper))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for baking partitions in parallel."""
+import logging
+import unittest
+
+from lxml import etree
+
+logger = logging.getLogger('cnx-easybake')
+
+CHAPTER = 'div[data-type="chapter"]'
+
+# Numbering chapters crosses partitions, collating at their end does not
+EOC_CSS = b'''
+body { counter-reset: chapter; }
+div[data-type="chapter"] { counter-increment: chapter; }
+div[data-type="chapter"] > h1::before {
+  content: "Chapter " counter(chapter) " ";
+}
+:pass(2) div[data-type="chapter"] div[data-type="exercise"] {
+  move-to: eoc-exercises;
+}
+:pass(2) div[data-type="chapter"]::after {
+  class: eoc-exercises;
+  content: pending(eoc-exercises);
+}
+'''
+
+FIGURES_CSS = b'''
+div[data-type="chapter"] { counter-reset: figure; }
+figure { counter-increment: figure; }
+figcaption::before { content: "Figure " counter(figure) " "; }
+'''
+
+CHAPTERS_CSS = b'''
+div[data-type="chapter"] { counter-increment: chapter; }
+div[data-type="chapter"] > h1::before { content: counter(chapter); }
+'''
+
+TARGET_CSS = b'''
+div[data-type="chapter"] { counter-reset: figure; }
+figure { counter-increment: figure; }
+a.xref::after { content: target-counter(attr(href), figure); }
+'''
+
+SHARED_CSS = b'''
+:pass(1) dl.definition { move-to: terms; }
+:pass(2) div[data-type="chapter"]::after { content: pending(terms); }
+'''
+
+LAST_CHAPTER_CSS = b'''
+dl.definition { move-to: terms; }
+div[data-type="chapter"]:last-child::after { content: pending(terms); }
+'''
+
+
+# Rules looking at the siblings and ancestors of partitions
+SIBLINGS_CSS = b'''
+div[data-type="chapter"]:nth-child(2n) figure::after { content: "even"; }
+div[data-type="chapter"] + div[data-type="chapter"] > h1 { class: "next"; }
+body:not(:empty) > div[data-type="chapter"]:last-child h1::after {
+  content: "last";
+}
+div[data-type="chapter"]:lang(en) > h1 { data-lang: "en"; }
+'''
+
+
+class PartitionBakerTestCase(unittest.TestCase):
+    """Compare partitioned bakes with serial ones."""
+
+    def setUp(self):
+        from ..benchmarks.book import generate_book
+        self.html = generate_book(chapters=5, sections=2, xrefs=1)
+        self.bakers = []
+        self.old_level = logger.level
+        logger.setLevel(logging.ERROR)
+
+    def tearDown(self):
+        for baker in self.bakers:
+            baker.close()
+        logger.setLevel(self.old_level)
+
+    def baker(self, css, selector=CHAPTER, **kwargs):
+        from ..partition import PartitionBaker
+        baker = PartitionBaker(css, selector, workers=2, **kwargs)
+        self.bakers.append(baker)
+        return baker
+
+    def assertBakes(self, css, reasons, selector=CHAPTER):
+        """Bake partitioned, expecting the serial output and reasons."""
+        from ..oven import Oven
+        html_doc = etree.XML(self.html)
+        Oven(css).bake(html_doc)
+        expected = etree.tostring(html_doc)
+
+        html_doc = etree.XML(self.html)
+        report = self.baker(css, selector).bake(html_doc)
+        self.assertEqual(etree.tostring(html_doc), expected)
+        self.assertEqual(len(report), len(reasons))
+        for (_, reason), expected_reason in zip(report, reasons):
+            if expected_reason is None:
+                self.assertIsNone(reason)
+            else:
+                self.assertIn(expected_reason, reason)
+        return report
+
+    def test_parallel_pass(self):
+        """The end of chapter pass bakes in parallel, numbering does not."""
+        report = self.assertBakes(EOC_CSS, ['matches outside', None])
+        self.assertEqual([step for step, _ in report], ['0', '2'])
+
+    def test_siblings_and_ancestors(self):
+        """Partitions see their siblings and ancestors in the skeleton."""
+        self.assertBakes(SIBLINGS_CSS, [None])
+
+    def test_skeleton(self):
+        """Only the partitions of a worker are sent whole."""
+        from cssselect2 import compile_selector_list
+        from ..partition import find_partitions, skeleton
+        html_doc = etree.XML(self.html)
+        partitions, _ = find_partitions(html_doc,
+                                        compile_selector_list(CHAPTER))
+        chapters = [wrapper.etree_element for wrapper in partitions]
+        tree, copies = skeleton(html_doc, chapters[1:3])
+        self.assertEqual([etree.tostring(copy) for copy in copies],
+                         [etree.tostring(chapter, with_tail=False)
+                          for chapter in chapters[1:3]])
+        head, body = tree
+        self.assertEqual(etree.tostring(head),
+                         etree.tostring(html_doc[0], with_tail=False))
+        self.assertEqual(len(body), len(html_doc[1]))
+        for stub in (body[0], body[3], body[4]):
+            self.assertEqual(len(stub), 0)
+            self.assertTrue(stub.text)
+        self.assertLess(len(etree.tostring(tree)),
+                        len(etree.tostring(html_doc)) * 3 // 4)
+
+    def test_counters_reset_per_partition(self):
+        self.assertBakes(FIGURES_CSS, [None])
+
+    def test_counters_across_partitions(self):
+        self.assertBakes(CHAPTERS_CSS, ['counters chapter carry over'])
+
+    def test_target_references(self):
+        self.assertBakes(TARGET_CSS, ['target-* references'])
+
+    def test_bucket_shared_between_passes(self):
+        self.assertBakes(SHARED_CSS, ['shares bucket terms',
+                                      'shares bucket terms'])
+
+    def test_bucket_emptied_in_other_partition(self):
+        self.assertBakes(LAST_CHAPTER_CSS, ['emptied outside'])
+
+    def test_no_partitions(self):
+        self.assertBakes(FIGURES_CSS, ['no partitions'], 'div.missing')
+
+    def test_stop_at(self):
+        html_doc = etree.XML(self.html)
+        report = self.baker(EOC_CSS).bake(html_doc, '2')
+        self.assertEqual([step for step, _ in report], ['0'])
+
+    def test_strict(self):
+        from ..partition import PartitionError
+        baker = self.baker(CHAPTERS_CSS, strict=True)
+        with self.assertRaises(PartitionError) as cm:
+            baker.bake(etree.XML(self.html))
+        self.assertIn('carry over', str(cm.exception))
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Asymptotic scaling tests for the bake engine.
+
+Each test bakes the same recipe over synthetic books of size N, 2N, 4N and
+8N, fits the growth exponent of the operations of the bake (and of the peak
+Python memory allocated during the bake) against the input size, and fails
+if it exceeds the expected complexity plus a tolerance.
+
+The operations are the lines of cnx-easybake run by the bake, lookups,
+wrapper constructions and inserts included, so the counts are the same on
+every run and machine. Work done by lxml, cssselect2 or ICU is only counted
+by the calls into them; set EASYBAKE_SCALING_TIMING=1 to also fit bake
+times, over larger books.
+
+Paths that are known to be quadratic today are held to QUADRATIC, so they
+can not get any worse; tighten them to LINEAR once they are fixed.
+"""
+import logging
+import math
+import os
+import sys
+import unittest
+from timeit import default_timer as timer
+
+from lxml import etree
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+logger = logging.getLogger('cnx-easybake')
+
+SCALES = (1, 2, 4, 8)
+LINEAR = 1.0
+QUADRATIC = 2.0
+OPERATION_TOLERANCE = 0.25
+TIME_TOLERANCE = 0.35
+MEMORY_TOLERANCE = 0.25
+
+# Bake times are only fitted on request, they vary from run to run
+TIMING = bool(os.environ.get('EASYBAKE_SCALING_TIMING'))
+# Books for the timing tests are this many times larger
+TIMING_SIZE = 4
+
+# A book with one of everything, the tests scale one dimension of it
+BASE_BOOK = dict(chapters=1, sections=1, figures=0, exercises=0, terms=1,
+                 xrefs=0)
+
+SORT_CSS = b'''@namespace xhtml 'http://www.w3.org/1999/xhtml';
+dl.definition { move-to: terms; }
+body::after { content: pending(terms); sort-by: xhtml|dl > xhtml|dt; }
+'''
+
+GROUP_CSS = b'''@namespace xhtml 'http://www.w3.org/1999/xhtml';
+dl.definition { move-to: terms; }
+body::after {
+  content: pending(terms);
+  group-by: xhtml|dl > xhtml|dt, "xhtml|dl > xhtml|dt::first-letter";
+}
+'''
+
+MOVE_CSS = b'''span[data-type="term"] { move-to: terms; }
+p::after { content: "moved"; move-to: notes; }
+body::after { content: pending(terms) pending(notes); }
+'''
+
+OUTSIDE_CSS = b'''div[data-type="page"]::outside { class: wrapper; }
+'''
+
+
+def growth_exponent(sizes, values):
+    """Return the least squares slope of log(values) against log(sizes)."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(value, 1e-9)) for value in values]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    return (sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) /
+            sum((x - x_mean) ** 2 for x in xs))
+
+
+def bake_operations(css, html):
+    """Return the number of lines of cnx-easybake run baking html with css.
+
+    A tracer already installed, like the one of coverage, is put back
+    after the bake; it does not see the lines of the bake itself.
+    """
+    from ..oven import Oven
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    element = etree.XML(html)
+    oven = Oven(css)
+    count = [0]
+
+    def trace_lines(frame, event, arg):
+        if event == 'line':
+            count[0] += 1
+        return trace_lines
+
+    def trace_calls(frame, event, arg):
+        if frame.f_code.co_filename.startswith(package):
+            count[0] += 1
+            return trace_lines
+
+    previous = sys.gettrace()
+    sys.settrace(trace_calls)
+    try:
+        oven.bake(element)
+    finally:
+        sys.settrace(previous)
+    return count[0]
+
+
+def bake_time(css, html, repeat=3):
+    """Return the fastest of repeat bakes of html with css, in seconds."""
+    from ..oven import Oven
+    best = None
+    for _ in range(repeat):
+        element = etree.XML(html)
+        oven = Oven(css)
+        start = timer()
+        oven.bake(element)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bake_memory(css, html):
+    """Return the peak Python memory allocated while baking, in bytes."""
+    from ..oven import Oven
+    element = etree.XML(html)
+    oven = Oven(css)
+    tracemalloc.start()
+    try:
+        oven.bake(element)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class ScalingTestCase(unittest.TestCase):
+    """Check that baking grows no faster than expected with input size."""
+
+    measure = staticmethod(bake_operations)
+    measured = 'operations'
+    tolerance = OPERATION_TOLERANCE
+    size = 1
+    check_memory = True
+
+    def setUp(self):
+        self.old_level = logger.level
+        logger.setLevel(logging.ERROR)
+
+    def tearDown(self):
+        logger.setLevel(self.old_level)
+
+    def assertScales(self, css, dimension, n, complexity=LINEAR, **sizes):
+        """Bake css over books with dimension set to n times SCALES."""
+        from ..benchmarks.book import generate_book
+        book = dict(BASE_BOOK, **sizes)
+        htmls = []
+        for scale in SCALES:
+            book[dimension] = n * scale * self.size
+            htmls.append(generate_book(**book))
+        inputs = [len(html) for html in htmls]
+
+        values = [self.measure(css, html) for html in htmls]
+        exponent = growth_exponent(inputs, values)
+        self.assertLessEqual(
+            exponent, complexity + self.tolerance,
+            'Bake {} grow as n^{:.2f} ({})'.format(
+                self.measured, exponent,
+                ', '.join('{:.6g}'.format(v) for v in values)))
+
+        if self.check_memory and tracemalloc is not None:
+            peaks = [bake_memory(css, html) for html in htmls]
+            exponent = growth_exponent(inputs, peaks)
+            self.assertLessEqual(
+                exponent, LINEAR + MEMORY_TOLERANCE,
+                'Bake memory grows as n^{:.2f} ({})'.format(
+                    exponent, ', '.join(str(p) for p in peaks)))
+
+    def recipe(self, name):
+        from ..benchmarks.run import SCENARIOS
+        with open(SCENARIOS[name], 'rb') as f:
+            return f.read()
+
+    def test_tracer_restored(self):
+        """Counting operations keeps the tracer installed before."""
+        def tracer(frame, event, arg):
+            pass
+
+        previous = sys.gettrace()
+        sys.settrace(tracer)
+        try:
+            bake_operations(MOVE_CSS, b'<html><body><p/></body></html>')
+            current = sys.gettrace()
+        finally:
+            sys.settrace(previous)
+        self.assertIs(current, tracer)
+
+    def test_counters(self):
+        """Numbering and target-counter() scale linearly."""
+        self.assertScales(self.recipe('counters'), 'chapters', 1,
+                          sections=3, figures=2, exercises=2, xrefs=2)
+
+    def test_deferred_and_target(self):
+        """Deferred rules and target-string() scale linearly."""
+        self.assertScales(self.recipe('deferred_and_target'), 'chapters', 1,
+                          sections=3, figures=2, exercises=2, xrefs=2)
+
+    def test_move_to_eoc(self):
+        """End of chapter collation scales linearly with chapters."""
+        self.assertScales(self.recipe('move_to'), 'chapters', 1,
+                          sections=3, terms=3, exercises=2)
+
+    def test_group_by_glossary(self):
+        """The grouped glossary scales linearly with chapters."""
+        self.assertScales(self.recipe('group_by'), 'chapters', 1,
+                          sections=3, terms=3)
+
+    def test_index(self):
+        """The sorted index is quadratic today (insert_sort)."""
+        self.assertScales(self.recipe('index'), 'chapters', 1, QUADRATIC,
+                          sections=3, terms=3)
+
+    def test_insert_sort(self):
+        """Sorting one large bucket is quadratic today (insert_sort)."""
+        self.assertScales(SORT_CSS, 'terms', 25, QUADRATIC)
+
+    def test_grouped_insert(self):
+        """Grouping one large bucket scales linearly (grouped_insert)."""
+        self.assertScales(GROUP_CSS, 'terms', 30)
+
+    def test_move_to(self):
+        """Many moves in one pass scale linearly.
+
+        Exercises do_move_to and current_target, which scan the actions.
+        """
+        self.assertScales(MOVE_CSS, 'terms', 30)
+
+    def test_outside(self):
+        """Wrapping many siblings is quadratic today (iterdescendants)."""
+        self.assertScales(OUTSIDE_CSS, 'sections', 25, QUADRATIC)
+
+
+@unittest.skipUnless(TIMING, 'set EASYBAKE_SCALING_TIMING=1 to fit bake times')
+class TimingScalingTestCase(ScalingTestCase):
+    """Check that bake time grows no faster than expected with input size.
+
+    This also covers the work of lxml, cssselect2 and ICU, but the times
+    vary with the load of the machine, so the books are larger and the
+    tests only run on request.
+    """
+
+    measure = staticmethod(bake_time)
+    measured = 'times'
+    tolerance = TIME_TOLERANCE
+    size = TIMING_SIZE
+    check_memory = False
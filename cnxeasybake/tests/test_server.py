@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the bake server."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from lxml import etree
+
+here = os.path.abspath(os.path.dirname(__file__))
+RECIPES = {
+    'counters': os.path.join(here, 'rulesets', 'counters.css'),
+    'index': os.path.join(here, 'rulesets', 'index.css'),
+}
+
+
+def _read(name):
+    with open(os.path.join(here, 'html', name), 'rb') as f:
+        return f.read()
+
+
+def _bake(recipe, html):
+    """Bake directly with a fresh oven, for comparison."""
+    from ..oven import Oven
+    html_doc = etree.XML(html).getroottree()
+    Oven(RECIPES[recipe]).bake(html_doc)
+    return etree.tostring(html_doc, method='xml')
+
+
+class ServerTestCase(unittest.TestCase):
+    """Talk HTTP to a server on a Unix domain socket."""
+
+    @classmethod
+    def setUpClass(cls):
+        from ..server import Baker, make_server
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.socket_path = os.path.join(cls.tmpdir, 'bake.sock')
+        cls.baker = Baker(RECIPES, workers=2,
+                          path_root=os.path.join(here, 'html'))
+        cls.server = make_server(cls.baker, cls.socket_path)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.baker.close()
+        shutil.rmtree(cls.tmpdir)
+
+    def request(self, method, url, body=None):
+        from ..server import UnixHTTPConnection
+        connection = UnixHTTPConnection(self.socket_path, timeout=30)
+        try:
+            connection.request(method, url, body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def test_health(self):
+        status, body = self.request('GET', '/health')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode('utf-8')), {'status': 'ok'})
+
+    def test_recipes(self):
+        status, body = self.request('GET', '/recipes')
+        self.assertEqual(json.loads(body.decode('utf-8')),
+                         {'recipes': ['counters', 'index']})
+
+    def test_bake_body(self):
+        """Posted HTML bakes as it does with a fresh oven, repeatedly."""
+        html = _read('counters_raw.html')
+        for _ in range(3):
+            status, body = self.request('POST', '/bake/counters', html)
+            self.assertEqual(status, 200)
+            self.assertEqual(body, _bake('counters', html))
+
+    def test_bake_path(self):
+        """HTML can be read by the server from a path."""
+        path = os.path.join(here, 'html', 'index_raw.html')
+        status, body = self.request('POST', '/bake/index?path=' + path, b'')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, _bake('index', _read('index_raw.html')))
+        status, body = self.request('POST', '/bake/index?path=index_raw.html',
+                                    b'')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, _bake('index', _read('index_raw.html')))
+
+    def test_bake_path_outside(self):
+        """Paths outside of the path root are refused."""
+        link = os.path.join(here, 'html', 'outside_link.html')
+        os.symlink(RECIPES['index'], link)
+        try:
+            for path in (RECIPES['index'], '../rulesets/index.css',
+                         os.path.join(here, 'html', '..', 'test_server.py'),
+                         link):
+                status, body = self.request(
+                    'POST', '/bake/index?path=' + path, b'')
+                self.assertEqual(status, 403)
+                self.assertIn(b'Path not under', body)
+        finally:
+            os.unlink(link)
+
+    def test_concurrent(self):
+        """Requests from many threads get their own results."""
+        expected = dict((name, _bake(name, _read(name + '_raw.html')))
+                        for name in RECIPES)
+        results = []
+
+        def post(name):
+            results.append((name, self.request(
+                'POST', '/bake/' + name, _read(name + '_raw.html'))))
+
+        threads = [threading.Thread(target=post, args=(name,))
+                   for name in sorted(RECIPES) * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        for name, (status, body) in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(body, expected[name])
+
+    def test_errors(self):
+        """Unknown recipes, urls and unparsable input are reported."""
+        status, _ = self.request('POST', '/bake/missing', b'<html/>')
+        self.assertEqual(status, 404)
+        status, _ = self.request('GET', '/missing')
+        self.assertEqual(status, 404)
+        status, body = self.request('POST', '/bake/counters', b'not html')
+        self.assertEqual(status, 400)
+        self.assertIn(b'Bad input', body)
+
+    def test_stats(self):
+        self.request('POST', '/bake/counters', _read('counters_raw.html'))
+        status, body = self.request('GET', '/stats')
+        stats = json.loads(body.decode('utf-8'))
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertGreaterEqual(stats['recipes']['counters']['bakes'], 1)
+        self.assertGreaterEqual(stats['requests'],
+                                stats['recipes']['counters']['bakes'])
+
+
+class BakerTestCase(unittest.TestCase):
+
+    def test_no_path_root(self):
+        """Without a path root, path requests are refused."""
+        from ..server import Baker
+        baker = Baker(RECIPES, workers=1)
+        try:
+            result = baker.bake('index', path=os.path.join(
+                here, 'html', 'index_raw.html'))
+        finally:
+            baker.close()
+        self.assertEqual(result, {'status': 403,
+                                  'error': u'Path requests are not enabled'})
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for the compact variable store."""
+import unittest
+
+
+class VariableStoreTestCase(unittest.TestCase):
+    """Set, look up and snapshot variables of several passes."""
+
+    def setUp(self):
+        from ..variables import VariableStore
+        self.store = VariableStore()
+        self.first = self.store.variables('0')
+        self.second = self.store.variables('1')
+
+    def test_variables(self):
+        first = self.first
+        first['chapter'] = 1
+        first['figure'] = 2
+        first['chapter'] += 1
+        self.assertIn('chapter', first)
+        self.assertNotIn('exercise', first)
+        self.assertNotIn('figure', self.second)
+        self.assertEqual(first['chapter'], 2)
+        self.assertEqual(first.get('exercise', 0), 0)
+        self.assertRaises(KeyError, lambda: first['exercise'])
+        self.assertEqual(first.items(), [('chapter', 2), ('figure', 2)])
+        self.assertEqual(self.store.names, ['chapter', 'figure'])
+
+    def test_lookup(self):
+        from ..variables import UNSET
+        self.first['chapter'] = 1
+        self.first['figure'] = 1
+        self.store.set_scope(['0'])
+        self.assertEqual(self.store.lookup('figure'), 1)
+        self.store.set_scope(['1', '0'])
+        self.assertEqual(self.store.lookup('figure'), 1)
+        self.second['figure'] = 5
+        self.first['figure'] = 2
+        self.assertEqual(self.store.lookup('figure'), 5)
+        self.assertEqual(self.store.lookup('chapter'), 1)
+        self.assertIs(self.store.lookup('exercise'), UNSET)
+        self.store.set_scope(['0'])
+        self.assertEqual(self.store.lookup('figure'), 2)
+
+    def test_snapshots(self):
+        from ..variables import UNSET
+        self.first['figure'] = 1
+        self.store.snapshot('fig-1', ['0'])
+        self.store.snapshot('fig-2', ['0'])
+        self.first['figure'] = 2
+        self.store.snapshot('fig-3', ['0'])
+        self.assertEqual(self.store.lookup_snapshot('fig-1', 'figure'), 1)
+        self.assertEqual(self.store.lookup_snapshot('fig-3', 'figure'), 2)
+        self.assertIs(self.store.lookup_snapshot('fig-1', 'chapter'), UNSET)
+        self.assertRaises(KeyError, self.store.lookup_snapshot, 'fig-4',
+                          'figure')
+        # Unchanged passes share their values between snapshots
+        snapshots = self.store.snapshots
+        self.assertIs(snapshots['fig-1'][0][1], snapshots['fig-2'][0][1])
+        self.second['figure'] = 7
+        self.store.snapshot('fig-4', ['1', '0'])
+        self.assertIs(snapshots['fig-4'][1][1], snapshots['fig-3'][0][1])
+        self.assertEqual(self.store.lookup_snapshot('fig-4', 'figure'), 7)
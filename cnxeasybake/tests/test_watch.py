@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Tests for baking again when the recipe or html changes."""
+import io
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+logger = logging.getLogger('cnx-easybake')
+
+HTML = (b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        b'<div class="a">A</div></body></html>')
+
+
+class WatcherTestCase(unittest.TestCase):
+    """Poll the recipe and html for changes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.css = self.write('recipe.css', b'div.a::before { content: "1"; }')
+        self.html = self.write('raw.html', HTML)
+        self.out = os.path.join(self.tmpdir, 'baked.html')
+        self.old_level = logger.level
+        logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        logger.setLevel(self.old_level)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def watcher(self, **kwargs):
+        from ..watch import Watcher
+        return Watcher(self.css, self.html, self.out, **kwargs)
+
+    def baked(self):
+        with io.open(self.out, encoding='utf-8') as f:
+            return f.read()
+
+    def test_bake_on_change(self):
+        report = io.StringIO()
+        watcher = self.watcher(report=report)
+        self.assertTrue(watcher.check())
+        self.assertIn(u'<div class="a"><div>1</div>A</div>', self.baked())
+        self.assertFalse(watcher.check())
+
+        with mock.patch.object(watcher, 'load_html') as load_html:
+            self.write('recipe.css', b'div.a::after { content: "22"; }',
+                       mtime=1)
+            self.assertTrue(watcher.check())
+        self.assertFalse(load_html.called)
+        self.assertIn(u'<div class="a">A<div>22</div></div>', self.baked())
+
+        self.write('raw.html', HTML.replace(b'>A<', b'>B<'), mtime=1)
+        self.assertTrue(watcher.check())
+        self.assertIn(u'<div class="a">B<div>22</div></div>', self.baked())
+
+        lines = report.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn(u'baked {}'.format(self.out), lines[0])
+        self.assertIn(u'recipe parsed in', lines[0])
+        self.assertIn(u'html parsed in', lines[0])
+        self.assertNotIn(u'html parsed in', lines[1])
+        self.assertNotIn(u'recipe parsed in', lines[2])
+
+    def test_bad_html(self):
+        watcher = self.watcher()
+        self.write('raw.html', b'<html><body>', mtime=1)
+        self.assertFalse(watcher.check())
+        self.assertFalse(os.path.exists(self.out))
+        self.write('raw.html', HTML, mtime=2)
+        self.assertTrue(watcher.check())
+
+    def test_partition(self):
+        watcher = self.watcher(partition='div.a')
+        self.assertTrue(watcher.check())
+        self.assertIn(u'<div class="a"><div>1</div>A</div>', self.baked())
+        self.write('raw.html', HTML.replace(b'>A<', b'>B<'), mtime=1)
+        self.assertTrue(watcher.check())
+        self.assertIn(u'<div class="a"><div>1</div>B</div>', self.baked())
+
+    def test_parser(self):
+        from ..files import make_parser
+        self.write('raw.html', HTML.replace(b'<div', b' <div'), mtime=1)
+        watcher = self.watcher(parser=make_parser(remove_blank_text=True))
+        self.assertTrue(watcher.check())
+        self.assertIn(u'<body><div class="a"><div>1</div>A</div>',
+                      self.baked())
+
+    def test_cli_parser(self):
+        from ..scripts.main import main
+        from ..files import make_parser
+        with mock.patch('cnxeasybake.watch.Watcher.run') as run, \
+                mock.patch('cnxeasybake.watch.Watcher.__init__',
+                           return_value=None) as init:
+            main(['-q', '--watch', '--huge-tree', '--remove-blank-text',
+                  self.css, self.html, self.out])
+        run.assert_called_once_with()
+        self.assertIs(init.call_args[0][-1], make_parser(True, True))
+
+    def test_run(self):
+        watcher = self.watcher()
+        with mock.patch('time.sleep') as sleep:
+            sleep.side_effect = lambda interval: self.write(
+                'recipe.css', b'div.a::after { content: "2"; }', mtime=1)
+            watcher.run(interval=0.1, bakes=2)
+        sleep.assert_called_once_with(0.1)
+        self.assertIn(u'A<div>2</div>', self.baked())
+
+    def test_cli_needs_files(self):
+        from .test_cli import captured_output
+        from ..scripts.main import main
+        with captured_output() as (out, err):
+            with self.assertRaises(SystemExit):
+                main(['--watch', self.css])
+        self.assertIn('--watch needs html_in and html_out files',
+                      err.getvalue())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Store the counters or the strings of a bake compactly.
+
+Variable names are interned into small integer slots, shared by all the
+passes of a bake. Each pass keeps its values in a list indexed by slot.
+Elements with an id snapshot the values of the passes in scope, for
+``target-counter()`` and ``target-string()``: a snapshot holds one tuple
+of values per pass, and a pass that did not change since the previous
+snapshot shares its tuple with it, so the passes already baked are only
+copied once.
+
+Looking a name up in the passes in scope is one dictionary access: the
+store keeps a flat view of the value each name has in the first pass of
+the scope setting it, updated as the passes set values.
+"""
+
+# The value of a slot not set in a pass
+UNSET = object()
+
+
+class Variables(object):
+    """The variables of one pass, used like a dict of name to value."""
+
+    __slots__ = ('store', 'step', 'values', 'frozen')
+
+    def __init__(self, store, step):
+        """Keep the values of the pass step in the slots of store."""
+        self.store = store
+        self.step = step
+        self.values = []
+        # The values as a tuple, None when changed since the last snapshot
+        self.frozen = ()
+
+    def __contains__(self, name):
+        return self.get(name, UNSET) is not UNSET
+
+    def __getitem__(self, name):
+        value = self.get(name, UNSET)
+        if value is UNSET:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        slot = self.store.slot(name)
+        values = self.values
+        if slot >= len(values):
+            values.extend([UNSET] * (slot + 1 - len(values)))
+        values[slot] = value
+        self.frozen = None
+        self.store.update_view(self.step, name, value)
+
+    def get(self, name, default=None):
+        """Return the value of name, default if not set."""
+        slot = self.store.slots.get(name)
+        if slot is None or slot >= len(self.values):
+            return default
+        value = self.values[slot]
+        return default if value is UNSET else value
+
+    def items(self):
+        """Return the (name, value) pairs set, in the order of the slots."""
+        names = self.store.names
+        return [(names[slot], value) for slot, value in enumerate(self.values)
+                if value is not UNSET]
+
+    def freeze(self):
+        """Return the values as a tuple, the same one while unchanged."""
+        if self.frozen is None:
+            self.frozen = tuple(self.values)
+        return self.frozen
+
+
+class VariableStore(object):
+    """The counters or the strings of all the passes of a bake."""
+
+    def __init__(self):
+        """Start without any variable."""
+        # Interned names: name to slot, and slot to name
+        self.slots = {}
+        self.names = []
+        # The Variables of each pass
+        self.passes = {}
+        # Element id to ((pass, values), ...) of the passes in scope
+        self.snapshots = {}
+        # The passes in scope, by priority, the value of each name in the
+        # first of them setting it and the priority of that pass
+        self.ranks = {}
+        self.view = {}
+        self.view_ranks = {}
+
+    def slot(self, name):
+        """Return the slot of name, interning it if new."""
+        try:
+            return self.slots[name]
+        except KeyError:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+            return slot
+
+    def variables(self, step):
+        """Return the Variables of the pass step, created empty."""
+        variables = self.passes[step] = Variables(self, step)
+        return variables
+
+    def set_scope(self, scope):
+        """Look names up in the passes of scope, the first one first."""
+        self.ranks = dict((step, rank) for rank, step in enumerate(scope))
+        self.view = {}
+        self.view_ranks = {}
+        for step in reversed(scope):
+            for name, value in self.passes[step].items():
+                self.update_view(step, name, value)
+
+    def update_view(self, step, name, value):
+        """Show value of name set by step, unless an earlier pass sets it.
+
+        Earlier means earlier in the scope, the passes baked later.
+        """
+        rank = self.ranks.get(step)
+        if rank is not None and rank <= self.view_ranks.get(name, rank):
+            self.view[name] = value
+            self.view_ranks[name] = rank
+
+    def snapshot(self, element_id, scope):
+        """Record the values of the passes in scope for element_id."""
+        passes = self.passes
+        self.snapshots[element_id] = tuple(
+            (step, passes[step].freeze()) for step in scope)
+
+    def lookup(self, name):
+        """Return the value of name in the first pass in scope setting it.
+
+        Returns UNSET if no pass in scope sets it.
+        """
+        return self.view.get(name, UNSET)
+
+    def lookup_snapshot(self, element_id, name):
+        """Return the value of name when element_id was snapshot.
+
+        Raises KeyError for an element_id without snapshot, returns UNSET
+        if name was not set.
+        """
+        snapshot = self.snapshots[element_id]
+        slot = self.slots.get(name)
+        if slot is not None:
+            for _, values in snapshot:
+                if slot < len(values) and values[slot] is not UNSET:
+                    return values[slot]
+        return UNSET
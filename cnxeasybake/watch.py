@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2016, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Bake again whenever the recipe or the raw HTML file changes.
+
+The files are polled for changes of their modification time or size, which
+works on any filesystem without extra services. The raw HTML is parsed
+once and copied for each bake, it is parsed again only when it changes.
+"""
+from __future__ import print_function
+
+import logging
+import os
+import time
+from copy import deepcopy
+
+from lxml import etree
+
+from .files import read_html, write_bytes
+
+logger = logging.getLogger('cnx-easybake')
+
+
+def stamp(path):
+    """Return what tells that the file at path changed, or None."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class Watcher(object):
+    """Bake html_path with css_path into out_path, whenever they change."""
+
+    def __init__(self, css_path, html_path, out_path, last_step=None,
+                 use_repeatable_ids=False, partition=None, report=None,
+                 close_empty=True, parser=None):
+        """Watch the recipe css_path and the raw HTML html_path.
+
+        With a partition selector, a change of the raw HTML bakes only the
+        partitions that changed, see the incremental module. Timings are
+        printed to the report file, if any. Without close_empty, empty
+        elements are left self-closed. The raw HTML is parsed with parser,
+        see files.make_parser.
+        """
+        self.css_path = css_path
+        self.html_path = html_path
+        self.out_path = out_path
+        self.last_step = last_step
+        self.use_repeatable_ids = use_repeatable_ids
+        self.partition = partition
+        self.report = report
+        self.close_empty = close_empty
+        self.parser = parser
+        self.stamps = {}
+        self.baker = None
+        self.raw = None
+
+    def changed(self):
+        """Return the watched paths that changed since the last call."""
+        paths = []
+        for path in (self.css_path, self.html_path):
+            current = stamp(path)
+            if current != self.stamps.get(path):
+                self.stamps[path] = current
+                paths.append(path)
+        return paths
+
+    def load_css(self):
+        """Parse the recipe."""
+        with open(self.css_path, 'rb') as css_in:
+            css = css_in.read()
+        if self.partition:
+            from .incremental import IncrementalBaker
+            self.baker = IncrementalBaker(css, self.partition,
+                                          self.use_repeatable_ids)
+            self.baker.oven.close_empty = self.close_empty
+        else:
+            from .oven import Oven
+            self.baker = Oven(css, self.use_repeatable_ids,
+                              close_empty=self.close_empty)
+
+    def load_html(self):
+        """Parse the raw HTML."""
+        self.raw = read_html(self.html_path, self.parser)
+
+    def bake(self):
+        """Bake a copy of the raw HTML and write it out."""
+        html_doc = deepcopy(self.raw)
+        self.baker.bake(html_doc, self.last_step)
+        write_bytes(etree.tostring(html_doc, method="xml") + b'\n',
+                    self.out_path)
+
+    def check(self):
+        """Bake if the recipe or the raw HTML changed.
+
+        Returns whether it baked. A recipe or HTML that fails to parse, or
+        to bake, is logged and waits for the next change.
+        """
+        paths = self.changed()
+        if not paths:
+            return False
+        timings = []
+        try:
+            for path, load, what in ((self.css_path, self.load_css, 'recipe'),
+                                     (self.html_path, self.load_html, 'html')):
+                if path in paths:
+                    start = time.time()
+                    load()
+                    timings.append(u'{} parsed in {:.2f}s'.format(
+                        what, time.time() - start))
+            start = time.time()
+            self.bake()
+        except Exception:
+            logger.exception(u'Baking {} failed'.format(self.html_path))
+            return False
+        timings.insert(0, u'baked {} in {:.2f}s'.format(
+            self.out_path, time.time() - start))
+        if self.report is not None:
+            print(u'{} {}'.format(time.strftime('%H:%M:%S'),
+                                  u', '.join(timings)), file=self.report)
+        return True
+
+    def run(self, interval=0.5, bakes=None):
+        """Poll every interval seconds, until baked bakes times if given."""
+        baked = 0
+        while bakes is None or baked < bakes:
+            if self.check():
+                baked += 1
+            else:
+                time.sleep(interval)
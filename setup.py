@@ -45,6 +45,7 @@ setup(
     entry_points={
         'console_scripts': [
             'cnx-easybake = cnxeasybake.scripts.main:main',
+            'cnx-easybake-benchmark = cnxeasybake.benchmarks.run:main',
             ],
         },
    )